@@ -2,26 +2,26 @@ from flask import Flask, request
 from flask_cors import CORS
 from flask_wtf import CSRFProtect
 from flask_migrate import Migrate
-from .utils.mailService import mail
+from .utils.mailService import mail, smtp_pool
+from .utils.emailOutbox import email_sender
+from .utils.emailTemplates import email_renderer
 from config import DevelopmentConfig, ProductionConfig
-import chromadb
-import insightface
 from .graphql import schema
 from .models import db
-from.utils.remScheduler import scheduler, check_reminders
+from.utils.remScheduler import scheduler, check_reminders, schedule_reminders
 from .graphql.auth import jwt, AuthenticatedGraphQLView
+from .utils.faceProvider import face_provider
+from .utils.faceInference import face_inference
+from .utils.faceJobs import registration_jobs
+from .utils.faceCache import recognition_cache
+from .utils.faceMetrics import face_metrics
+from .utils.schedulerLeader import scheduler_leader
+from .utils.schemaUpgrade import upgrade_schema
+import threading
 import os
 
 migration = Migrate()
 csrf = CSRFProtect()
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-face_collection = chroma_client.get_or_create_collection(
-    name="face_embeddings",
-    metadata={"hnsw:space": "cosine"}
-)
-
-face_model = insightface.app.FaceAnalysis(name='buffalo_l')
-face_model.prepare(ctx_id=0)  # set to -1 if using CPU
 
 
 def create_app():
@@ -37,22 +37,63 @@ def create_app():
 
     app.app_context().push()
 
+    if app.config.get('SCHEMA_AUTO_UPGRADE', True):
+        # Before anything queries the new tables/columns (the scheduler, the email senders)
+        upgrade_schema()
+
     csrf.init_app(app)
     jwt.init_app(app)
     mail.init_app(app)
+    smtp_pool.init_app(app)
+    email_renderer.init_app(app)
+    email_sender.init_app(app)
+    face_provider.init_app(app)
+    face_inference.init_app(app)
+    registration_jobs.init_app(app)
+    recognition_cache.init_app(app)
+    face_metrics.init_app(app)
+    if app.config.get('FACE_MODEL_WARMUP'):
+        face_inference.warm_up()
+        if face_inference.workers > 0:
+            # the model lives in the workers; this process only needs the face index
+            threading.Thread(target=face_provider.warm_up, kwargs={'model': False}, daemon=True).start()
 
     scheduler.init_app(app)
-    scheduler.start()
     scheduler.add_job(
         id='check_reminders',
-        func=lambda: check_reminders(app),
+        func=lambda: scheduler_leader.is_leader and check_reminders(app),
         trigger='interval',
         seconds=60  # check every minute
     )
 
+    def lead_scheduler():
+        if scheduler.running:
+            scheduler.resume()
+        else:
+            scheduler.start()
+        # one-off: give reminders without a next_fire_at (e.g. older rows) one
+        scheduler.add_job(id='schedule_reminders', func=lambda: schedule_reminders(app), trigger='date', replace_existing=True)
+        # The outbox senders run in the leader too, instead of polling from every worker
+        email_sender.start()
+
+    def step_down():
+        scheduler.pause()
+        email_sender.stop()
+
+    # Only the elected process runs the scheduler; the rest just serve requests
+    scheduler_leader.init_app(app)
+    scheduler_leader.start(on_elected=lead_scheduler, on_deposed=step_down)
+
     from app.api.user_lookup import lookup
     app.register_blueprint(lookup, url_prefix='/user-lookup')
 
+    from app.api.metrics import metrics
+    app.register_blueprint(metrics)
+
+    from app.cli import face_cli, upgrade_schema_command
+    app.cli.add_command(face_cli)
+    app.cli.add_command(upgrade_schema_command)
+
     app.add_url_rule(
         '/graphql',
         view_func=AuthenticatedGraphQLView.as_view(
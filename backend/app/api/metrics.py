@@ -0,0 +1,14 @@
+from flask import Blueprint, Response
+from ..utils.faceMetrics import face_metrics
+from ..utils.faceInference import face_inference
+from ..utils.faceCache import recognition_cache
+from ..utils.authControl import metrics_access_required
+
+metrics = Blueprint('metrics', __name__)
+
+@metrics.route('/metrics', methods=['GET'])
+@metrics_access_required
+def export_metrics():
+    """Face subsystem latency histograms, inference pool and cache counters (Prometheus text format)"""
+    body = face_metrics.render(face_inference.metric_lines() + recognition_cache.metric_lines())
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -1,23 +1,133 @@
-from flask import Blueprint, request, jsonify, abort
+from flask import Blueprint, request, jsonify, abort, current_app, url_for, make_response
+from functools import wraps
+import hashlib
+import io
+import zipfile
 from flask_jwt_extended import verify_jwt_in_request, get_current_user
 from ..utils.embedding_func import *
-from ..models import SenInfo
+from ..utils.faceProvider import face_provider
+from ..utils.faceInference import face_inference, InferenceQueueFull, InferenceTimeout
+from ..utils.faceJobs import registration_jobs
+from ..utils.faceCache import recognition_cache
+from ..utils.faceMetrics import face_metrics
+from ..utils.authControl import metrics_access_required
+from ..models import SenInfo, FaceRegistrationJob
 
 lookup = Blueprint('lookup', __name__)
 
+def traced(endpoint):
+    """Time the view's stages under `endpoint` in the face metrics, labelled with its HTTP status"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with face_metrics.trace(endpoint) as outcome:
+                response = make_response(view(*args, **kwargs))
+                outcome['status'] = response.status_code
+                return response
+        return wrapper
+    return decorator
+
+def inference_busy_response(err: InferenceQueueFull):
+    """503 telling the client when to retry, so face traffic backs off instead of queueing."""
+    response = jsonify({"error": "Face recognition is busy. Please try again shortly."})
+    return response, 503, {"Retry-After": str(err.retry_after)}
+
+def inference_timeout_response():
+    return jsonify({"error": "Face processing took too long. Please try again."}), 504
+
+# Adjust threshold for better matching - was 0.7, now 0.85
+THRESHOLD = 0.85  # Increased threshold to allow more matches
+
+def score_users(metadatas, distances, threshold=THRESHOLD):
+    """Best similarity (1 - distance) per ez_id among the results within the threshold"""
+    user_scores = {}  # ez_id -> best similarity (1 - distance)
+
+    for metadata, distance in zip(metadatas, distances):
+        if distance > threshold:  # Skip if distance too high
+            continue
+            
+        ez_id = metadata.get('ez_id')
+        similarity = 1 - distance  # Convert distance to similarity
+        
+        if ez_id not in user_scores or similarity > user_scores[ez_id]:
+            user_scores[ez_id] = similarity
+
+    return user_scores
+
+def confidence_level(similarity):
+    return (
+        "Very High" if similarity > 0.90 else
+        "High" if similarity > 0.80 else
+        "Medium" if similarity > 0.65 else
+        "Low"
+    )
+
+def format_matches(user_scores, limit=5):
+    """Top `limit` users sorted by similarity, in the /recognize response format"""
+    # Sort users by similarity
+    top_users = sorted(user_scores.items(), key=lambda x: x[1], reverse=True)[:limit]  # Increased to top 5
+
+    return [{
+        "ezId": ez_id,
+        "similarity": float(similarity),
+        "confidence": confidence_level(similarity),
+        "match_percentage": f"{similarity:.1%}"
+    } for ez_id, similarity in top_users]
+
+def search_pincodes():
+    """Pincodes to scope face search to, or [] for a global search.
+
+    Uses the request's comma-separated 'pincodes' field if given, otherwise the home
+    pincode of the signed-in caller (senior or doctor). Raises ValueError when too many
+    pincodes are requested. Always [] unless FACE_LOCALITY_SEARCH is on.
+    """
+    if not face_provider.locality_search:
+        return []
+
+    requested = request.form.get('pincodes') or request.args.get('pincodes')
+    if requested:
+        pincodes = sorted({p.strip() for p in requested.split(',') if p.strip()})
+        max_pincodes = current_app.config.get('FACE_LOCALITY_MAX_PINCODES', 20)
+        if len(pincodes) > max_pincodes:
+            raise ValueError(f"At most {max_pincodes} pincodes can be searched at once")
+        return pincodes
+
+    try:
+        verify_jwt_in_request(optional=True)
+        user = get_current_user()
+    except Exception:
+        user = None  # recognition doesn't need a login; a bad token just means no home region
+    info = user and (user.sen_info if user.role == 0 else user.doc_info)
+    return [info.pincode] if info and info.pincode else []
+
+def current_senior_user():
+    """(user, error_response) for the JWT in the request; only senior citizens may register"""
+    # Authenticate user using JWT token
+    verify_jwt_in_request()
+    current_user = get_current_user()
+    
+    if not current_user:
+        return None, (jsonify({"error": "Authentication required"}), 401)
+        
+    if current_user.role != 0:
+        return None, (jsonify({"error": "Only senior citizens can register face embeddings"}), 403)
+
+    return current_user, None
+
 @lookup.route('/register', methods=['POST'])
+@traced('register')
 def register():
-    """Register user using video only"""
+    """Register user using video only.
+
+    Stores the upload and queues a background registration job, answering 202 with the job id
+    right away. Poll GET /register/<job_id> for progress. Re-posting the same video while its
+    job is queued or running returns that job; re-posting it after it completed answers 200
+    with that job, unless a newer registration has replaced it since.
+    """
     try:
-        # Authenticate user using JWT token
-        verify_jwt_in_request()
-        current_user = get_current_user()
-        
-        if not current_user:
-            return jsonify({"error": "Authentication required"}), 401
-            
-        if current_user.role != 0:
-            return jsonify({"error": "Only senior citizens can register face embeddings"}), 403
+        current_user, error = current_senior_user()
+        if error:
+            return error
         
         video = request.files.get('video')
         
@@ -29,127 +139,283 @@ def register():
             return jsonify({"error": "No video uploaded"}), 400
 
         try:
-            video_bytes = video.read()
-            frames = extract_frames_from_video(video_bytes, max_frames=15, frame_interval=3)
-            embeddings = extract_embeddings_from_frames(frames)
-            
-            if not embeddings:
-                return jsonify({"error": "No valid faces detected in the video. Please ensure the video contains clear, visible faces"}), 400
-
-            if len(embeddings) < 3:
-                return jsonify({"error": "At least 3 frames with valid faces are required for registration from video"}), 400
+            with face_metrics.stage('upload_read'):
+                video_bytes = video.read()
 
-            # Clear existing embeddings for this ez_id in ChromaDB
-            try:
-                existing_results = face_collection.get(where={"ez_id": senior.ez_id})
-                if existing_results['ids']:
-                    face_collection.delete(ids=existing_results['ids'])
-            except Exception as e:
-                print(f"Error clearing existing embeddings: {e}")
-
-            # Store embeddings in ChromaDB
-            success = store_embeddings_in_chroma(senior.ez_id, embeddings)
-
-            if not success:
-                return jsonify({"error": "Failed to store face embeddings"}), 500
+            with face_metrics.stage('enqueue'):
+                upload_sha256 = hashlib.sha256(video_bytes).hexdigest()
+                job = registration_jobs.find_reusable(senior.ez_id, upload_sha256)
+                if job is None:
+                    job = registration_jobs.create(senior.ez_id, video_bytes, upload_sha256)
 
+            finished = job.status == 'completed'
             return jsonify({
-                "message": f"User registered successfully from video with {len(embeddings)} face embeddings",
-                "ez_id": senior.ez_id,
-                "total_embeddings": len(embeddings),
-                "frames_processed": len(frames)
-            }), 200
+                "message": "This video is already registered" if finished else "Video received. Face registration is in progress",
+                "job_id": job.job_id,
+                "status": job.status,
+                "status_url": url_for('lookup.registration_status', job_id=job.job_id)
+            }), 200 if finished else 202
 
         except Exception as e:
-            print(f"Error processing video {video.filename}: {e}")
+            print(f"Error queueing video {video.filename}: {e}")
             return jsonify({"error": f"Failed to process video!"}), 500
 
     except Exception as e:
         return jsonify({"error": f"Video registration failed! Try Again Later."}), 500
 
+@lookup.route('/register/<job_id>', methods=['GET'])
+def registration_status(job_id):
+    """Stage and progress of a registration job started by the current user"""
+    try:
+        current_user, error = current_senior_user()
+        if error:
+            return error
+
+        job = FaceRegistrationJob.query.get(job_id)
+        if not job or job.ez_id != current_user.ez_id:
+            return jsonify({"error": "Registration job not found"}), 404
+
+        return jsonify(registration_jobs.describe(job)), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Could not fetch registration status! Try Again Later."}), 500
+
+def match_photo(image_bytes, pincodes=()):
+    """(response body, status) for one photo, searching `pincodes` first if given.
+
+    Raises InferenceQueueFull / InferenceTimeout.
+    """
+    emb = face_inference.run(extract_embedding, image_bytes)
+
+    if emb is None:
+        return {"error": "No face detected in the uploaded photo. Please upload a clear image with a visible face"}, 400
+
+    # Search in the face index
+    search_results = search_similar_faces(emb, n_results=face_provider.query_size, pincodes=pincodes)
+    
+    if not search_results or not search_results['metadatas'][0]:
+        return {
+            "error": "No matching user found",
+            "message": "The face in the photo doesn't match any registered users"
+        }, 404
+
+    with face_metrics.stage('postprocess'):
+        user_scores = score_users(search_results['metadatas'][0], search_results['distances'][0])
+        results = format_matches(user_scores)
+
+    if not results:
+        # Provide more detailed feedback about why no matches were found
+        min_distance = float(min(search_results['distances'][0])) if search_results['distances'][0] else 1.0
+        best_similarity = 1 - min_distance
+        
+        return {
+            "error": "No matching user found",
+            "message": "The face in the photo doesn't match any registered users with sufficient confidence",
+            "debug_info": {
+                "min_distance": min_distance,
+                "best_similarity_score": best_similarity,
+                "threshold_used": THRESHOLD,
+                "required_similarity": 1 - THRESHOLD,
+                "total_faces_compared": len(search_results['distances'][0]),
+                "search_scope": search_results['scopes'][0],
+                "suggestion": f"Best match had {best_similarity:.2%} similarity, but {(1-THRESHOLD):.2%} required"
+            }
+        }, 404
+
+    return {
+        "matches": results,
+        "debug_info": {
+            "threshold_used": THRESHOLD,
+            "total_candidates_found": len(user_scores),
+            "total_faces_in_db": len(search_results['distances'][0]) if search_results['distances'][0] else 0,
+            "search_scope": search_results['scopes'][0]
+        }
+    }, 200
+
 @lookup.route('/recognize', methods=['POST'])
+@traced('recognize')
 def recognize():
-    """Recognize user using photo only and return matching ez_id(s)"""
+    """Recognize user using photo only and return matching ez_id(s).
+
+    Results are cached by a perceptual hash of the photo, so a kiosk re-submitting the same
+    (or a near-identical) photo gets the earlier answer without running the face model.
+
+    With FACE_LOCALITY_SEARCH on, faces registered in the caller's home pincode (or the
+    'pincodes' field) are searched first and the whole index only if none match confidently.
+    """
     try:
         file = request.files.get('photo')
         
         if not file or file.filename == '':
             return jsonify({"error": "No photo uploaded"}), 400
-        
+
+        try:
+            pincodes = search_pincodes()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with face_metrics.stage('upload_read'):
+            image_bytes = file.read()
+        with face_metrics.stage('cache_lookup'):
+            photo_key = recognition_cache.photo_hash(image_bytes, scope=','.join(pincodes))
+            cached = recognition_cache.get(photo_key)
+        if cached is not None:
+            body, status = cached
+            return jsonify(body), status, {"X-Recognition-Cache": "HIT"}
+
         # Process image
-        emb = extract_embedding(file.read())
-        if emb is None:
-            return jsonify({"error": "No face detected in the uploaded photo. Please upload a clear image with a visible face"}), 400
+        generation = recognition_cache.generation
+        try:
+            body, status = match_photo(image_bytes, pincodes)
+        except InferenceQueueFull as e:
+            return inference_busy_response(e)
+        except InferenceTimeout:
+            return inference_timeout_response()
 
-        # Search in ChromaDB
-        search_results = search_similar_faces(emb, n_results=50)
+        recognition_cache.put(photo_key, (body, status), generation)
+        return jsonify(body), status, {"X-Recognition-Cache": "MISS"}
         
-        if not search_results or not search_results['metadatas'][0]:
-            return jsonify({
-                "error": "No matching user found",
-                "message": "The face in the photo doesn't match any registered users"
-            }), 404
-
-        # Adjust threshold for better matching - was 0.7, now 0.85
-        THRESHOLD = 0.85  # Increased threshold to allow more matches
-        user_scores = {}  # ez_id -> best similarity (1 - distance)
-
-        for metadata, distance in zip(search_results['metadatas'][0], search_results['distances'][0]):
-            if distance > THRESHOLD:  # Skip if distance too high
-                continue
-                
-            ez_id = metadata.get('ez_id')
-            similarity = 1 - distance  # Convert distance to similarity
-            
-            if ez_id not in user_scores or similarity > user_scores[ez_id]:
-                user_scores[ez_id] = similarity
+    except Exception as e:
+        print(f"Recognition error: {e}")
+        return jsonify({"error": f"Recognition failed! Try Again."}), 500
 
-        # Sort users by similarity
-        top_users = sorted(user_scores.items(), key=lambda x: x[1], reverse=True)[:5]  # Increased to top 5
+@lookup.route('/recognize/cache', methods=['GET'])
+@metrics_access_required
+def recognition_cache_stats():
+    """Hit/miss counters of the /recognize result cache in this worker"""
+    return jsonify(recognition_cache.stats()), 200
 
-        if not top_users:
-            # Provide more detailed feedback about why no matches were found
-            min_distance = float(min(search_results['distances'][0])) if search_results['distances'][0] else 1.0
-            best_similarity = 1 - min_distance
-            
-            return jsonify({
-                "error": "No matching user found",
-                "message": "The face in the photo doesn't match any registered users with sufficient confidence",
-                "debug_info": {
-                    "min_distance": min_distance,
-                    "best_similarity_score": best_similarity,
-                    "threshold_used": THRESHOLD,
-                    "required_similarity": 1 - THRESHOLD,
-                    "total_faces_compared": len(search_results['distances'][0]),
-                    "suggestion": f"Best match had {best_similarity:.2%} similarity, but {(1-THRESHOLD):.2%} required"
+def read_batch_images(max_images, max_image_bytes, max_archive_bytes, max_archive_members):
+    """Collect (filename, bytes) from multipart 'photos' files and/or a zip 'archive'.
+
+    Zip members are checked against the per-photo and total uncompressed limits before
+    anything is inflated; raises ValueError for an archive over the member or size limits.
+    """
+    images = []
+    for file in request.files.getlist('photos'):
+        if file and file.filename:
+            images.append((file.filename, file.read(max_image_bytes + 1)))
+
+    archive = request.files.get('archive')
+    if archive and archive.filename:
+        with zipfile.ZipFile(io.BytesIO(archive.read())) as zf:
+            members = zf.infolist()
+            if len(members) > max_archive_members:
+                raise ValueError(f"The archive may hold at most {max_archive_members} files")
+            inflated = 0
+            for info in members:
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if info.file_size > max_image_bytes:
+                    images.append((info.filename, b''))  # reported as unreadable, never inflated
+                    continue
+                inflated += info.file_size
+                if inflated > max_archive_bytes:
+                    raise ValueError("The archive is too large once uncompressed")
+                with zf.open(info) as member:
+                    # file_size comes from the archive itself; never inflate more than the cap
+                    images.append((info.filename, member.read(max_image_bytes + 1)))
+                if len(images) > max_images:
+                    break
+
+    return images
+
+@lookup.route('/recognize/batch', methods=['POST'])
+@traced('recognize_batch')
+def recognize_batch():
+    """Recognize one person from several photos (multipart 'photos' and/or a zip 'archive').
+
+    All photos go through detection and recognition as one inference job and the face index
+    is queried once with every embedding. Returns matches per photo plus the identity that
+    best fits all photos together.
+    """
+    try:
+        max_images = current_app.config.get('FACE_BATCH_MAX_IMAGES', 10)
+        max_image_bytes = current_app.config.get('FACE_BATCH_MAX_IMAGE_BYTES', 15 * 1024 * 1024)
+        try:
+            with face_metrics.stage('upload_read'):
+                images = read_batch_images(
+                    max_images, max_image_bytes,
+                    max_archive_bytes=current_app.config.get('FACE_BATCH_MAX_ARCHIVE_BYTES', 64 * 1024 * 1024),
+                    max_archive_members=current_app.config.get('FACE_BATCH_MAX_ARCHIVE_MEMBERS', 100)
+                )
+        except zipfile.BadZipFile:
+            return jsonify({"error": "The uploaded archive is not a valid zip file"}), 400
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            pincodes = search_pincodes()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not images:
+            return jsonify({"error": "No photos uploaded"}), 400
+        if len(images) > max_images:
+            return jsonify({"error": f"At most {max_images} photos can be recognized at once"}), 400
+
+        valid = [(i, data) for i, (_, data) in enumerate(images) if 0 < len(data) <= max_image_bytes]
+        try:
+            embeddings = face_inference.run(extract_embeddings_from_images, [data for _, data in valid])
+        except InferenceQueueFull as e:
+            return inference_busy_response(e)
+        except InferenceTimeout:
+            return inference_timeout_response()
+
+        per_image = [None] * len(images)
+        for (i, _), emb in zip(valid, embeddings):
+            per_image[i] = emb
+        with_face = [i for i, emb in enumerate(per_image) if emb is not None]
+        if not with_face:
+            return jsonify({"error": "No face detected in any of the uploaded photos. Please upload clear images with a visible face"}), 400
+
+        # One multi-vector query for every photo with a face
+        search_results = search_faces(
+            [per_image[i] for i in with_face], n_results=face_provider.query_size, pincodes=pincodes
+        )
+
+        with face_metrics.stage('postprocess'):
+            readable = {i for i, _ in valid}
+            results = []
+            fused_scores = {}  # ez_id -> similarities across photos
+            for position, (filename, _) in enumerate(images):
+                if position not in readable:
+                    results.append({"index": position, "filename": filename, "error": "Photo is empty or too large"})
+                    continue
+                if per_image[position] is None:
+                    results.append({"index": position, "filename": filename, "error": "No face detected"})
+                    continue
+                row = with_face.index(position)
+                user_scores = score_users(search_results['metadatas'][row], search_results['distances'][row])
+                for ez_id, similarity in user_scores.items():
+                    fused_scores.setdefault(ez_id, []).append(similarity)
+                results.append({"index": position, "filename": filename, "matches": format_matches(user_scores)})
+
+            # Fuse: mean similarity over every photo with a face (photos without a match count as 0)
+            best_match = None
+            if fused_scores:
+                ez_id, scores = max(fused_scores.items(), key=lambda item: sum(item[1]))
+                similarity = sum(scores) / len(with_face)
+                best_match = {
+                    "ezId": ez_id,
+                    "similarity": float(similarity),
+                    "confidence": confidence_level(similarity),
+                    "match_percentage": f"{similarity:.1%}",
+                    "photos_matched": len(scores)
                 }
-            }), 404
-
-        results = []
-        for ez_id, similarity in top_users:
-            confidence_level = (
-                "Very High" if similarity > 0.90 else
-                "High" if similarity > 0.80 else
-                "Medium" if similarity > 0.65 else
-                "Low"
-            )
-            
-            results.append({
-                "ezId": ez_id,
-                "similarity": float(similarity),
-                "confidence": confidence_level,
-                "match_percentage": f"{similarity:.1%}"
-            })
 
         return jsonify({
-            "matches": results,
+            "results": results,
+            "best_match": best_match,
             "debug_info": {
                 "threshold_used": THRESHOLD,
-                "total_candidates_found": len(user_scores),
-                "total_faces_in_db": len(search_results['distances'][0]) if search_results['distances'][0] else 0
+                "photos_received": len(images),
+                "faces_detected": len(with_face),
+                "total_candidates_found": len(fused_scores),
+                "search_scope": "global" if "global" in search_results['scopes'] else "locality"
             }
-        })
-        
+        }), 200 if best_match else 404
+
     except Exception as e:
-        print(f"Recognition error: {e}")
+        print(f"Batch recognition error: {e}")
         return jsonify({"error": f"Recognition failed! Try Again."}), 500
@@ -0,0 +1,336 @@
+"""
+    Flask CLI commands for maintaining the face index and the database schema.
+
+    Run them from backend/, e.g. `flask --app run face migrate-prototypes`.
+"""
+import csv
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+from .models import SenInfo
+from .utils.faceProvider import face_provider
+from .utils.faceIndex import ChromaFaceIndex
+from .utils.faceInference import FaceInferencePool, InferenceQueueFull
+from .utils.embedding_func import (
+    IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, build_prototypes, embedding_records,
+    extract_enrollment_embeddings, store_embeddings_in_chroma
+)
+from .utils.faceCache import recognition_cache
+from .utils.schemaUpgrade import upgrade_schema
+
+face_cli = AppGroup('face', help='Face recognition index maintenance.')
+
+
+@click.command('upgrade-schema')
+@with_appcontext
+def upgrade_schema_command():
+    """Create missing tables, add missing columns and indexes, and backfill them."""
+    upgrade_schema()
+    click.echo("Schema is up to date")
+
+
+def iter_index_ez_ids(index, page_size=1000):
+    """Yield (id, ez_id) for every embedding in the face index, page by page."""
+    offset = 0
+    while True:
+        page = index.get(limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        for embedding_id, metadata in zip(page['ids'], page['metadatas']):
+            yield embedding_id, (metadata or {}).get('ez_id')
+        offset += len(page['ids'])
+
+
+@face_cli.command('migrate-prototypes')
+@click.option('--dry-run', is_flag=True, help='Only report what would change.')
+def migrate_prototypes(dry_run):
+    """Replace every user's raw frame embeddings with 1-3 prototype centroids.
+
+    This is one-way: the raw embeddings are deleted once the prototypes are stored.
+    """
+    index = face_provider.index
+    ez_ids = sorted({ez_id for _, ez_id in iter_index_ez_ids(index) if ez_id})
+    click.echo(f"{index.count()} embeddings for {len(ez_ids)} users in the {face_provider.index_backend} face index")
+
+    converted = skipped = before = after = 0
+    for ez_id in ez_ids:
+        existing = index.get(where={"ez_id": ez_id}, include_embeddings=True)
+        if all((m or {}).get('kind') == 'prototype' for m in existing['metadatas']):
+            skipped += 1
+            continue
+
+        embeddings = [np.asarray(e, dtype=np.float32) for e in existing['embeddings']]
+        prototypes, _ = build_prototypes(embeddings, max_prototypes=face_provider.prototypes_per_user)
+        before += len(embeddings)
+        after += len(prototypes)
+        if dry_run:
+            converted += 1
+            continue
+
+        # store_embeddings_in_chroma clusters again in prototype mode, so hand it the raw set
+        previous_mode = face_provider.index_mode
+        face_provider.index_mode = 'prototype'
+        try:
+            pincode = next((m.get('pincode') for m in existing['metadatas'] if m and m.get('pincode')), None)
+            stored = store_embeddings_in_chroma(ez_id, embeddings, pincode)
+        finally:
+            face_provider.index_mode = previous_mode
+        if not stored:
+            click.echo(f"  {ez_id}: failed to store prototypes, raw embeddings kept", err=True)
+            continue
+        index.delete(existing['ids'])
+        converted += 1
+
+    if converted and not dry_run:
+        recognition_cache.invalidate()
+
+    verb = "Would convert" if dry_run else "Converted"
+    click.echo(f"{verb} {converted} users ({before} -> {after} embeddings), {skipped} already in prototype form")
+    if not dry_run and face_provider.index_mode != 'prototype':
+        click.echo("Set FACE_INDEX_MODE=prototype so new registrations are stored as prototypes too.")
+
+
+@face_cli.command('rebuild-index')
+@click.option('--m', 'm', type=int, help='HNSW graph degree (default FACE_HNSW_M).')
+@click.option('--construction-ef', type=int, help='HNSW build beam width (default FACE_HNSW_CONSTRUCTION_EF).')
+@click.option('--search-ef', type=int, help='HNSW query beam width (default FACE_HNSW_SEARCH_EF).')
+@click.option('--page-size', type=int, default=1000, show_default=True, help='Embeddings copied per batch.')
+def rebuild_index(m, construction_ef, search_ef, page_size):
+    """Rebuild the ChromaDB face collection with new HNSW parameters.
+
+    Every embedding is copied into a new collection built with the given (or configured)
+    parameters, which then replaces FACE_COLLECTION_NAME. Pause registrations while it runs
+    and restart the web workers afterwards: they hold a handle on the old collection.
+    """
+    if face_provider.index_backend != 'chroma':
+        click.echo("The NumPy face index is searched exactly and has no HNSW parameters; nothing to rebuild.")
+        return
+
+    client = face_provider.client
+    source = face_provider.index
+    metadata = face_provider.hnsw_metadata(m, construction_ef, search_ef)
+    total = source.count()
+    click.echo(f"Rebuilding '{face_provider.collection_name}' ({total} embeddings) with "
+               f"M={metadata['hnsw:M']}, ef_construction={metadata['hnsw:construction_ef']}, "
+               f"ef_search={metadata['hnsw:search_ef']}")
+
+    staging_name = f"{face_provider.collection_name}_rebuild"
+    try:
+        client.delete_collection(staging_name)  # left over from an interrupted rebuild
+    except Exception:
+        pass
+    staging = client.create_collection(name=staging_name, metadata=metadata)
+    target = ChromaFaceIndex(client, staging)
+
+    offset = 0
+    while True:
+        page = source.get(include_embeddings=True, limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        target.add(page['ids'], list(page['embeddings']), page['metadatas'])
+        offset += len(page['ids'])
+        click.echo(f"  copied {offset}/{total}")
+
+    if staging.count() != source.count():
+        client.delete_collection(staging_name)
+        raise click.ClickException("The face index changed while copying; nothing was replaced, run the rebuild again")
+
+    client.delete_collection(face_provider.collection_name)
+    staging.modify(name=face_provider.collection_name)
+    click.echo(f"Rebuilt '{face_provider.collection_name}'. Restart the web workers to pick it up.")
+    if (metadata['hnsw:M'], metadata['hnsw:construction_ef'], metadata['hnsw:search_ef']) != \
+            (face_provider.hnsw_m, face_provider.hnsw_construction_ef, face_provider.hnsw_search_ef):
+        click.echo("Set FACE_HNSW_M / FACE_HNSW_CONSTRUCTION_EF / FACE_HNSW_SEARCH_EF to match, "
+                   "or the workers will override ef_search and warn about M / ef_construction.")
+
+
+@face_cli.command('sync-pincodes')
+@click.option('--dry-run', is_flag=True, help='Only report what would change.')
+@click.option('--page-size', type=int, default=1000, show_default=True, help='Embeddings read per batch.')
+def sync_pincodes(dry_run, page_size):
+    """Copy every senior's home pincode onto their stored face embeddings.
+
+    Needed once for embeddings stored before locality-scoped search (FACE_LOCALITY_SEARCH)
+    existed; safe to re-run at any time.
+    """
+    index = face_provider.index
+    pincodes = dict(SenInfo.query.with_entities(SenInfo.ez_id, SenInfo.pincode))
+    ids, metadatas, users = [], [], set()
+    offset = 0
+    while True:
+        page = index.get(limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        for embedding_id, metadata in zip(page['ids'], page['metadatas']):
+            ez_id = (metadata or {}).get('ez_id')
+            pincode = pincodes.get(ez_id) or None
+            if ez_id and metadata.get('pincode') != pincode:
+                ids.append(embedding_id)
+                metadatas.append({'pincode': pincode})
+                users.add(ez_id)
+        offset += len(page['ids'])
+
+    if not dry_run:
+        for start in range(0, len(ids), page_size):
+            index.update_metadatas(ids[start:start + page_size], metadatas[start:start + page_size])
+        if ids:
+            recognition_cache.invalidate()
+    verb = "Would update" if dry_run else "Updated"
+    click.echo(f"{verb} {len(ids)} embeddings of {len(users)} users")
+
+
+def is_enrollment_media(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)
+
+
+def read_enrollment_source(source):
+    """{ez_id: [media paths]} from a CSV manifest (ez_id,path rows) or a directory.
+
+    A directory holds either one sub-directory per ez_id with that person's videos/photos,
+    or files named after the ez_id (e.g. `ez-sen-42.mp4`).
+    """
+    entries = {}
+    if os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='') as f:
+            for row in csv.DictReader(f):
+                ez_id, path = (row.get('ez_id') or '').strip(), (row.get('path') or '').strip()
+                if ez_id and path:
+                    entries.setdefault(ez_id, []).append(os.path.join(base, path))
+        return entries
+
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if os.path.isdir(path):
+            files = [os.path.join(path, f) for f in sorted(os.listdir(path)) if is_enrollment_media(f)]
+            if files:
+                entries[name] = files
+        elif is_enrollment_media(name):
+            entries.setdefault(os.path.splitext(name)[0], []).append(path)
+    return entries
+
+
+def read_progress_log(path):
+    """Last logged outcome per ez_id from a previous (possibly interrupted) run."""
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of a killed run
+                done[record['ez_id']] = record['status']
+    return done
+
+
+@face_cli.command('enroll-bulk')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--workers', type=int, default=os.cpu_count() or 1, show_default=True, help='Inference processes.')
+@click.option('--batch-size', type=int, default=2000, show_default=True, help='Embeddings per face index write.')
+@click.option('--progress-log', type=click.Path(), help='Resumable JSONL log (default: <source>.enroll-log.jsonl).')
+@click.option('--replace', is_flag=True, help='Replace users that already have embeddings instead of skipping them.')
+@click.option('--retry-failed', is_flag=True, help='Retry users that failed in a previous run.')
+def enroll_bulk(source, workers, batch_size, progress_log, replace, retry_failed):
+    """Enroll many users at once from a directory or a CSV manifest of videos/photos.
+
+    Media is processed in parallel across inference processes and embeddings are written
+    in large batches. Every user's outcome is appended to the progress log once its
+    embeddings are stored; re-running the command skips users already logged.
+    """
+    entries = read_enrollment_source(source)
+    progress_log = progress_log or os.path.abspath(source).rstrip(os.sep) + '.enroll-log.jsonl'
+    logged = read_progress_log(progress_log)
+    skip = {'enrolled'} | ({'skipped'} if not replace else set()) | ({'failed'} if not retry_failed else set())
+    pending = {ez_id: paths for ez_id, paths in entries.items() if logged.get(ez_id) not in skip}
+    click.echo(f"{len(entries)} users in {source}, {len(entries) - len(pending)} already done per {progress_log}")
+
+    index = face_provider.index
+    known = dict(  # ez_id -> home pincode
+        SenInfo.query.with_entities(SenInfo.ez_id, SenInfo.pincode).filter(SenInfo.ez_id.in_(list(pending)))
+    )
+    existing = {}  # ez_id -> ids already in the index
+    for embedding_id, ez_id in iter_index_ez_ids(index):
+        if ez_id in pending:
+            existing.setdefault(ez_id, []).append(embedding_id)
+
+    counts = {'enrolled': 0, 'skipped': 0, 'failed': 0}
+    with open(progress_log, 'a') as log:
+        def record(ez_id, status, **details):
+            log.write(json.dumps({"ez_id": ez_id, "status": status, "at": datetime.utcnow().isoformat(), **details}) + '\n')
+            log.flush()
+            counts[status] += 1
+
+        queue = []
+        for ez_id, paths in pending.items():
+            if ez_id not in known:
+                record(ez_id, 'failed', error="Senior citizen profile not found")
+            elif ez_id in existing and not replace:
+                record(ez_id, 'skipped', error="Already has face embeddings (use --replace)")
+            else:
+                queue.append((ez_id, paths))
+        queue.reverse()  # popped from the end
+
+        buffer = {'ids': [], 'embeddings': [], 'metadatas': [], 'stale': [], 'users': []}
+
+        def flush():
+            if not buffer['ids']:
+                return
+            # New rows first, then the replaced ones, so no user is ever left without embeddings
+            index.add(buffer['ids'], buffer['embeddings'], buffer['metadatas'])
+            index.delete(buffer['stale'])
+            for ez_id, details in buffer['users']:
+                record(ez_id, 'enrolled', **details)
+            for key in buffer:
+                buffer[key] = []
+
+        pool = FaceInferencePool()
+        pool.workers = max(workers, 1)
+        pool.queue_size = pool.workers
+        filter_settings = {key: current_app.config[key] for key in current_app.config if key.startswith('FACE_FRAME_')}
+        running = {}
+        try:
+            while queue or running:
+                while queue:
+                    ez_id, paths = queue[-1]
+                    try:
+                        future = pool.submit(extract_enrollment_embeddings, paths, filter_settings=filter_settings)
+                    except InferenceQueueFull:
+                        break
+                    running[future] = queue.pop()
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    ez_id, paths = running.pop(future)
+                    try:
+                        embeddings, stats = future.result()
+                    except Exception as e:
+                        record(ez_id, 'failed', error=str(e))
+                        continue
+                    minimum = 3 if stats['videos'] else 1  # same bar as /register for videos
+                    if len(embeddings) < minimum:
+                        record(ez_id, 'failed', error=f"Only {len(embeddings)} usable faces found", **stats)
+                        continue
+                    ids, vectors, metadatas = embedding_records(ez_id, embeddings, known[ez_id])
+                    buffer['ids'] += ids
+                    buffer['embeddings'] += vectors
+                    buffer['metadatas'] += metadatas
+                    buffer['stale'] += existing.get(ez_id, [])
+                    buffer['users'].append((ez_id, {"embeddings": len(ids), **stats}))
+                    click.echo(f"  {ez_id}: {len(embeddings)} faces from {len(paths)} files")
+                if len(buffer['ids']) >= batch_size:
+                    flush()
+            flush()
+        finally:
+            pool.shutdown()
+            if counts['enrolled']:
+                recognition_cache.invalidate()
+
+    click.echo(f"Enrolled {counts['enrolled']}, skipped {counts['skipped']}, failed {counts['failed']}. Log: {progress_log}")
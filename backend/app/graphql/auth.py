@@ -1,8 +1,8 @@
 from flask_jwt_extended import create_access_token, get_jwt_identity, JWTManager, verify_jwt_in_request
 from flask import request, current_app
 from ..utils.hash import checkpw, hashpw
-from ..utils.dbUtils import adddb, commitdb, generate_ez_id
-from ..utils.mailService import send_email
+from ..utils.dbUtils import adddb, commitdb, rollbackdb, generate_ez_id
+from ..utils.emailOutbox import queue_email, PRIORITY_LOGIN
 from ..models import User
 import graphene
 from flask_graphql import GraphQLView
@@ -100,22 +100,25 @@ class EZLogin(graphene.Mutation):
                 'current_year': datetime.now().year
             }
             
-            # Send email using the login template
-            send_email(
+            # Send email using the login template, via the email outbox
+            queue_email(
                 subject='🔐 EZCare Login Link - Secure Access to Your Account',
                 recipients=[user.email],  # Always send to user's email regardless of how they were found
                 reminder_display=template_data,
-                template="login_template.html"
+                template="login_template.html",
+                priority=PRIORITY_LOGIN
             )
+            commitdb()
             
             identifier = ez_id if ez_id else email
-            logger.info(f"Login email sent successfully to {user.email} for identifier: {identifier}")
+            logger.info(f"Login email queued for {user.email} for identifier: {identifier}")
             return ReturnType(
                 message=f"Login link sent to {user.email}. Please check your email and click the link to login securely.",
                 status=200
             )
             
         except Exception as e:
+            rollbackdb()
             identifier = ez_id if ez_id else email
             logger.error(f"Failed to send login email for identifier {identifier}: {str(e)}")
             return ReturnType(
@@ -4,7 +4,7 @@ from ..models import EmergencyContacts, db, SenInfo
 from .return_types import ReturnType
 from ..utils.dbUtils import adddb, commitdb, rollbackdb
 from ..utils.authControl import get_senior
-from ..utils.mailService import send_email
+from ..utils.emailOutbox import queue_email, PRIORITY_URGENT
 from datetime import datetime
 
 class EmergencyContactType(SQLAlchemyObjectType):
@@ -127,18 +127,22 @@ class SOS(graphene.Mutation):
         current_year = datetime.now().year
         
         try:
-            send_email(
+            # Sent by the urgent lane of the email outbox, never queued behind reminders
+            queue_email(
                 subject=f"🚨 SOS: {senior.user.name} needs urgent help!",
                 recipients=recipients,
                 reminder_display=reminder_display,
-                template="SOS_template.html"
+                template="SOS_template.html",
+                priority=PRIORITY_URGENT
             )
+            commitdb()
             
             return ReturnType(
-                message=f"SOS alert sent to {len(recipients)} emergency contact(s)", 
+                message=f"SOS alert queued for {len(recipients)} emergency contact(s)", 
                 status=200
             )
         except Exception as e:
+            rollbackdb()
             print(f"Error sending SOS email: {e}")
             return ReturnType(message="Failed to send SOS alert", status=500)
 
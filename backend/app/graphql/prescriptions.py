@@ -6,6 +6,14 @@ from ..utils.dbUtils import adddb, commitdb, rollbackdb, deletedb
 from datetime import datetime, time, timedelta
 from ..utils.authControl import get_senior, get_doctor
 
+def first_reminder_time(time_slots, now):
+    """Start of a medicine reminder: its next slot today, or its first slot tomorrow"""
+    slots = sorted(datetime.strptime(slot, "%H:%M").time() for slot in time_slots)
+    upcoming = [slot for slot in slots if datetime.combine(now.date(), slot) > now]
+    if upcoming:
+        return datetime.combine(now.date(), upcoming[0])
+    return datetime.combine(now.date() + timedelta(days=1), slots[0])
+
 class PrescriptionType(SQLAlchemyObjectType):
     class Meta:
         model = Prescription
@@ -69,16 +77,8 @@ class AddPrescription(graphene.Mutation):
             frequency = time_data.get("frequency", "Daily")
             
             if time_slots:
-                # Create a recurring reminder for the medication
-                first_time = datetime.strptime(time_slots[0], "%H:%M").time()
-                next_reminder = datetime.combine(datetime.now().date(), first_time)
-                
-                # If the time has passed today, schedule for tomorrow
-                if next_reminder <= datetime.now():
-                    next_reminder = datetime.combine(
-                        datetime.now().date() + timedelta(days=1), 
-                        first_time
-                    )
+                # Create a recurring reminder for the medication, starting with today's remaining slots
+                next_reminder = first_reminder_time(time_slots, datetime.now())
 
                 reminder = Reminders(
                     ez_id=senior.ez_id,
@@ -149,14 +149,7 @@ class UpdatePrescription(graphene.Mutation):
                     frequency = time_data.get("frequency", "Daily")
                     
                     if time_slots:
-                        first_time = datetime.strptime(time_slots[0], "%H:%M").time()
-                        next_reminder = datetime.combine(datetime.now().date(), first_time)
-                        
-                        if next_reminder <= datetime.now():
-                            next_reminder = datetime.combine(
-                                datetime.now().date() + timedelta(days=1), 
-                                first_time
-                            )
+                        next_reminder = first_reminder_time(time_slots, datetime.now())
 
                         new_reminder = Reminders(
                             ez_id=prescription.sen_info.ez_id,
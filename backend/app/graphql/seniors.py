@@ -4,6 +4,9 @@ from ..models import User, SenInfo, db
 from .return_types import ReturnType
 from ..utils.dbUtils import adddb, commitdb, rollbackdb
 from ..utils.authControl import get_user, get_senior
+from ..utils.embedding_func import set_identity_pincode
+from ..utils.faceCache import recognition_cache
+from ..utils.faceProvider import face_provider
 
 class SeniorType(SQLAlchemyObjectType):
     class Meta:
@@ -79,6 +82,7 @@ class UpdateSenior(graphene.Mutation):
             senior.medical_info = medical_info
         if address is not None:
             senior.address = address
+        pincode_changed = pincode is not None and pincode != senior.pincode
         if pincode is not None:
             senior.pincode = pincode
         if alternate_phone_num is not None:
@@ -86,11 +90,21 @@ class UpdateSenior(graphene.Mutation):
 
         try: 
             commitdb()
-            return ReturnType(message="Senior updated successfully", status=1)
         except Exception as e:
             rollbackdb()
             print(f"Error updating senior: {e}")
             return ReturnType(message="Something went wrong", status=500)
+
+        if pincode_changed and face_provider.locality_search:
+            # Locality-scoped face search looks registered faces up by their home pincode;
+            # with it off, `flask face sync-pincodes` catches up when it's turned on
+            try:
+                if set_identity_pincode(senior.ez_id, pincode):
+                    recognition_cache.invalidate()
+            except Exception as e:
+                print(f"Error updating face embeddings pincode: {e}")
+
+        return ReturnType(message="Senior updated successfully", status=1)
         
 
 class SeniorsMutation(graphene.ObjectType):
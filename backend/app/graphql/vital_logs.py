@@ -6,7 +6,7 @@ from .return_types import ReturnType
 from ..utils.dbUtils import adddb, commitdb, rollbackdb, deletedb
 from ..utils.authControl import get_senior
 from ..utils.vital_types_data import get_vital_type_by_id
-from ..utils.mailService import send_email
+from ..utils.emailOutbox import queue_email, PRIORITY_URGENT
 from .vital_types import VitalTypeType  # Import instead of redefining
 import logging
 
@@ -132,57 +132,65 @@ def check_numeric_threshold(threshold, reading):
         logger.error(f"Error parsing numeric reading '{reading}': {str(e)}")
         return False
 
-def send_threshold_alert_emails(senior, vital_type_data, reading, logged_at):
-    """Send email alerts to emergency contacts."""
+def queue_threshold_alert_emails(senior, vital_type_data, reading, logged_at):
+    """Queue email alerts to emergency contacts; they are sent once the caller commits.
+
+    Runs in a savepoint: if queueing fails, only the alert is rolled back and the caller's
+    transaction (the vital log) can still commit.
+    """
     try:
-        # Get senior's user info
-        senior_user = User.query.filter_by(ez_id=senior.ez_id).first()
-        if not senior_user:
-            logger.error(f"User not found for senior {senior.sen_id}")
-            return
-        
-        # Get emergency contacts with email alerts enabled
-        emergency_contacts = EmergencyContacts.query.filter_by(
-            sen_id=senior.sen_id,
-            send_alert=True
-        ).all()
-        
-        if not emergency_contacts:
-            logger.info(f"No emergency contacts with email alerts for senior {senior.sen_id}")
-            return
-        
-        # Prepare email data
-        alert_data = {
-            'senior_name': senior_user.name,
-            'senior_ezid': senior.ez_id,
-            'vital_type': vital_type_data['label'],
-            'reading': reading,
-            'unit': vital_type_data['unit'],
-            'threshold': vital_type_data['threshold'],
-            'logged_at': logged_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'alert_type': 'vital_threshold'
-        }
-        
-        # Get recipient emails
-        recipient_emails = [contact.email for contact in emergency_contacts if contact.email]
-        
-        if recipient_emails:
-            subject = f"EZCare Alert: {vital_type_data['label']} Reading Outside Normal Range"
-            
-            # Send email using the existing mail service
-            send_email(
-                subject=subject,
-                recipients=recipient_emails,
-                reminder_display=alert_data,
-                template="vital_alert_template.html"
-            )
-            
-            logger.info(f"Vital threshold alert sent to {len(recipient_emails)} contacts for senior {senior.sen_id}")
-        else:
-            logger.warning(f"No valid email addresses found in emergency contacts for senior {senior.sen_id}")
-            
+        with db.session.begin_nested():
+            _queue_threshold_alert_emails(senior, vital_type_data, reading, logged_at)
     except Exception as e:
-        logger.error(f"Error sending threshold alert emails: {str(e)}")
+        logger.exception(f"Error queueing threshold alert emails for senior {senior.sen_id}: {str(e)}")
+
+def _queue_threshold_alert_emails(senior, vital_type_data, reading, logged_at):
+    # Get senior's user info
+    senior_user = User.query.filter_by(ez_id=senior.ez_id).first()
+    if not senior_user:
+        logger.error(f"User not found for senior {senior.sen_id}")
+        return
+
+    # Get emergency contacts with email alerts enabled
+    emergency_contacts = EmergencyContacts.query.filter_by(
+        sen_id=senior.sen_id,
+        send_alert=True
+    ).all()
+
+    if not emergency_contacts:
+        logger.info(f"No emergency contacts with email alerts for senior {senior.sen_id}")
+        return
+
+    # Prepare email data
+    alert_data = {
+        'senior_name': senior_user.name,
+        'senior_ezid': senior.ez_id,
+        'vital_type': vital_type_data['label'],
+        'reading': reading,
+        'unit': vital_type_data['unit'],
+        'threshold': vital_type_data['threshold'],
+        'logged_at': logged_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'alert_type': 'vital_threshold'
+    }
+
+    # Get recipient emails
+    recipient_emails = [contact.email for contact in emergency_contacts if contact.email]
+
+    if recipient_emails:
+        subject = f"EZCare Alert: {vital_type_data['label']} Reading Outside Normal Range"
+
+        # Urgent lane of the email outbox
+        queue_email(
+            subject=subject,
+            recipients=recipient_emails,
+            reminder_display=alert_data,
+            template="vital_alert_template.html",
+            priority=PRIORITY_URGENT
+        )
+
+        logger.info(f"Vital threshold alert queued for {len(recipient_emails)} contacts for senior {senior.sen_id}")
+    else:
+        logger.warning(f"No valid email addresses found in emergency contacts for senior {senior.sen_id}")
 
 class AddVitalLog(graphene.Mutation):
     class Arguments:
@@ -223,15 +231,17 @@ class AddVitalLog(graphene.Mutation):
         adddb(vital_log)
 
         try:
-            commitdb()
-            
+            # Written before the alert's savepoint, so a failed alert cannot take the log with it
+            db.session.flush()
+
             # Check if vital reading is outside threshold
             is_outside_threshold = check_threshold(vital_type_data, reading)
-            
+
             if is_outside_threshold:
-                # Send email to emergency contacts
-                send_threshold_alert_emails(senior, vital_type_data, reading, logged_at)
-            
+                # Email emergency contacts, committed together with the log
+                queue_threshold_alert_emails(senior, vital_type_data, reading, logged_at)
+
+            commitdb()
             return ReturnType(message="Vital log added successfully", status=201)
         except Exception as e:
             rollbackdb()
@@ -131,6 +131,12 @@ class Reminders(db.Model):
     weekdays = db.Column(db.String(64))  # comma-separated days: 'mon,tue,thu'
     times_per_day = db.Column(db.Integer, default=1)  # for multiple reminders/day
     time_slots = db.Column(db.JSON)  # optional: store ['08:00', '20:00']
+    next_fire_at = db.Column(db.DateTime)  # UTC; maintained by remScheduler, NULL once it will never fire
+
+    __table_args__ = (
+        # check_reminders: WHERE is_active AND next_fire_at <= now
+        db.Index('ix_reminders_active_next_fire_at', 'is_active', 'next_fire_at'),
+    )
 
 class Notification(db.Model):
     __tablename__ = 'notifications'  # Add missing table name
@@ -196,3 +202,51 @@ class Joinee(db.Model):
     grp_id = db.Column(db.Integer, db.ForeignKey('groups.grp_id'), primary_key=True)
     sen_id = db.Column(db.Integer, db.ForeignKey('sen_info.sen_id'), primary_key=True)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class FaceRegistrationJob(db.Model):
+    __tablename__ = 'face_registration_jobs'
+    job_id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    ez_id = db.Column(db.String(32), db.ForeignKey('users.ez_id'), nullable=False, index=True)
+    status = db.Column(db.String(16), default='queued')  # queued, processing, completed, failed
+    stage = db.Column(db.String(32), default='uploaded')  # uploaded, extracting, storing, done
+    upload_path = db.Column(db.String(256))
+    upload_sha256 = db.Column(db.String(64), index=True)  # lets clients retry the same upload safely
+    frames_decoded = db.Column(db.Integer, default=0)
+    faces_found = db.Column(db.Integer, default=0)
+    embeddings_stored = db.Column(db.Integer, default=0)
+    embeddings_kept = db.Column(db.Integer, default=0)  # old embeddings kept because the new video had few usable frames
+    frame_stats = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SchedulerLease(db.Model):
+    __tablename__ = 'scheduler_leases'
+    name = db.Column(db.String(64), primary_key=True)  # one row per singleton job group, e.g. 'reminders'
+    holder = db.Column(db.String(128), nullable=False)  # host:pid:nonce of the process holding it
+    expires_at = db.Column(db.DateTime, nullable=False)  # UTC; anyone may take the lease over after this
+
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    email_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    subject = db.Column(db.String(256), nullable=False)
+    recipients = db.Column(db.JSON, nullable=False)  # list of addresses
+    template = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON)  # reminder_display passed to build_email; cleared once sent or failed for good
+    priority = db.Column(db.Integer, default=5)  # lower is sooner: 0 SOS / vital alerts, 1 login links, 5 reminders
+    status = db.Column(db.String(16), default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)  # retries back off exponentially
+    claimed_by = db.Column(db.String(128))  # sender thread holding a 'sending' row
+    claimed_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # sender claim: WHERE status = 'pending' AND next_attempt_at <= now ORDER BY priority
+        db.Index('ix_email_outbox_claim', 'status', 'priority', 'next_attempt_at'),
+    )
@@ -1,6 +1,7 @@
+import hmac
 from functools import wraps
-from flask_jwt_extended import jwt_required, current_user
-from flask import request, abort
+from flask_jwt_extended import jwt_required, current_user, verify_jwt_in_request, get_current_user
+from flask import request, abort, current_app, jsonify
 from ..models import User, SenInfo, DocInfo  # ✅ Added missing imports
 
 
@@ -60,3 +61,21 @@ def get_mod(info):
     if mod.role != 2:
         raise Exception("UnAuthorised Access! Moderators Only.")
     return mod
+
+
+def metrics_access_required(view):
+    """Monitoring endpoints: `Authorization: Bearer <METRICS_TOKEN>` (scrapers) or a moderator's JWT."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('METRICS_TOKEN')
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return view(*args, **kwargs)
+        try:
+            verify_jwt_in_request()
+            user = get_current_user()
+        except Exception:
+            return jsonify({"error": "Authentication required"}), 401
+        if not user or user.role != 2:
+            return jsonify({"error": "UnAuthorised Access! Moderators Only."}), 403
+        return view(*args, **kwargs)
+    return wrapper
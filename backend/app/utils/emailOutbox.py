@@ -0,0 +1,296 @@
+"""
+    Transactional email outbox and its background sender pool.
+
+    Nothing sends SMTP on a request or scheduler thread. Code that needs to email someone
+    adds an email_outbox row (queue_email / queue_emails) in its own transaction; once that
+    transaction commits, the senders are woken up. A batch of work therefore costs one commit
+    however many emails it produces, and an SMTP stall never adds latency to a request.
+
+    EmailSender runs background threads in two lanes:
+      - urgent: only rows with priority <= PRIORITY_URGENT (SOS, vital alerts), so they are
+        never stuck behind a batch of reminders;
+      - normal: every row, most urgent first.
+    Each thread claims a batch of due rows (status 'sending', claimed_by), sends it over one
+    pooled SMTP connection (mailService.smtp_pool) and records the outcomes with one commit. A failed email is retried
+    with exponential backoff until EMAIL_SENDER_MAX_ATTEMPTS, then marked 'failed'.
+
+    Delivery is at-least-once: rows claimed by a sender that died are handed out again after
+    EMAIL_SENDER_CLAIM_TIMEOUT seconds.
+
+    Only the scheduler leader runs sender threads (create_app starts them when it is elected
+    and stops them when it is deposed), so gunicorn workers and CLI runs do not all poll the
+    outbox. Emails queued in another process are picked up within EMAIL_SENDER_POLL_INTERVAL.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from ..models import db, EmailOutbox
+from .dbUtils import commitdb, rollbackdb
+from .mailService import smtp_pool, build_email
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_URGENT = 0  # SOS and vital alerts: served by the urgent lane
+PRIORITY_LOGIN = 1  # someone is waiting for it
+PRIORITY_REMINDER = 5
+
+_DATETIME_KEY = '$datetime'
+
+
+def encode_payload(payload):
+    """JSON-safe copy of a reminder_display dict (datetimes kept as tagged ISO strings, at any depth)."""
+    if isinstance(payload, datetime):
+        return {_DATETIME_KEY: payload.isoformat()}
+    if isinstance(payload, dict):
+        return {key: encode_payload(value) for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [encode_payload(value) for value in payload]
+    return payload
+
+
+def decode_payload(payload):
+    if isinstance(payload, dict):
+        if _DATETIME_KEY in payload:
+            return datetime.fromisoformat(payload[_DATETIME_KEY])
+        return {key: decode_payload(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [decode_payload(value) for value in payload]
+    return payload
+
+
+def outbox_row(subject, recipients, template="reminders_template.html", reminder_display=None,
+               priority=PRIORITY_REMINDER) -> dict:
+    """Values for one email_outbox row, as build_email would be called with them."""
+    return {
+        "subject": subject,
+        "recipients": list(recipients),
+        "template": template,
+        "payload": encode_payload(reminder_display),
+        "priority": priority,
+        "status": 'pending',
+        "attempts": 0,
+        "next_attempt_at": datetime.utcnow(),
+    }
+
+
+def queue_emails(rows) -> None:
+    """Add outbox rows (see outbox_row) in one bulk INSERT; they go out once the caller commits."""
+    if not rows:
+        return
+    db.session.execute(insert(EmailOutbox), rows)
+    urgent = any(row["priority"] <= PRIORITY_URGENT for row in rows)
+    db.session.info['outbox_queued'] = db.session.info.get('outbox_queued', False) or urgent
+
+
+def queue_email(subject, recipients, template="reminders_template.html", reminder_display=None,
+                priority=PRIORITY_REMINDER) -> None:
+    """Add one email to the outbox; it goes out once the caller commits."""
+    queue_emails([outbox_row(subject, recipients, template, reminder_display, priority)])
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_senders(session):
+    urgent = session.info.pop('outbox_queued', None)
+    if urgent is not None:
+        email_sender.notify(urgent=urgent)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_queued(session):
+    session.info.pop('outbox_queued', None)
+
+
+class EmailSender:
+    """Background threads that drain the email outbox over reused SMTP connections."""
+
+    LANES = ('urgent', 'normal')
+
+    def __init__(self, app=None):
+        self.app = None
+        self.threads = 2
+        self.urgent_threads = 1
+        self.batch_size = 100
+        self.poll_interval = 5
+        self.max_attempts = 6
+        self.retry_base = 30
+        self.retry_max = 3600
+        self.claim_timeout = 300
+        self._wake = {lane: threading.Event() for lane in self.LANES}
+        self._stop = threading.Event()
+        self._workers = []
+        self._stale_checked_at = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.threads = app.config.get('EMAIL_SENDER_THREADS', self.threads)
+        self.urgent_threads = app.config.get('EMAIL_SENDER_URGENT_THREADS', self.urgent_threads)
+        self.batch_size = app.config.get('EMAIL_SENDER_BATCH_SIZE', self.batch_size)
+        self.poll_interval = app.config.get('EMAIL_SENDER_POLL_INTERVAL', self.poll_interval)
+        self.max_attempts = app.config.get('EMAIL_SENDER_MAX_ATTEMPTS', self.max_attempts)
+        self.retry_base = app.config.get('EMAIL_SENDER_RETRY_BASE', self.retry_base)
+        self.retry_max = app.config.get('EMAIL_SENDER_RETRY_MAX', self.retry_max)
+        self.claim_timeout = app.config.get('EMAIL_SENDER_CLAIM_TIMEOUT', self.claim_timeout)
+        app.extensions['email_sender'] = self
+
+    @property
+    def running(self) -> bool:
+        return any(worker.is_alive() for worker in self._workers)
+
+    def start(self):
+        """Start the sender threads (no-op when already running or configured with 0 threads)."""
+        if self.running:
+            return
+        # A fresh event, so threads of an earlier stop() that are still finishing a batch exit
+        self._stop = threading.Event()
+        self._workers = []
+        lanes = ['urgent'] * self.urgent_threads + ['normal'] * self.threads
+        for number, lane in enumerate(lanes):
+            worker = threading.Thread(target=self._run, args=(lane, self._stop),
+                                      name=f'email-sender-{lane}-{number}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """Ask the sender threads to exit after their current batch."""
+        self._stop.set()
+        self._workers = []
+        for event_ in self._wake.values():
+            event_.set()
+
+    def notify(self, urgent=False):
+        """Wake the senders: new rows were committed to the outbox."""
+        if urgent:
+            self._wake['urgent'].set()
+        self._wake['normal'].set()
+
+    def _run(self, lane, stop):
+        holder = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        max_priority = PRIORITY_URGENT if lane == 'urgent' else None
+        while not stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.deliver(max_priority=max_priority, holder=holder)
+            except Exception as e:
+                logger.error(f"Email sender {holder} failed: {e}")
+            self._wake[lane].wait(self.poll_interval)
+            self._wake[lane].clear()
+
+    def backoff(self, attempts) -> timedelta:
+        """Delay before retry number `attempts` (1, 2, ...): retry_base doubling up to retry_max."""
+        return timedelta(seconds=min(self.retry_base * 2 ** (attempts - 1), self.retry_max))
+
+    def deliver(self, max_priority=None, holder=None) -> dict:
+        """Send every due outbox row (optionally only priority <= max_priority), batch by batch.
+
+        Needs an app context. Returns {"sent": n, "failed": n} where failed counts attempts that
+        failed, whether or not they will be retried.
+        """
+        holder = holder or f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        totals = {"sent": 0, "failed": 0}
+        self._release_stale_claims()
+        while not self._stop.is_set():
+            batch = self._claim(holder, max_priority)
+            if not batch:
+                break
+            results = self._send(batch)
+            try:
+                db.session.execute(update(EmailOutbox), results)
+                commitdb()
+            except Exception as e:
+                rollbackdb()
+                logger.error(f"Could not record outbox delivery results: {e}")
+                break  # the rows are handed out again after the claim timeout
+            sent = sum(result["status"] == 'sent' for result in results)
+            totals["sent"] += sent
+            totals["failed"] += len(results) - sent
+            if len(batch) < self.batch_size:
+                break
+        return totals
+
+    def _release_stale_claims(self):
+        now = datetime.utcnow()
+        if self._stale_checked_at and now - self._stale_checked_at < timedelta(seconds=self.claim_timeout):
+            return
+        self._stale_checked_at = now
+        db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.status == 'sending',
+                   EmailOutbox.claimed_at < now - timedelta(seconds=self.claim_timeout))
+            .values(status='pending', claimed_by=None)
+        )
+        commitdb()
+
+    def _claim(self, holder, max_priority):
+        """Atomically mark a batch of due rows as ours and return them, most urgent first."""
+        now = datetime.utcnow()
+        due = select(EmailOutbox.email_id).where(
+            EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now
+        )
+        if max_priority is not None:
+            due = due.where(EmailOutbox.priority <= max_priority)
+        due_ids = db.session.scalars(
+            due.order_by(EmailOutbox.priority, EmailOutbox.email_id).limit(self.batch_size)
+        ).all()
+        if not due_ids:
+            rollbackdb()  # end the read transaction; idle polling never takes a write lock
+            return []
+        # The status check is repeated in the UPDATE so two senders never claim the same row
+        db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.email_id.in_(due_ids), EmailOutbox.status == 'pending')
+            .values(status='sending', claimed_by=holder, claimed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        commitdb()
+        return EmailOutbox.query.filter(EmailOutbox.status == 'sending', EmailOutbox.claimed_by == holder) \
+            .order_by(EmailOutbox.priority, EmailOutbox.email_id).all()
+
+    def _send(self, batch):
+        """Render the batch and send it over one pooled SMTP connection; returns row updates."""
+        errors, rendered = {}, []
+        for email in batch:
+            try:
+                rendered.append((email.email_id, build_email(
+                    subject=email.subject,
+                    recipients=email.recipients,
+                    reminder_display=decode_payload(email.payload),
+                    template=email.template,
+                )))
+            except Exception as e:
+                errors[email.email_id] = e
+        sent = smtp_pool.send_many([message for _, message in rendered])
+        errors.update((email_id, error) for (email_id, _), error in zip(rendered, sent))
+
+        results = []
+        for email in batch:
+            attempts = (email.attempts or 0) + 1
+            error = errors[email.email_id]
+            if error is None:
+                results.append({
+                    "email_id": email.email_id, "status": 'sent', "attempts": attempts,
+                    "sent_at": datetime.utcnow(), "next_attempt_at": email.next_attempt_at,
+                    "payload": None, "error": None, "claimed_by": None,
+                })
+                continue
+            logger.warning(f"Email {email.email_id} attempt {attempts} failed: {error}")
+            retry = attempts < self.max_attempts
+            results.append({
+                "email_id": email.email_id, "status": 'pending' if retry else 'failed', "attempts": attempts,
+                "sent_at": None,
+                "next_attempt_at": datetime.utcnow() + self.backoff(attempts) if retry else email.next_attempt_at,
+                # A given-up email is never rendered again: drop its payload (login links carry tokens)
+                "payload": email.payload if retry else None, "error": str(error), "claimed_by": None,
+            })
+        return results
+
+
+email_sender = EmailSender()
@@ -0,0 +1,103 @@
+"""
+    Precompiled email templates.
+
+    render_template() looks every template up again (and stats the file when auto-reload is on),
+    runs the context processors and fires the template signals for every message. Emails need
+    none of that: EmailRenderer compiles the email templates once at startup and renders the
+    compiled Template objects directly. The static parts of a template (markup, the large <style>
+    blocks) are compiled into constants, so a render only evaluates the per-message variables.
+
+    A reminder tick sends many identical emails (the same group meeting or daily medicine for
+    many seniors), so for templates in CACHED_TEMPLATES the rendered HTML is also kept in a small
+    LRU keyed by the template variables.
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+EMAIL_TEMPLATES = (
+    "reminders_template.html",
+    "reminder_digest_template.html",
+    "SOS_template.html",
+    "vital_alert_template.html",
+    "login_template.html",
+)
+
+# Never login_template.html: its links carry one-time tokens
+CACHED_TEMPLATES = {"reminders_template.html"}
+
+
+def _cache_key_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not part of a cacheable email")
+
+
+class EmailRenderer:
+    """Renders email templates compiled once, with an LRU of rendered reminder emails."""
+
+    def __init__(self, app=None):
+        self.cache_size = 256
+        self._templates = {}
+        self._rendered = OrderedDict()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache_size = app.config.get('EMAIL_RENDER_CACHE_SIZE', self.cache_size)
+        self.clear()
+        app.extensions['email_renderer'] = self
+        with app.app_context():
+            for name in EMAIL_TEMPLATES:
+                try:
+                    self._template(name)
+                except Exception as e:
+                    # Surfaced at startup instead of on every email
+                    logger.error(f"Email template {name} failed to compile: {e}")
+
+    def render(self, name, **context) -> str:
+        """Render an email template; needs an app context the first time `name` is used."""
+        key = None
+        if name in CACHED_TEMPLATES and self.cache_size:
+            try:
+                key = (name, json.dumps(context, sort_keys=True, default=_cache_key_value))
+            except TypeError:
+                pass  # e.g. a model object, which may change between renders
+        if key is None:
+            return self._template(name).render(context)
+
+        with self._lock:
+            html = self._rendered.get(key)
+            if html is not None:
+                self._rendered.move_to_end(key)
+                return html
+        html = self._template(name).render(context)
+        with self._lock:
+            self._rendered[key] = html
+            if len(self._rendered) > self.cache_size:
+                self._rendered.popitem(last=False)
+        return html
+
+    def clear(self):
+        """Forget compiled templates and rendered emails (e.g. after editing a template)."""
+        with self._lock:
+            self._templates.clear()
+            self._rendered.clear()
+
+    def _template(self, name):
+        template = self._templates.get(name)
+        if template is None:
+            template = current_app.jinja_env.get_template(name)
+            self._templates[name] = template
+        return template
+
+
+email_renderer = EmailRenderer()
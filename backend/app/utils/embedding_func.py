@@ -1,74 +1,261 @@
 import numpy as np
 import io
+import json
+import math
 import cv2
 import uuid
 import tempfile
+import shutil
 import os
+from contextlib import contextmanager
+from itertools import islice
 from PIL import Image
 from datetime import datetime
-from app import face_collection, face_model
+from .faceProvider import face_provider
+from .faceMetrics import face_metrics
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.avi', '.mkv', '.webm', '.3gp')
+
+def decode_photo(image_bytes, max_side=None):
+    """Decode photo bytes to an RGB array.
+
+    With `max_side`, JPEGs are decoded in draft mode: libjpeg scales by 1/2, 1/4 or 1/8
+    while decoding, picking the smallest scale that keeps the longer side >= max_side,
+    so a 12 MP phone photo never has all of its pixels decoded.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if max_side:
+        width, height = img.size
+        scale = max_side / max(width, height)
+        if scale < 1:
+            img.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+    return np.array(img.convert("RGB"))
 
 def extract_embedding(image_bytes):
     """Extract face embedding from image bytes"""
-    try:
-        img = np.array(Image.open(io.BytesIO(image_bytes)).convert("RGB"))
-        faces = face_model.get(img)
-        if not faces:
-            return None
-        
-        # Get the largest face if multiple faces detected
-        if len(faces) > 1:
-            face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-        else:
-            face = faces[0]
-            
-        emb = face.embedding
-        emb = emb / np.linalg.norm(emb)  # normalize
-        return emb.astype(np.float32)
-    except Exception as e:
-        print(f"Error extracting embedding: {e}")
-        return None
+    return extract_embeddings_from_images([image_bytes])[0]
+
+def extract_embeddings_from_images(images, batch_size=32):
+    """Extract one face embedding per image (bytes). Returns a list aligned with `images`,
+    with None where no face was found. Recognition runs batched over all images."""
+    rec_model = face_provider.model.models.get('recognition')
+
+    embeddings = [None] * len(images)
+    crops = []
+    positions = []
+    for position, image_bytes in enumerate(images):
+        try:
+            with face_metrics.stage('decode'):
+                img = decode_photo(image_bytes, max_side=face_provider.decode_max_side)
+            if rec_model is None:
+                found = extract_embeddings_per_frame([img])
+                embeddings[position] = found[0] if found else None
+                continue
+            crop = detect_face_crop(img, image_size=rec_model.input_size[0])
+            if crop is not None:
+                crops.append(crop)
+                positions.append(position)
+        except Exception as e:
+            print(f"Error extracting embedding: {e}")
+
+    for position, emb in zip(positions, embed_face_crops(crops, batch_size=batch_size)):
+        embeddings[position] = emb
+    return embeddings
+
+@contextmanager
+def video_source(video):
+    """Yield a path cv2.VideoCapture can open for `video` (a file path, bytes or a readable stream).
+
+    On Linux in-memory data lives in an anonymous memory file (memfd) instead of a temp file on disk.
+    """
+    if isinstance(video, str):
+        yield video
+    elif hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('ezcare-video')
+        try:
+            with open(fd, 'wb', closefd=False) as buffer:
+                if isinstance(video, (bytes, bytearray, memoryview)):
+                    buffer.write(video)
+                else:
+                    shutil.copyfileobj(video, buffer)
+            yield f"/proc/self/fd/{fd}"
+        finally:
+            os.close(fd)
+    else:
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
+            if isinstance(video, (bytes, bytearray, memoryview)):
+                temp_video.write(video)
+            else:
+                shutil.copyfileobj(video, temp_video)
+            temp_video_path = temp_video.name
+        try:
+            yield temp_video_path
+        finally:
+            os.unlink(temp_video_path)  # Clean up temp file
+
+def iter_video_frames(video, frame_interval=5):
+    """Lazily yield every `frame_interval`-th frame of a video as RGB.
+
+    Skipped frames are only grabbed (demuxed/decoded, never retrieved or colour converted),
+    and nothing is decoded past the point where the caller stops iterating.
+    """
+    with video_source(video) as path:
+        cap = cv2.VideoCapture(path)
+        try:
+            frame_count = 0
+            while True:
+                frame = None
+                with face_metrics.stage('frame_extraction'):
+                    if not (cap.isOpened() and cap.grab()):
+                        break
+                    # Extract frame at intervals
+                    if frame_count % frame_interval == 0:
+                        ret, frame = cap.retrieve()
+                        if not ret:
+                            break
+                        # Convert BGR to RGB
+                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    frame_count += 1
+                if frame is not None:
+                    yield frame
+        finally:
+            cap.release()
 
 def extract_frames_from_video(video_bytes, max_frames=10, frame_interval=5):
     """Extract frames from video bytes"""
     try:
-        # Save video to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
-            temp_video.write(video_bytes)
-            temp_video_path = temp_video.name
-        
-        cap = cv2.VideoCapture(temp_video_path)
-        frames = []
-        frame_count = 0
-        
-        while cap.isOpened() and len(frames) < max_frames:
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            # Extract frame at intervals
-            if frame_count % frame_interval == 0:
-                # Convert BGR to RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frames.append(frame_rgb)
-            
-            frame_count += 1
-        
-        cap.release()
-        os.unlink(temp_video_path)  # Clean up temp file
-        
-        return frames
+        return list(islice(iter_video_frames(video_bytes, frame_interval), max_frames))
     except Exception as e:
         print(f"Error extracting frames: {e}")
         return []
 
-def extract_embeddings_from_frames(frames):
-    """Extract face embeddings from multiple frames"""
+def dhash(gray, hash_size=8):
+    """64-bit difference hash of a grayscale image, used to spot near-duplicate frames"""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+class FrameQualityFilter:
+    """Cheap checks run on every sampled frame before it reaches the face model.
+
+    Frames that are too dark/bright, blurred (low Laplacian variance) or near-duplicates
+    (difference-hash within `max_hash_distance` bits of an accepted frame) are rejected.
+    Counts per stage are kept in `stats`.
+    """
+
+    def __init__(self, min_sharpness=60.0, min_brightness=40.0, max_brightness=220.0, max_hash_distance=3):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_hash_distance = max_hash_distance
+        self.accepted_hashes = []
+        self.stats = {
+            "sampled": 0,
+            "too_dark": 0,
+            "too_bright": 0,
+            "blurry": 0,
+            "duplicate": 0,
+            "no_face": 0,
+            "accepted": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            min_sharpness=config.get('FACE_FRAME_MIN_SHARPNESS', 60.0),
+            min_brightness=config.get('FACE_FRAME_MIN_BRIGHTNESS', 40.0),
+            max_brightness=config.get('FACE_FRAME_MAX_BRIGHTNESS', 220.0),
+            max_hash_distance=config.get('FACE_FRAME_DEDUP_DISTANCE', 3),
+        )
+
+    def check(self, frame):
+        """Return True if the RGB frame is worth running the face model on"""
+        self.stats["sampled"] += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+
+        brightness = float(gray.mean())
+        if brightness < self.min_brightness:
+            self.stats["too_dark"] += 1
+            return False
+        if brightness > self.max_brightness:
+            self.stats["too_bright"] += 1
+            return False
+
+        if cv2.Laplacian(gray, cv2.CV_64F).var() < self.min_sharpness:
+            self.stats["blurry"] += 1
+            return False
+
+        frame_hash = dhash(gray)
+        if any((frame_hash ^ h).bit_count() <= self.max_hash_distance for h in self.accepted_hashes):
+            self.stats["duplicate"] += 1
+            return False
+        self.accepted_hashes.append(frame_hash)
+        return True
+
+    def record_face(self, found):
+        self.stats["accepted" if found else "no_face"] += 1
+
+def detect_face_crop(frame, image_size=112):
+    """Detect the largest face in a frame and return its aligned crop for the recognition model
+
+    The detector letterboxes the frame to its input size (det_size) itself and maps the boxes
+    and landmarks back, so the face is cropped from the full frame at full resolution.
+    """
+    from insightface.utils import face_align  # heavy import, only needed once the model is in use
+
+    model = face_provider.model
+    with face_metrics.stage('detection'):
+        bboxes, kpss = model.det_model.detect(frame, max_num=0, metric='default')
+        if bboxes.shape[0] == 0 or kpss is None:
+            return None
+        # Get the largest face
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        largest = int(np.argmax(areas))
+        return face_align.norm_crop(frame, landmark=kpss[largest], image_size=image_size)
+
+def embed_face_crops(crops, batch_size=32):
+    """Run aligned face crops through the recognition model in batched ONNX calls"""
+    if not crops:
+        return []
+    rec_model = face_provider.model.models['recognition']
+    embeddings = []
+    with face_metrics.stage('embedding'):
+        for start in range(0, len(crops), batch_size):
+            feats = rec_model.get_feat(crops[start:start + batch_size])
+            feats = feats / np.linalg.norm(feats, axis=1, keepdims=True)  # normalize
+            embeddings.extend(feats.astype(np.float32))
+    return embeddings
+
+def extract_embeddings_from_frames(frames, batch_size=32):
+    """Extract face embeddings from multiple frames.
+
+    Detection runs per frame, then the aligned face crops of all frames go through the
+    recognition model in batched ONNX calls. Landmark/gender-age models are skipped.
+    """
+    rec_model = face_provider.model.models.get('recognition')
+    if rec_model is None:
+        return extract_embeddings_per_frame(frames)
+
+    crops = []
+    for frame in frames:
+        try:
+            crop = detect_face_crop(frame, image_size=rec_model.input_size[0])
+            if crop is not None:
+                crops.append(crop)
+        except Exception as e:
+            print(f"Error processing frame: {e}")
+            continue
+
+    return embed_face_crops(crops, batch_size=batch_size)
+
+def extract_embeddings_per_frame(frames):
+    """Reference path: full FaceAnalysis inference once per frame (kept for benchmarks)"""
     embeddings = []
     
     for frame in frames:
         try:
-            faces = face_model.get(frame)
+            faces = face_provider.model.get(frame)
             if faces:
                 # Get the largest face
                 face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
@@ -81,48 +268,250 @@ def extract_embeddings_from_frames(frames):
     
     return embeddings
 
-def store_embeddings_in_chroma(ez_id, embeddings):
-    """Store embeddings in ChromaDB with only ez_id"""
+def write_progress(path, **progress):
+    """Atomically write a small JSON progress report, read back by the registration job status endpoint"""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(progress, f)
+    os.replace(path + '.tmp', path)
+
+def extract_embeddings_from_video(video, max_frames=10, frame_interval=5, max_samples=None, frame_filter=None, progress_path=None):
+    """Extract face embeddings from a video. Returns (embeddings, frame_stats).
+
+    Frames are decoded straight from memory and pass the cheap FrameQualityFilter before
+    detection runs on them; decoding stops as soon as `max_frames` faces are found or
+    `max_samples` frames were sampled (default 3 * max_frames). Runs as a single inference
+    job so decoded frames never leave the worker process. With `progress_path`, frames
+    decoded / faces found are reported there as the job runs.
+    """
+    max_samples = max_samples or max_frames * 3
+    frame_filter = frame_filter or FrameQualityFilter()
+    rec_model = face_provider.model.models.get('recognition')
+    image_size = rec_model.input_size[0] if rec_model is not None else 112
+
+    crops = []
     try:
-        embedding_ids = []
-        embedding_metadatas = []
-        
-        for i, emb in enumerate(embeddings):
-            embedding_id = f"{ez_id}_{i}_{uuid.uuid4().hex[:8]}"
-            embedding_ids.append(embedding_id)
-            
-            embedding_metadata = {
-                "ez_id": ez_id,
-                "embedding_index": i,
-                "created_at": datetime.utcnow().isoformat()
-            }
-            
-            embedding_metadatas.append(embedding_metadata)
+        for frame in iter_video_frames(video, frame_interval):
+            with face_metrics.stage('frame_filter'):
+                usable = frame_filter.check(frame)
+            if usable:
+                try:
+                    crop = detect_face_crop(frame, image_size=image_size)
+                except Exception as e:
+                    print(f"Error processing frame: {e}")
+                    crop = None
+                frame_filter.record_face(crop is not None)
+                if crop is not None:
+                    crops.append((frame, crop))
+            if progress_path:
+                write_progress(progress_path, frames_decoded=frame_filter.stats["sampled"], faces_found=len(crops))
+            if len(crops) >= max_frames or frame_filter.stats["sampled"] >= max_samples:
+                break
+    except Exception as e:
+        print(f"Error extracting frames: {e}")
+
+    if rec_model is None:
+        return extract_embeddings_per_frame([frame for frame, _ in crops]), frame_filter.stats
+    return embed_face_crops([crop for _, crop in crops]), frame_filter.stats
+
+def extract_enrollment_embeddings(paths, max_frames=15, frame_interval=3, filter_settings=None):
+    """Embeddings for one person from a mix of video and photo files (bulk enrollment).
+
+    Videos go through the same filtered extraction as /register, photos through the
+    batched photo path. Returns (embeddings, stats) with per-kind counts.
+    """
+    embeddings = []
+    stats = {"videos": 0, "photos": 0, "photos_without_face": 0, "frames_sampled": 0}
+    photos = []
+    for path in paths:
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            frame_filter = FrameQualityFilter.from_config(filter_settings or {})
+            video_embeddings, frame_stats = extract_embeddings_from_video(
+                path, max_frames=max_frames, frame_interval=frame_interval, frame_filter=frame_filter
+            )
+            embeddings.extend(video_embeddings)
+            stats["videos"] += 1
+            stats["frames_sampled"] += frame_stats["sampled"]
+        else:
+            with open(path, 'rb') as f:
+                photos.append(f.read())
+
+    if photos:
+        photo_embeddings = extract_embeddings_from_images(photos)
+        embeddings.extend(emb for emb in photo_embeddings if emb is not None)
+        stats["photos"] = len(photos)
+        stats["photos_without_face"] = sum(emb is None for emb in photo_embeddings)
+    return embeddings, stats
+
+def build_prototypes(embeddings, max_prototypes=3, per_prototype=5, iterations=10):
+    """Cluster a user's registration embeddings into 1..max_prototypes centroids.
+
+    Uses spherical k-means (cosine) with farthest-point initialisation, roughly one
+    prototype per `per_prototype` embeddings. Returns (prototypes, support) where
+    support[i] is the number of embeddings that formed prototype i.
+    """
+    X = np.stack(embeddings).astype(np.float32)
+    X = X / np.linalg.norm(X, axis=1, keepdims=True)
+    k = int(min(max_prototypes, max(1, len(X) // per_prototype)))
+
+    # Deterministic farthest-point init: start from the embedding closest to the mean
+    mean = X.mean(axis=0)
+    centroids = [X[int(np.argmax(X @ mean))]]
+    while len(centroids) < k:
+        sims = np.max(X @ np.stack(centroids).T, axis=1)
+        centroids.append(X[int(np.argmin(sims))])
+    centroids = np.stack(centroids)
+
+    for _ in range(iterations):
+        labels = np.argmax(X @ centroids.T, axis=1)
+        updated = []
+        for c in range(k):
+            members = X[labels == c]
+            if len(members):
+                centroid = members.mean(axis=0)
+                updated.append(centroid / np.linalg.norm(centroid))
+        if len(updated) == len(centroids) and np.allclose(np.stack(updated), centroids, atol=1e-6):
+            break
+        centroids = np.stack(updated)
+        k = len(centroids)
+
+    labels = np.argmax(X @ centroids.T, axis=1)
+    support = [int(np.sum(labels == c)) for c in range(k)]
+    return [c.astype(np.float32) for c in centroids], support
+
+def embedding_records(ez_id, embeddings, pincode=None):
+    """(ids, embeddings, metadatas) to store for a user's registration embeddings
+
+    In prototype mode (FACE_INDEX_MODE = 'prototype') only 1-3 cluster centroids of the
+    embeddings are stored instead of every frame embedding. The senior's home `pincode`
+    is stored with each one for locality-scoped search.
+    """
+    embedding_ids = []
+    embedding_metadatas = []
+
+    support = None
+    if face_provider.index_mode == 'prototype':
+        embeddings, support = build_prototypes(embeddings, max_prototypes=face_provider.prototypes_per_user)
+    
+    for i, emb in enumerate(embeddings):
+        embedding_id = f"{ez_id}_{i}_{uuid.uuid4().hex[:8]}"
+        embedding_ids.append(embedding_id)
         
-        # Convert embeddings to list format for ChromaDB
-        embeddings_list = [emb.tolist() for emb in embeddings]
+        embedding_metadata = {
+            "ez_id": ez_id,
+            "embedding_index": i,
+            "created_at": datetime.utcnow().isoformat()
+        }
+        if pincode:
+            embedding_metadata["pincode"] = pincode
+        if support is not None:
+            embedding_metadata["kind"] = "prototype"
+            embedding_metadata["support"] = support[i]
         
-        face_collection.add(
-            embeddings=embeddings_list,
-            metadatas=embedding_metadatas,
-            ids=embedding_ids
-        )
+        embedding_metadatas.append(embedding_metadata)
+
+    return embedding_ids, list(embeddings), embedding_metadatas
+
+def store_embeddings_in_chroma(ez_id, embeddings, pincode=None):
+    """Store embeddings in the face index (ChromaDB or NumPy backend) with ez_id and pincode"""
+    try:
+        records = embedding_records(ez_id, embeddings, pincode)
+        with face_metrics.stage('index_write'):
+            face_provider.index.add(*records)
         
         return True
     except Exception as e:
         print(f"Error storing embeddings: {e}")
         return False
 
-def search_similar_faces(query_embedding, n_results=10):
-    """Search for similar faces in ChromaDB"""
-    try:
-        results = face_collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=n_results,
-            include=['metadatas', 'distances']
-        )
-        
+def select_kept_embeddings(existing, embeddings, limit, min_similarity=0.5):
+    """Ids of the stored embeddings worth keeping next to a small fresh set.
+
+    Old rows are ranked by cosine similarity to the mean of the fresh embeddings; the best
+    `limit` rows at or above `min_similarity` are kept, so a re-registration with few usable
+    frames tops up rather than thins out the identity without keeping a mismatched face.
+    """
+    if limit <= 0 or not existing['ids']:
+        return []
+    fresh = np.stack(embeddings).astype(np.float32)
+    centre = (fresh / np.linalg.norm(fresh, axis=1, keepdims=True)).mean(axis=0)
+    centre /= np.linalg.norm(centre)
+    old = np.asarray(existing['embeddings'], dtype=np.float32)
+    sims = (old / np.linalg.norm(old, axis=1, keepdims=True)) @ centre
+    ranked = [i for i in np.argsort(-sims) if sims[i] >= min_similarity]
+    return [existing['ids'][i] for i in ranked[:limit]]
+
+def replace_embeddings_in_index(ez_id, embeddings, min_fresh=10, keep_similarity=0.5, pincode=None):
+    """Swap a user's stored embeddings for a new registration in one face index operation.
+
+    When the new video produced fewer than `min_fresh` embeddings, matching old embeddings
+    are kept to make up the difference (in prototype mode: up to the prototype budget).
+    Returns {"stored": n, "kept": n}.
+    """
+    ids, vectors, metadatas = embedding_records(ez_id, embeddings, pincode)
+    keep_ids = []
+    if len(embeddings) < min_fresh:
+        if face_provider.index_mode == 'prototype':
+            limit = face_provider.prototypes_per_user - len(ids)
+        else:
+            limit = min_fresh - len(ids)
+        if limit > 0:
+            existing = face_provider.index.get(where={"ez_id": ez_id}, include_embeddings=True)
+            keep_ids = select_kept_embeddings(existing, embeddings, limit, keep_similarity)
+
+    with face_metrics.stage('index_write'):
+        face_provider.index.replace_identity(ez_id, ids, vectors, metadatas, keep_ids=keep_ids)
+    return {"stored": len(ids), "kept": len(keep_ids)}
+
+def set_identity_pincode(ez_id, pincode):
+    """Point the pincode metadata of all of ez_id's stored embeddings at `pincode`; returns rows changed"""
+    index = face_provider.index
+    existing = index.get(where={"ez_id": ez_id})
+    ids = [embedding_id for embedding_id, metadata in zip(existing['ids'], existing['metadatas'])
+           if (metadata or {}).get("pincode") != (pincode or None)]
+    index.update_metadatas(ids, [{"pincode": pincode or None}] * len(ids))
+    return len(ids)
+
+def pincode_filter(pincodes):
+    """Face index `where` filter matching embeddings of seniors living in any of `pincodes`"""
+    pincodes = list(pincodes)
+    return {"pincode": pincodes[0]} if len(pincodes) == 1 else {"pincode": {"$in": pincodes}}
+
+def search_faces(query_embeddings, n_results=10, pincodes=None, min_similarity=None):
+    """Query the face index, searching only the given pincodes first when there are any.
+
+    Query rows whose best local match is below `min_similarity` (default
+    FACE_LOCALITY_MIN_SIMILARITY) are searched again over the whole index. The result has
+    the usual query layout plus 'scopes': 'locality' or 'global' per query row.
+    """
+    index = face_provider.index
+    if not pincodes:
+        with face_metrics.stage('index_query'):
+            results = dict(index.query(query_embeddings, n_results=n_results))
+        results['scopes'] = ['global'] * len(query_embeddings)
         return results
+
+    if min_similarity is None:
+        min_similarity = face_provider.locality_min_similarity
+    with face_metrics.stage('index_query_locality'):
+        local = index.query(query_embeddings, n_results=n_results, where=pincode_filter(pincodes))
+    results = {key: list(local[key]) for key in ('ids', 'metadatas', 'distances')}
+    results['scopes'] = ['locality'] * len(query_embeddings)
+
+    fallback = [row for row, distances in enumerate(results['distances'])
+                if not distances or 1 - min(distances) < min_similarity]
+    if fallback:
+        with face_metrics.stage('index_query'):
+            wide = index.query([query_embeddings[row] for row in fallback], n_results=n_results)
+        for position, row in enumerate(fallback):
+            for key in ('ids', 'metadatas', 'distances'):
+                results[key][row] = wide[key][position]
+            results['scopes'][row] = 'global'
+    return results
+
+def search_similar_faces(query_embedding, n_results=10, pincodes=None):
+    """Search for similar faces in the face index, within `pincodes` first if given"""
+    try:
+        return search_faces([query_embedding], n_results=n_results, pincodes=pincodes)
     except Exception as e:
         print(f"Error searching faces: {e}")
         return None
@@ -0,0 +1,178 @@
+"""
+    Recognition result cache.
+
+    Kiosks often re-submit the same (or a re-encoded, near-identical) photo within seconds.
+    /user-lookup/recognize looks the photo up here by a 256-bit difference hash of the decoded
+    image before touching the inference pool or the face index.
+
+    Entries are bounded (LRU) and expire after FACE_RECOGNITION_CACHE_TTL seconds. Whenever
+    an identity's embeddings change, invalidate() clears this process's cache and touches a
+    stamp file, so every other web worker drops its cache on its next lookup too.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from .embedding_func import dhash
+
+logger = logging.getLogger(__name__)
+
+
+class RecognitionCache:
+    """Bounded LRU/TTL cache of /recognize responses keyed by perceptual photo hash."""
+
+    HASH_SIZE = 16  # 16x16 difference hash = 256 bits
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_entries = 256
+        self.ttl = 30
+        self.max_distance = 6
+        self.stamp_path = './face_uploads/recognition_cache.stamp'
+        self._entries = OrderedDict()  # photo hash -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._stamp = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('FACE_RECOGNITION_CACHE_ENABLED', self.enabled)
+        self.max_entries = app.config.get('FACE_RECOGNITION_CACHE_SIZE', self.max_entries)
+        self.ttl = app.config.get('FACE_RECOGNITION_CACHE_TTL', self.ttl)
+        self.max_distance = app.config.get('FACE_RECOGNITION_CACHE_MAX_DISTANCE', self.max_distance)
+        self.stamp_path = os.path.abspath(app.config.get('FACE_RECOGNITION_CACHE_STAMP', self.stamp_path))
+        self._stamp = self._read_stamp()
+        app.extensions['face_recognition_cache'] = self
+
+    def photo_hash(self, image_bytes, scope=None):
+        """Perceptual hash of the decoded photo, or None if it can't be decoded.
+
+        A `scope` (e.g. the pincodes a search was limited to) goes into the bits above the
+        photo hash, so the same photo under different scopes never counts as a near match.
+        """
+        if not self.enabled:
+            return None
+        try:
+            img = Image.open(io.BytesIO(image_bytes))
+            img.draft('L', (self.HASH_SIZE * 8, self.HASH_SIZE * 8))  # JPEG: decode at reduced scale
+            key = dhash(np.asarray(img.convert('L')), hash_size=self.HASH_SIZE)
+        except Exception:
+            return None
+        if scope:
+            key |= int.from_bytes(hashlib.blake2b(scope.encode(), digest_size=8).digest(), 'big') << (self.HASH_SIZE ** 2)
+        return key
+
+    def _read_stamp(self):
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _sync_stamp(self):
+        """Drop everything if another process invalidated the cache since we last looked."""
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self.generation += 1
+
+    def get(self, key):
+        """Cached value for this photo hash (or one within max_distance bits), else None."""
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._sync_stamp()
+            entry_key = key if key in self._entries else None
+            if entry_key is None and self.max_distance > 0:
+                best = self.max_distance + 1
+                for candidate in self._entries:
+                    distance = (candidate ^ key).bit_count()
+                    if distance < best:
+                        entry_key, best = candidate, distance
+            if entry_key is not None:
+                stored_at, value = self._entries[entry_key]
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(entry_key)
+                    self.hits += 1
+                    return value
+                del self._entries[entry_key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, generation):
+        """Store a value computed while the cache was at `generation`; dropped if it was invalidated meanwhile."""
+        if key is None:
+            return
+        with self._lock:
+            self._sync_stamp()
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """Forget every cached result, in this process and (through the stamp file) in the others."""
+        with self._lock:
+            self._clear()
+            self.invalidations += 1
+            try:
+                os.makedirs(os.path.dirname(self.stamp_path), exist_ok=True)
+                with open(self.stamp_path, 'a'):
+                    pass
+                os.utime(self.stamp_path)
+                self._stamp = self._read_stamp()
+            except OSError as e:
+                logger.error(f"Could not touch recognition cache stamp {self.stamp_path}: {e}")
+
+    def metric_lines(self):
+        """Cache counters in the Prometheus text format, for /metrics."""
+        stats = self.stats()
+        lines = []
+        for name, kind, doc in (
+            ('hits', 'counter', 'Recognition requests answered from the cache.'),
+            ('misses', 'counter', 'Recognition requests that ran the face model.'),
+            ('evictions', 'counter', 'Cache entries dropped to stay within the size limit.'),
+            ('invalidations', 'counter', 'Times the cache was cleared because embeddings changed.'),
+            ('entries', 'gauge', 'Photos currently cached.'),
+        ):
+            metric = f"face_recognition_cache_{name}" + ('_total' if kind == 'counter' else '')
+            lines += [f"# HELP {metric} {doc}", f"# TYPE {metric} {kind}", f"{metric} {stats[name]}"]
+        return lines
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+recognition_cache = RecognitionCache()
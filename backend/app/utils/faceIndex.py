@@ -0,0 +1,382 @@
+"""
+    Face index backends.
+
+    FaceIndex is the storage interface used by the face endpoints. Two backends:
+      - ChromaFaceIndex: the ChromaDB collection (HNSW, default).
+      - NumpyFaceIndex: a memory-mapped matrix of normalised embeddings (float32, or
+        float16/int8 quantized) searched with matrix-vector products; faster than a
+        Chroma round-trip up to ~100k faces.
+
+    query() returns the ChromaDB result layout ({'ids', 'metadatas', 'distances'}, one
+    list per query vector, cosine distance) whichever backend is used.
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class FaceIndex:
+    """Interface implemented by every face index backend."""
+
+    def add(self, ids, embeddings, metadatas) -> None:
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results=10, where=None) -> dict:
+        raise NotImplementedError
+
+    def get(self, where=None, include_embeddings=False, limit=None, offset=0) -> dict:
+        raise NotImplementedError
+
+    def delete(self, ids) -> None:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def update_metadatas(self, ids, metadatas) -> None:
+        """Merge metadata into existing rows (a None value deletes the key); unknown ids are ignored."""
+        raise NotImplementedError
+
+    def replace_identity(self, ez_id, ids, embeddings, metadatas, keep_ids=()) -> None:
+        """Swap ez_id's stored embeddings for the given ones, keeping the rows in `keep_ids`.
+
+        The new rows are added before the old ones are deleted, so the identity never has
+        zero embeddings in between. Backends that can do better (one atomic write) override it.
+        """
+        keep = set(keep_ids)
+        stale = [i for i in self.get(where={"ez_id": ez_id})['ids'] if i not in keep]
+        self.add(ids, embeddings, metadatas)
+        self.delete(stale)
+
+
+class ChromaFaceIndex(FaceIndex):
+    """FaceIndex backed by a ChromaDB collection."""
+
+    def __init__(self, client, collection):
+        self.client = client
+        self.collection = collection
+
+    def add(self, ids, embeddings, metadatas):
+        batch = self.client.get_max_batch_size()
+        for start in range(0, len(ids), batch):
+            self.collection.add(
+                ids=ids[start:start + batch],
+                embeddings=[np.asarray(e, dtype=np.float32).tolist() for e in embeddings[start:start + batch]],
+                metadatas=metadatas[start:start + batch]
+            )
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        return self.collection.query(
+            query_embeddings=[np.asarray(q, dtype=np.float32).tolist() for q in query_embeddings],
+            n_results=n_results,
+            where=where,
+            include=['metadatas', 'distances']
+        )
+
+    def get(self, where=None, include_embeddings=False, limit=None, offset=0):
+        include = ['metadatas', 'embeddings'] if include_embeddings else ['metadatas']
+        return self.collection.get(where=where, include=include, limit=limit, offset=offset or None)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=list(ids))
+
+    def count(self):
+        return self.collection.count()
+
+    def update_metadatas(self, ids, metadatas):
+        batch = self.client.get_max_batch_size()
+        for start in range(0, len(ids), batch):
+            self.collection.update(ids=list(ids[start:start + batch]), metadatas=metadatas[start:start + batch])
+
+
+def _matches(metadata, where):
+    """Evaluate the subset of Chroma `where` filters the app uses: equality, $in, $and."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(_matches(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            if '$in' in condition and metadata.get(key) not in condition['$in']:
+                return False
+            if '$eq' in condition and metadata.get(key) != condition['$eq']:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class NumpyFaceIndex(FaceIndex):
+    """In-process FaceIndex: `embeddings.npy` (memory-mapped) + `ids.npy` + `metadata.json`.
+
+    `dtype` selects the on-disk/in-memory storage of the embeddings:
+      - float32: exact.
+      - float16: half the footprint.
+      - int8: a quarter of the footprint; each row is scaled so its largest component
+        maps to 127, with the per-row scale kept in `scales.npy`.
+    Similarities are computed block by block straight from the stored vectors, so the
+    full float32 matrix is never materialised.
+
+    Files are rewritten atomically (write to .tmp, os.replace) under an exclusive lock on
+    `.lock`, and every process reloads its mapping when the files change on disk. A reload
+    takes a shared lock on the same file, so it never sees a new matrix with old ids or
+    metadata from a rewrite still in progress in another process.
+
+    add, delete and replace_identity rewrite the whole N x D matrix (O(N) disk writes per
+    call, ~200 MB for a million float32 rows), so batch writes where possible: the bulk
+    enroll and sync commands write once per page, not once per user. Metadata-only updates
+    rewrite metadata.json alone.
+    """
+
+    DTYPES = ('float32', 'float16', 'int8')
+    BLOCK_ROWS = 16384
+
+    def __init__(self, path, dim=512, dtype='float32'):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported face index dtype '{dtype}', expected one of {self.DTYPES}")
+        self.path = path
+        self.dim = dim
+        self.dtype = dtype
+        os.makedirs(path, exist_ok=True)
+        self._matrix_file = os.path.join(path, 'embeddings.npy')
+        self._scales_file = os.path.join(path, 'scales.npy')
+        self._ids_file = os.path.join(path, 'ids.npy')
+        self._meta_file = os.path.join(path, 'metadata.json')
+        self._lock_file = os.path.join(path, '.lock')
+        self._lock = threading.Lock()
+        self._version = None
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._scales = None
+        self._ids = np.zeros((0,), dtype=str)
+        self._metadatas = []
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock, open(self._lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._reload(force=True, locked=True)
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _disk_version(self):
+        try:
+            stat = os.stat(self._meta_file)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _reload(self, force=False, locked=False):
+        """Re-read the files if they changed. `locked`: the caller already holds the file lock."""
+        version = self._disk_version()
+        if version is None or (version == self._version and not force):
+            return
+        if locked:
+            self._load(version)
+            return
+        # Shared lock: wait for a rewrite in another process to finish replacing all the files
+        with open(self._lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            try:
+                self._load(self._disk_version())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, version):
+        with open(self._meta_file) as f:
+            self._metadatas = json.load(f)
+        self._ids = np.load(self._ids_file)
+        self._matrix = np.load(self._matrix_file, mmap_mode='r')
+        self._scales = np.load(self._scales_file) if self._matrix.dtype == np.int8 else None
+        self._version = version
+
+    def _write(self, matrix, scales, ids, metadatas):
+        np.save(self._matrix_file + '.tmp.npy', np.ascontiguousarray(matrix))
+        if scales is not None:
+            np.save(self._scales_file + '.tmp.npy', np.asarray(scales, dtype=np.float32))
+        np.save(self._ids_file + '.tmp.npy', np.asarray(ids, dtype=str))
+        with open(self._meta_file + '.tmp', 'w') as f:
+            json.dump(metadatas, f)
+        os.replace(self._matrix_file + '.tmp.npy', self._matrix_file)
+        if scales is not None:
+            os.replace(self._scales_file + '.tmp.npy', self._scales_file)
+        os.replace(self._ids_file + '.tmp.npy', self._ids_file)
+        # metadata.json is replaced last: its change is what readers use as the version stamp
+        os.replace(self._meta_file + '.tmp', self._meta_file)
+        self._reload(force=True, locked=True)
+
+    @staticmethod
+    def _normalize(embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    def _encode(self, matrix):
+        """float32 rows -> (stored rows, per-row scales or None) in this index's dtype."""
+        if self.dtype == 'int8':
+            scales = np.abs(matrix).max(axis=1)
+            scales[scales == 0] = 1.0
+            return np.round(matrix / scales[:, None] * 127).astype(np.int8), scales.astype(np.float32)
+        return matrix.astype(self.dtype), None
+
+    @staticmethod
+    def _decode(block, scales):
+        """Stored rows -> float32 rows."""
+        if block.dtype == np.int8:
+            return block.astype(np.float32) * (scales / 127)[:, None]
+        return block.astype(np.float32)
+
+    def _similarities(self, matrix, scales, rows, queries):
+        """Cosine similarity of every query against the given stored rows, one block at a time."""
+        sims = np.empty((len(queries), len(rows)), dtype=np.float32)
+        contiguous = len(rows) == len(matrix)
+        for start in range(0, len(rows), self.BLOCK_ROWS):
+            stop = min(start + self.BLOCK_ROWS, len(rows))
+            index = slice(start, stop) if contiguous else rows[start:stop]
+            block = np.asarray(matrix[index])
+            if block.dtype == np.int8:
+                # dot product on the int8 codes, rescaled per row afterwards
+                block_sims = queries @ block.astype(np.float32).T
+                block_sims *= scales[index] / 127
+            else:
+                block_sims = queries @ block.astype(np.float32, copy=False).T
+            sims[:, start:stop] = block_sims
+        return sims
+
+    def add(self, ids, embeddings, metadatas):
+        if not ids:
+            return
+        with self._write_lock():
+            new_rows, new_scales = self._encode(self._normalize(embeddings))
+            if self._matrix.dtype == new_rows.dtype or len(self._ids) == 0:
+                matrix = np.vstack([np.asarray(self._matrix, dtype=new_rows.dtype), new_rows])
+                scales = None if new_scales is None else np.concatenate([
+                    self._scales if self._scales is not None else np.zeros((0,), dtype=np.float32), new_scales
+                ])
+            else:
+                # FACE_INDEX_DTYPE changed since the index was written: re-encode everything
+                matrix, scales = self._encode(np.vstack([self._decode(np.asarray(self._matrix), self._scales), self._normalize(embeddings)]))
+            self._write(
+                matrix,
+                scales,
+                np.concatenate([self._ids, np.asarray(ids, dtype=str)]),
+                self._metadatas + [dict(m) for m in metadatas],
+            )
+
+    def _mask(self, where):
+        if not where:
+            return None
+        return np.fromiter((_matches(m, where) for m in self._metadatas), dtype=bool, count=len(self._metadatas))
+
+    def query(self, query_embeddings, n_results=10, where=None):
+        with self._lock:
+            self._reload()
+            matrix, scales, ids, metadatas = self._matrix, self._scales, self._ids, self._metadatas
+        mask = self._mask(where)
+        rows = np.arange(len(ids)) if mask is None else np.flatnonzero(mask)
+
+        results = {'ids': [], 'metadatas': [], 'distances': []}
+        queries = self._normalize(query_embeddings)
+        if len(rows) == 0:
+            for _ in queries:
+                results['ids'].append([])
+                results['metadatas'].append([])
+                results['distances'].append([])
+            return results
+
+        sims = self._similarities(matrix, scales, rows, queries)  # (queries, candidates)
+        k = min(n_results, len(rows))
+        for row_sims in sims:
+            top = np.argpartition(-row_sims, k - 1)[:k] if k < len(row_sims) else np.arange(len(row_sims))
+            top = top[np.argsort(-row_sims[top])]
+            results['ids'].append([str(ids[rows[i]]) for i in top])
+            results['metadatas'].append([metadatas[rows[i]] for i in top])
+            results['distances'].append([float(1.0 - row_sims[i]) for i in top])
+        return results
+
+    def get(self, where=None, include_embeddings=False, limit=None, offset=0):
+        with self._lock:
+            self._reload()
+            matrix, scales, ids, metadatas = self._matrix, self._scales, self._ids, self._metadatas
+        mask = self._mask(where)
+        rows = np.arange(len(ids)) if mask is None else np.flatnonzero(mask)
+        rows = rows[offset:offset + limit if limit else None]
+        result = {
+            'ids': [str(ids[i]) for i in rows],
+            'metadatas': [metadatas[i] for i in rows],
+        }
+        if include_embeddings:
+            result['embeddings'] = self._decode(np.asarray(matrix[rows]), scales[rows] if scales is not None else None)
+        return result
+
+    def delete(self, ids):
+        if not ids:
+            return
+        with self._write_lock():
+            keep = ~np.isin(self._ids, np.asarray(list(ids), dtype=str))
+            self._write(
+                np.asarray(self._matrix[keep]),
+                self._scales[keep] if self._scales is not None else None,
+                self._ids[keep],
+                [m for m, k in zip(self._metadatas, keep) if k],
+            )
+
+    def update_metadatas(self, ids, metadatas):
+        if not ids:
+            return
+        updates = dict(zip(ids, metadatas))
+
+        def merged(metadata, update):
+            return {key: value for key, value in {**metadata, **update}.items() if value is not None}
+
+        with self._write_lock():
+            if not len(self._ids):
+                return
+            # The embeddings are unchanged, so only metadata.json (the version stamp) is rewritten
+            with open(self._meta_file + '.tmp', 'w') as f:
+                json.dump([merged(m, updates[i]) if i in updates else m for i, m in zip(self._ids, self._metadatas)], f)
+            os.replace(self._meta_file + '.tmp', self._meta_file)
+            self._reload(force=True, locked=True)
+
+    def replace_identity(self, ez_id, ids, embeddings, metadatas, keep_ids=()):
+        """Single atomic rewrite: readers see either the old or the new set, never neither."""
+        keep_ids = set(keep_ids)
+        with self._write_lock():
+            keep = np.fromiter(
+                (m.get('ez_id') != ez_id or i in keep_ids for i, m in zip(self._ids, self._metadatas)),
+                dtype=bool, count=len(self._ids)
+            )
+            matrix = np.asarray(self._matrix[keep])
+            scales = self._scales[keep] if self._scales is not None else None
+            if ids:
+                new_rows, new_scales = self._encode(self._normalize(embeddings))
+                if len(matrix) and matrix.dtype != new_rows.dtype:
+                    # FACE_INDEX_DTYPE changed since the index was written: re-encode the kept rows
+                    matrix, scales = self._encode(self._decode(matrix, scales))
+                matrix = np.vstack([matrix.astype(new_rows.dtype, copy=False), new_rows])
+                scales = None if new_scales is None else np.concatenate([
+                    scales if scales is not None else np.zeros((0,), dtype=np.float32), new_scales
+                ])
+            self._write(
+                matrix,
+                scales,
+                np.concatenate([self._ids[keep], np.asarray(ids, dtype=str)]),
+                [m for m, k in zip(self._metadatas, keep) if k] + [dict(m) for m in metadatas],
+            )
+
+    def count(self):
+        with self._lock:
+            self._reload()
+            return len(self._ids)
+
+    def nbytes(self) -> int:
+        """Bytes used by the stored embedding matrix (and int8 scales)."""
+        with self._lock:
+            self._reload()
+            return self._matrix.nbytes + (self._scales.nbytes if self._scales is not None else 0)
@@ -0,0 +1,213 @@
+"""
+    Face inference worker pool.
+
+    Face detection/recognition jobs are submitted here instead of running inside the
+    Flask request thread. Each worker process owns its own copy of the face model.
+    The number of jobs in flight is bounded: when the pool is full, submit() raises
+    InferenceQueueFull so the caller can answer 503 instead of piling up requests.
+    If a worker process dies (OOM kill, a crash in onnxruntime) the pool is broken for good;
+    it is then thrown away and a new one is started by the next job.
+"""
+import atexit
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from .faceMetrics import face_metrics
+from .faceProvider import face_provider
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference pool cannot accept another job."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Face inference queue is full")
+        self.retry_after = retry_after
+
+
+class InferenceTimeout(Exception):
+    """Raised when a job does not finish within the configured timeout."""
+
+
+def _init_worker(model_settings: dict, warm_up: bool = False) -> None:
+    """Runs once in every worker process before it accepts jobs."""
+    face_provider.configure(**model_settings)
+    if warm_up:
+        face_provider.warm_up(index=False)  # workers only run the model
+
+
+def _ready() -> bool:
+    return True
+
+
+def _traced(submitted_at, fn, *args, **kwargs):
+    """Runs in the worker: fn's result plus the stage timings recorded while it ran."""
+    return face_metrics.traced_call(submitted_at, fn, *args, **kwargs)
+
+
+class FaceInferencePool:
+    """Bounded pool of face inference workers shared by one web process."""
+
+    def __init__(self, app=None):
+        self.workers = 1
+        self.queue_size = 4
+        self.timeout = 60
+        self.retry_after = 5
+        self.warm_up_workers = False
+        self.rejected = 0
+        self.timed_out = 0
+        self.restarts = 0
+        self._executor = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config.get('FACE_INFERENCE_WORKERS', self.workers)
+        self.queue_size = app.config.get('FACE_INFERENCE_QUEUE_SIZE', self.queue_size)
+        self.timeout = app.config.get('FACE_INFERENCE_TIMEOUT', self.timeout)
+        self.retry_after = app.config.get('FACE_INFERENCE_RETRY_AFTER', self.retry_after)
+        self.warm_up_workers = app.config.get('FACE_MODEL_WARMUP', self.warm_up_workers)
+        app.extensions['face_inference'] = self
+
+    @property
+    def capacity(self) -> int:
+        """Jobs that may be running or waiting at the same time."""
+        return max(self.workers, 1) + self.queue_size
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.workers > 0:
+                        # spawn, not fork: the web process has live threads and DB connections
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context('spawn'),
+                            initializer=_init_worker,
+                            initargs=(face_provider.model_settings, self.warm_up_workers)
+                        )
+                    else:
+                        # FACE_INFERENCE_WORKERS = 0 keeps the model in this process (development)
+                        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='face-inference')
+                    if not self.restarts:
+                        atexit.register(self.shutdown)
+                    logger.info(f"Face inference pool started with {self.workers} worker(s), capacity {self.capacity}")
+        return self._executor
+
+    def _discard_executor(self, executor):
+        """Throw away a broken pool; the next job starts a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return  # another thread already replaced it
+            self._executor = None
+            self.restarts += 1
+        logger.error("Face inference worker died; restarting the pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release_slot(self):
+        with self._count_lock:
+            self._in_flight -= 1
+
+    def _job_done(self, future, executor):
+        self._release_slot()
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            # The worker running this job died; later jobs get a new pool
+            self._discard_executor(executor)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) on the pool. Raises InferenceQueueFull when at capacity."""
+        with self._count_lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                raise InferenceQueueFull(self.retry_after)
+            self._in_flight += 1
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # A worker died since the last job: start a new pool and try once more
+                self._discard_executor(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release_slot()
+            raise
+        # The slot is freed only when the job really finishes, even if the caller timed out
+        future.add_done_callback(lambda done: self._job_done(done, executor))
+        return future
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Submit a job and wait for its result, raising InferenceTimeout after `timeout` seconds.
+
+        Stage timings recorded by the job (and its wait in the queue) are added to the caller's trace.
+        """
+        future = self.submit(_traced, time.time(), fn, *args, **kwargs)
+        try:
+            result, stages = future.result(timeout=timeout or self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            self.timed_out += 1
+            raise InferenceTimeout(f"Face inference did not finish within {timeout or self.timeout}s")
+        for name, seconds in stages.items():
+            face_metrics.record(name, seconds)
+        return result
+
+    @property
+    def in_flight(self) -> int:
+        """Jobs currently running or waiting in the pool."""
+        with self._count_lock:
+            return self._in_flight
+
+    def metric_lines(self):
+        """Pool gauges and counters in the Prometheus text format, for /metrics."""
+        return [
+            "# HELP face_inference_capacity Face inference jobs that may run or wait at once.",
+            "# TYPE face_inference_capacity gauge",
+            f"face_inference_capacity {self.capacity}",
+            "# HELP face_inference_in_flight Face inference jobs running or waiting.",
+            "# TYPE face_inference_in_flight gauge",
+            f"face_inference_in_flight {self.in_flight}",
+            "# HELP face_inference_rejected_total Jobs refused with 503 because the pool was full.",
+            "# TYPE face_inference_rejected_total counter",
+            f"face_inference_rejected_total {self.rejected}",
+            "# HELP face_inference_timeouts_total Jobs the caller stopped waiting for.",
+            "# TYPE face_inference_timeouts_total counter",
+            f"face_inference_timeouts_total {self.timed_out}",
+            "# HELP face_inference_restarts_total Pools replaced because a worker process died.",
+            "# TYPE face_inference_restarts_total counter",
+            f"face_inference_restarts_total {self.restarts}",
+        ]
+
+    def warm_up(self) -> None:
+        """Start the workers now so they load the model before the first face request arrives.
+
+        Each worker process warms itself up in its initializer; one trivial job per worker
+        makes the pool spawn all of them. Returns without waiting for them.
+        """
+        try:
+            if self.workers > 0:
+                for _ in range(self.workers):
+                    self.submit(_ready)
+            else:
+                self.submit(face_provider.warm_up)
+        except InferenceQueueFull:
+            pass
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+face_inference = FaceInferencePool()
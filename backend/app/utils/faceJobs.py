@@ -0,0 +1,220 @@
+"""
+    Background face registration jobs.
+
+    POST /user-lookup/register only stores the upload and a FaceRegistrationJob row; the
+    video is processed here on a small thread pool (which hands the heavy work to the
+    face inference pool), so request threads are never held by slow uploads or inference.
+    Job state lives in the database so any web worker can answer status polls.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from ..models import FaceRegistrationJob, SenInfo
+from .dbUtils import adddb, commitdb, rollbackdb
+from .embedding_func import FrameQualityFilter, extract_embeddings_from_video, replace_embeddings_in_index
+from .faceCache import recognition_cache
+from .faceInference import face_inference, InferenceQueueFull, InferenceTimeout
+from .faceMetrics import face_metrics
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'processing')
+MIN_EMBEDDINGS = 3
+
+
+class RegistrationJobRunner:
+    """Runs FaceRegistrationJob rows in background threads of the web process."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.upload_folder = './face_uploads'
+        self.threads = 2
+        self.stale_after = timedelta(minutes=10)
+        self.max_busy_retries = 12
+        self.min_fresh = 10
+        self.keep_similarity = 0.5
+        self._executor = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.upload_folder = os.path.abspath(app.config.get('FACE_JOB_UPLOAD_FOLDER', self.upload_folder))
+        self.threads = app.config.get('FACE_JOB_THREADS', self.threads)
+        self.stale_after = timedelta(seconds=app.config.get('FACE_JOB_STALE_SECONDS', 600))
+        self.min_fresh = app.config.get('FACE_REGISTRATION_MIN_FRESH', self.min_fresh)
+        self.keep_similarity = app.config.get('FACE_REGISTRATION_KEEP_SIMILARITY', self.keep_similarity)
+        app.extensions['face_jobs'] = self
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='face-registration')
+        return self._executor
+
+    def progress_path(self, job_id):
+        return os.path.join(self.upload_folder, f"{job_id}.progress.json")
+
+    def find_reusable(self, ez_id, upload_sha256):
+        """The job a client retry of the same upload should get back instead of starting over.
+
+        That is a queued or running job, or a completed one that is still the senior's latest
+        registration. A completed job that a newer registration superseded is not reused: the
+        embeddings it stored have been replaced, so the video is registered again.
+        """
+        job = FaceRegistrationJob.query.filter(
+            FaceRegistrationJob.ez_id == ez_id,
+            FaceRegistrationJob.upload_sha256 == upload_sha256,
+            FaceRegistrationJob.status != 'failed'
+        ).order_by(FaceRegistrationJob.created_at.desc()).first()
+        if job is None:
+            return None
+        if job.status in ACTIVE_STATUSES:
+            if job.updated_at < datetime.utcnow() - self.stale_after:
+                # The process running it most likely died; let the retry start a fresh job
+                job.status = 'failed'
+                job.error = "Job stalled, please retry"
+                commitdb()
+                return None
+            return job
+        latest = FaceRegistrationJob.query.filter(
+            FaceRegistrationJob.ez_id == ez_id,
+            FaceRegistrationJob.status != 'failed'
+        ).order_by(FaceRegistrationJob.created_at.desc()).first()
+        return job if latest.job_id == job.job_id else None
+
+    def create(self, ez_id, upload, upload_sha256):
+        """Store the upload, create the job row and queue it. Returns the job."""
+        os.makedirs(self.upload_folder, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        upload_path = os.path.join(self.upload_folder, f"{job_id}.video")
+        with open(upload_path, 'wb') as f:
+            f.write(upload)
+
+        job = FaceRegistrationJob(
+            job_id=job_id,
+            ez_id=ez_id,
+            status='queued',
+            stage='uploaded',
+            upload_path=upload_path,
+            upload_sha256=upload_sha256
+        )
+        try:
+            adddb(job)
+            commitdb()
+        except Exception:
+            rollbackdb()
+            os.unlink(upload_path)
+            raise
+
+        self._get_executor().submit(self._run, job_id)
+        return job
+
+    def describe(self, job):
+        """Job state for the status endpoint, with live progress while it is running."""
+        progress = {
+            "frames_decoded": job.frames_decoded or 0,
+            "faces_found": job.faces_found or 0,
+            "embeddings_stored": job.embeddings_stored or 0,
+            "embeddings_kept": job.embeddings_kept or 0,
+        }
+        if job.status == 'processing':
+            try:
+                with open(self.progress_path(job.job_id)) as f:
+                    progress.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+        return {
+            "job_id": job.job_id,
+            "ez_id": job.ez_id,
+            "status": job.status,
+            "stage": job.stage,
+            "progress": progress,
+            "frame_stats": job.frame_stats,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        }
+
+    def _update(self, job, **fields):
+        for key, value in fields.items():
+            setattr(job, key, value)
+        commitdb()
+
+    def _extract(self, job):
+        """Run the video through the inference pool, waiting politely while it is saturated."""
+        frame_filter = FrameQualityFilter.from_config(self.app.config)
+        for attempt in range(self.max_busy_retries + 1):
+            try:
+                return face_inference.run(
+                    extract_embeddings_from_video, job.upload_path, max_frames=15, frame_interval=3,
+                    frame_filter=frame_filter, progress_path=self.progress_path(job.job_id)
+                )
+            except InferenceQueueFull as e:
+                if attempt == self.max_busy_retries:
+                    raise
+                time.sleep(e.retry_after)
+
+    def _run(self, job_id):
+        with self.app.app_context(), face_metrics.trace('register_job') as outcome:
+            job = FaceRegistrationJob.query.get(job_id)
+            if job is None:
+                return
+            try:
+                self._update(job, status='processing', stage='extracting')
+                embeddings, frame_stats = self._extract(job)
+                self._update(
+                    job,
+                    frames_decoded=frame_stats["sampled"],
+                    faces_found=len(embeddings),
+                    frame_stats=frame_stats
+                )
+
+                if not embeddings:
+                    raise ValueError("No valid faces detected in the video. Please ensure the video contains clear, visible faces")
+                if len(embeddings) < MIN_EMBEDDINGS:
+                    raise ValueError("At least 3 frames with valid faces are required for registration from video")
+
+                self._update(job, stage='storing')
+                senior = SenInfo.query.filter_by(ez_id=job.ez_id).one_or_none()
+                try:
+                    stored = replace_embeddings_in_index(
+                        job.ez_id, embeddings, min_fresh=self.min_fresh, keep_similarity=self.keep_similarity,
+                        pincode=senior.pincode if senior else None
+                    )
+                finally:
+                    # Cached /recognize answers may now be wrong for this face
+                    recognition_cache.invalidate()
+
+                self._update(
+                    job, status='completed', stage='done',
+                    embeddings_stored=stored["stored"], embeddings_kept=stored["kept"]
+                )
+            except ValueError as e:
+                rollbackdb()
+                self._update(job, status='failed', error=str(e))
+            except InferenceQueueFull:
+                rollbackdb()
+                self._update(job, status='failed', error="Face recognition is busy. Please try again shortly.")
+            except InferenceTimeout:
+                rollbackdb()
+                self._update(job, status='failed', error="Face processing took too long. Please try again.")
+            except Exception as e:
+                rollbackdb()
+                logger.error(f"Face registration job {job_id} failed: {e}")
+                self._update(job, status='failed', error="Failed to process video!")
+            finally:
+                outcome['status'] = job.status
+                for path in (job.upload_path, self.progress_path(job_id)):
+                    try:
+                        os.unlink(path)
+                    except (OSError, TypeError):
+                        pass
+
+
+registration_jobs = RegistrationJobRunner()
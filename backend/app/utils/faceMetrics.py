@@ -0,0 +1,148 @@
+"""
+    Stage-level latency metrics for the face endpoints, exported in the Prometheus text format.
+
+    Code that does a measurable piece of work wraps it in `stage('detection')` etc. Timings
+    are collected into the trace of the request (or registration job) running on the current
+    thread. That includes work done inside an inference worker process: FaceInferencePool runs
+    every job through `traced_call`, which sends the worker's stage timings back with the
+    result. When the trace ends, the per-stage totals are observed into
+    `face_stage_duration_seconds{endpoint, stage}` and the whole request into
+    `face_request_duration_seconds{endpoint, status}`.
+
+    Metrics are kept per process; with several web processes each one serves its own /metrics.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; face work ranges from sub-millisecond index queries to multi-second video jobs
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, counts in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{self.name}_bucket{{{_format_labels(labels + [('le', le)])}}} {cumulative}")
+            suffix = f"{{{_format_labels(labels)}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {counts[-1]!r}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class FaceMetrics:
+    """Face subsystem histograms plus the per-thread trace that feeds them."""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.stage_seconds = Histogram(
+            'face_stage_duration_seconds', 'Time spent per stage of a face request or registration job.',
+            ('endpoint', 'stage')
+        )
+        self.request_seconds = Histogram(
+            'face_request_duration_seconds', 'End-to-end time of a face request or registration job.',
+            ('endpoint', 'status')
+        )
+        self._local = threading.local()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('FACE_METRICS_ENABLED', self.enabled)
+        app.extensions['face_metrics'] = self
+
+    @property
+    def _stages(self):
+        return getattr(self._local, 'stages', None)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the block as `name` in the current trace (no-op outside a trace)."""
+        stages = self._stages
+        if stages is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+    def record(self, name, seconds):
+        """Add an externally measured duration (e.g. from a worker process) to the current trace."""
+        stages = self._stages
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + seconds
+
+    def traced_call(self, submitted_at, fn, *args, **kwargs):
+        """Run fn in a fresh trace and return (result, stage timings); used inside inference workers."""
+        stages = {'queue_wait': max(time.time() - submitted_at, 0.0)}
+        previous, self._local.stages = self._stages, stages
+        try:
+            return fn(*args, **kwargs), stages
+        finally:
+            self._local.stages = previous
+
+    @contextmanager
+    def trace(self, endpoint):
+        """Collect the stages of one request / job and observe them when it ends.
+
+        Yields a dict; set its 'status' (e.g. the HTTP status code) before the block exits.
+        """
+        outcome = {'status': 'error'}
+        if not self.enabled:
+            yield outcome
+            return
+        previous, self._local.stages = self._stages, {}
+        start = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            stages, self._local.stages = self._local.stages, previous
+            for name, seconds in stages.items():
+                self.stage_seconds.observe(seconds, endpoint=endpoint, stage=name)
+            self.request_seconds.observe(time.perf_counter() - start, endpoint=endpoint, status=outcome['status'])
+
+    def render(self, extra_lines=()):
+        """Prometheus text exposition of every face metric."""
+        lines = self.stage_seconds.render() + self.request_seconds.render() + list(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+
+face_metrics = FaceMetrics()
@@ -0,0 +1,80 @@
+"""
+    Tuned insightface model loading.
+
+    insightface.app.FaceAnalysis creates every ONNX Runtime session with default options,
+    so intra/inter-op thread counts follow the machine's core count in every process,
+    and all five buffalo_l models (detection, recognition, 2d/3d landmarks, gender-age)
+    are loaded. TunedFaceAnalysis builds the sessions through model_zoo.ModelRouter with our
+    SessionOptions and providers and keeps only the modules the app uses.
+
+    Imported lazily by FaceProvider.model: importing insightface is slow.
+"""
+import glob
+import logging
+import os.path as osp
+
+import onnxruntime
+from insightface.app import FaceAnalysis
+from insightface.model_zoo import model_zoo
+from insightface.utils import ensure_available
+
+logger = logging.getLogger(__name__)
+
+
+def session_options(intra_op_threads=0, inter_op_threads=0, allow_spinning=True):
+    """ONNX Runtime SessionOptions; 0 threads leaves the choice to ONNX Runtime."""
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if not allow_spinning:
+        # Idle threads sleep instead of busy-waiting, which matters when workers share cores
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        options.add_session_config_entry('session.inter_op.allow_spinning', '0')
+    return options
+
+
+def resolve_providers(providers=None):
+    """Requested execution providers that this onnxruntime build actually has."""
+    available = onnxruntime.get_available_providers()
+    requested = providers or model_zoo.get_default_providers()
+    usable = [p for p in requested if p in available]
+    if providers and len(usable) < len(requested):
+        logger.warning(f"Execution providers {[p for p in requested if p not in available]} are not available, using {usable}")
+    return usable or ['CPUExecutionProvider']
+
+
+class TunedFaceAnalysis(FaceAnalysis):
+    """FaceAnalysis whose ONNX sessions use the given SessionOptions / providers and allowed modules."""
+
+    def __init__(self, name, root='~/.insightface', allowed_modules=None, providers=None, sess_options=None):
+        onnxruntime.set_default_logger_severity(3)
+        self.models = {}
+        self.model_dir = ensure_available('models', name, root=root)
+        for onnx_file in sorted(glob.glob(osp.join(self.model_dir, '*.onnx'))):
+            model = model_zoo.ModelRouter(onnx_file).get_model(sess_options=sess_options, providers=providers)
+            if model is None:
+                logger.warning(f"Face model not recognized: {onnx_file}")
+            elif allowed_modules is not None and model.taskname not in allowed_modules:
+                del model  # frees the session right away
+            elif model.taskname in self.models:
+                logger.warning(f"Duplicate face model for '{model.taskname}', ignoring {onnx_file}")
+            else:
+                self.models[model.taskname] = model
+        assert 'detection' in self.models, f"No face detection model found in {self.model_dir}"
+        self.det_model = self.models['detection']
+        logger.info(f"Face model modules loaded: {sorted(self.models)}")
+
+
+def load_face_model(name, ctx_id=0, det_size=(640, 640), allowed_modules=None, providers=None,
+                    intra_op_threads=0, inter_op_threads=0, allow_spinning=True):
+    """Build and prepare a TunedFaceAnalysis."""
+    model = TunedFaceAnalysis(
+        name=name,
+        allowed_modules=allowed_modules,
+        providers=resolve_providers(providers),
+        sess_options=session_options(intra_op_threads, inter_op_threads, allow_spinning),
+    )
+    model.prepare(ctx_id=ctx_id, det_size=tuple(det_size))  # ctx_id -1 forces CPU
+    return model
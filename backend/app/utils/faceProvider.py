@@ -0,0 +1,224 @@
+"""
+    Lazily initialised face recognition subsystem.
+
+    The insightface model and the face index (ChromaDB collection or NumPy matrix)
+    are only built the first time a face request needs them, so GraphQL-only workers, `flask db` commands
+    and the test-suite never pay for loading model weights.
+"""
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FaceProvider:
+    """Owns the insightface model and the face index for one process."""
+
+    def __init__(self, app=None):
+        self.chroma_path = "./chroma_db"
+        self.collection_name = "face_embeddings"
+        self.model_name = "buffalo_l"
+        self.ctx_id = 0
+        self.det_size = (640, 640)
+        self.allowed_modules = ['detection', 'recognition']
+        self.providers = None
+        self.intra_op_threads = 0
+        self.inter_op_threads = 1
+        self.allow_spinning = False
+        self.decode_max_side = 1280
+        self.index_backend = "chroma"
+        self.numpy_index_path = "./face_index"
+        self.index_dtype = "float32"
+        self.index_mode = "raw"
+        self.prototypes_per_user = 3
+        self.n_results = 50
+        self.hnsw_m = 16
+        self.hnsw_construction_ef = 100
+        self.hnsw_search_ef = 100
+        self.locality_search = False
+        self.locality_min_similarity = 0.65
+        self._client = None
+        self._collection = None
+        self._index = None
+        self._model = None
+        self._collection_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read face settings from the app config. Nothing is loaded here."""
+        self.chroma_path = app.config.get('CHROMA_DB_PATH', self.chroma_path)
+        self.collection_name = app.config.get('FACE_COLLECTION_NAME', self.collection_name)
+        self.index_backend = app.config.get('FACE_INDEX_BACKEND', self.index_backend)
+        self.numpy_index_path = app.config.get('FACE_NUMPY_INDEX_PATH', self.numpy_index_path)
+        self.index_dtype = app.config.get('FACE_INDEX_DTYPE', self.index_dtype)
+        self.index_mode = app.config.get('FACE_INDEX_MODE', self.index_mode)
+        self.prototypes_per_user = app.config.get('FACE_PROTOTYPES_PER_USER', self.prototypes_per_user)
+        self.n_results = app.config.get('FACE_QUERY_N_RESULTS', self.n_results)
+        self.hnsw_m = app.config.get('FACE_HNSW_M', self.hnsw_m)
+        self.hnsw_construction_ef = app.config.get('FACE_HNSW_CONSTRUCTION_EF', self.hnsw_construction_ef)
+        self.hnsw_search_ef = app.config.get('FACE_HNSW_SEARCH_EF', self.hnsw_search_ef)
+        self.locality_search = app.config.get('FACE_LOCALITY_SEARCH', self.locality_search)
+        self.locality_min_similarity = app.config.get('FACE_LOCALITY_MIN_SIMILARITY', self.locality_min_similarity)
+        intra_op_threads = app.config.get('FACE_MODEL_INTRA_OP_THREADS', self.intra_op_threads)
+        if not intra_op_threads:
+            # Split the cores between the model-owning processes instead of letting each grab them all
+            intra_op_threads = max(1, (os.cpu_count() or 1) // max(app.config.get('FACE_INFERENCE_WORKERS', 1), 1))
+        self.configure(
+            model_name=app.config.get('FACE_MODEL_NAME', self.model_name),
+            ctx_id=app.config.get('FACE_MODEL_CTX_ID', self.ctx_id),
+            det_size=app.config.get('FACE_MODEL_DET_SIZE', self.det_size),
+            allowed_modules=app.config.get('FACE_MODEL_ALLOWED_MODULES', self.allowed_modules),
+            providers=app.config.get('FACE_MODEL_PROVIDERS', self.providers),
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=app.config.get('FACE_MODEL_INTER_OP_THREADS', self.inter_op_threads),
+            allow_spinning=app.config.get('FACE_MODEL_ALLOW_SPINNING', self.allow_spinning),
+            decode_max_side=app.config.get('FACE_PHOTO_DECODE_MAX_SIDE', self.decode_max_side),
+        )
+        app.extensions['face_provider'] = self
+
+    MODEL_SETTINGS = ('model_name', 'ctx_id', 'det_size', 'allowed_modules', 'providers',
+                      'intra_op_threads', 'inter_op_threads', 'allow_spinning', 'decode_max_side')
+
+    def configure(self, **settings):
+        """Apply model settings, e.g. inside an inference worker process that has no Flask app.
+
+        Accepts any of MODEL_SETTINGS; None leaves a setting unchanged.
+        """
+        for key, value in settings.items():
+            if key not in self.MODEL_SETTINGS:
+                raise TypeError(f"Unknown face model setting '{key}'")
+            if value is not None:
+                setattr(self, key, value)
+
+    @property
+    def model_settings(self) -> dict:
+        """Picklable model settings, passed to inference workers so they load the same model."""
+        return {key: getattr(self, key) for key in self.MODEL_SETTINGS}
+
+    def hnsw_metadata(self, m=None, construction_ef=None, search_ef=None) -> dict:
+        """Collection metadata with the HNSW parameters (configured values unless overridden)."""
+        return {
+            "hnsw:space": "cosine",
+            "hnsw:M": m or self.hnsw_m,
+            "hnsw:construction_ef": construction_ef or self.hnsw_construction_ef,
+            "hnsw:search_ef": search_ef or self.hnsw_search_ef,
+        }
+
+    @property
+    def client(self):
+        """ChromaDB PersistentClient for CHROMA_DB_PATH."""
+        if self._client is None:
+            with self._collection_lock:
+                if self._client is None:
+                    import chromadb
+
+                    self._client = chromadb.PersistentClient(path=self.chroma_path)
+        return self._client
+
+    @property
+    def collection(self):
+        """ChromaDB collection holding the face embeddings, created on first access."""
+        if self._collection is None:
+            client = self.client
+            with self._collection_lock:
+                if self._collection is None:
+                    collection = client.get_or_create_collection(
+                        name=self.collection_name,
+                        metadata=self.hnsw_metadata()
+                    )
+                    self._check_hnsw(collection)
+                    self._collection = collection
+                    logger.info(f"Face collection '{self.collection_name}' opened at {self.chroma_path}")
+        return self._collection
+
+    def _check_hnsw(self, collection):
+        """Apply FACE_HNSW_SEARCH_EF to an existing collection; warn if its build parameters differ."""
+        try:
+            hnsw = (collection.configuration_json or {}).get('hnsw') or {}
+        except Exception:
+            return
+        if hnsw.get('ef_search') not in (None, self.hnsw_search_ef):
+            # ef_search can change in place; Chroma reads it when a process first loads the index
+            collection.modify(configuration={"hnsw": {"ef_search": self.hnsw_search_ef}})
+        built = (hnsw.get('max_neighbors'), hnsw.get('ef_construction'))
+        if None not in built and built != (self.hnsw_m, self.hnsw_construction_ef):
+            logger.warning(
+                f"Face collection '{self.collection_name}' was built with M={built[0]}, ef_construction={built[1]}; "
+                f"run `flask face rebuild-index` to apply M={self.hnsw_m}, ef_construction={self.hnsw_construction_ef}"
+            )
+
+    @property
+    def index(self):
+        """FaceIndex backend selected by FACE_INDEX_BACKEND ('chroma' or 'numpy'), created on first access."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    from .faceIndex import ChromaFaceIndex, NumpyFaceIndex
+
+                    if self.index_backend == 'numpy':
+                        self._index = NumpyFaceIndex(self.numpy_index_path, dtype=self.index_dtype)
+                    else:
+                        self._index = ChromaFaceIndex(self.client, self.collection)
+        return self._index
+
+    @property
+    def model(self):
+        """Prepared insightface FaceAnalysis model, loaded on first access."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from .faceModel import load_face_model
+
+                    self._model = load_face_model(
+                        self.model_name,
+                        ctx_id=self.ctx_id,  # set to -1 if using CPU
+                        det_size=self.det_size,
+                        allowed_modules=self.allowed_modules,
+                        providers=self.providers,
+                        intra_op_threads=self.intra_op_threads,
+                        inter_op_threads=self.inter_op_threads,
+                        allow_spinning=self.allow_spinning,
+                    )
+                    logger.info(f"Face model '{self.model_name}' loaded "
+                                f"(det_size={self.det_size}, intra_op_threads={self.intra_op_threads})")
+        return self._model
+
+    @property
+    def query_size(self) -> int:
+        """How many nearest embeddings /recognize asks for before grouping them by ez_id."""
+        if self.index_mode == 'prototype':
+            return min(5 * self.prototypes_per_user, self.n_results)
+        return self.n_results
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self, model=True, index=True) -> None:
+        """Load the face index and/or the model, running one dummy inference per module, so the first real request isn't slow."""
+        try:
+            import numpy as np
+
+            if index:
+                self.index
+            if not model:
+                logger.info("Face index opened")
+                return
+            model = self.model
+            det_w, det_h = getattr(model, 'det_size', (640, 640))
+            model.det_model.detect(np.zeros((det_h, det_w, 3), dtype=np.uint8), max_num=0, metric='default')
+            rec_model = model.models.get('recognition')
+            if rec_model is not None:
+                # A blank image has no face, so recognition needs its own dummy crop
+                rec_model.get_feat([np.zeros((*rec_model.input_size[::-1], 3), dtype=np.uint8)])
+            logger.info("Face subsystem warmed up")
+        except Exception as e:
+            logger.error(f"Face subsystem warm-up failed: {e}")
+
+
+face_provider = FaceProvider()
@@ -1,14 +1,151 @@
-from flask_mail import Mail, Message
+from flask_mail import Mail, Message, BadHeaderError
 from datetime import datetime
-from flask import render_template
+from .emailTemplates import email_renderer
 from typing import List, Optional
+import atexit
 import logging
+import smtplib
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 mail = Mail()
 
-def send_email(subject: str, recipients: List[str], reminder_display=None, template="reminders_template.html", contact=None, current_year=None) -> None:
-    """Send an email using Flask-Mail.
+
+class SMTPPool:
+    """A few long-lived SMTP connections shared by every sender in this process.
+
+    Opening a connection costs a TCP connect, a TLS handshake and a login; a pooled one is
+    reused until it has been idle for MAIL_POOL_MAX_IDLE seconds (before the server drops it).
+    A connection idle for more than MAIL_POOL_HEALTH_CHECK seconds is checked with NOOP
+    before use, and one that breaks mid-send is replaced.
+    """
+
+    # The server refused this message; the connection itself is still usable
+    MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+                      BadHeaderError, AssertionError)
+
+    def __init__(self, app=None):
+        self.size = 4
+        self.max_idle = 240
+        self.health_check = 30
+        self.checkout_timeout = 30
+        self._idle = []  # (connection, last used), most recently used last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.size = app.config.get('MAIL_POOL_SIZE', self.size)
+        self.max_idle = app.config.get('MAIL_POOL_MAX_IDLE', self.max_idle)
+        self.health_check = app.config.get('MAIL_POOL_HEALTH_CHECK', self.health_check)
+        self.checkout_timeout = app.config.get('MAIL_POOL_CHECKOUT_TIMEOUT', self.checkout_timeout)
+        self._slots = threading.BoundedSemaphore(self.size)
+        app.extensions['smtp_pool'] = self
+        atexit.register(self.close)
+
+    def send(self, message: Message) -> None:
+        """Send one message over a pooled connection; raises what the SMTP server raised."""
+        error = self.send_many([message])[0]
+        if error is not None:
+            raise error
+
+    def send_many(self, messages: List[Message]) -> list:
+        """Send the messages in order over one pooled connection. Needs an app context.
+
+        Returns one entry per message: None when it was sent, else the exception. A message the
+        server refuses does not affect the others. When a reused connection breaks it is replaced
+        and the message retried once; when a fresh connection fails, the remaining messages all
+        fail with that error (the server is down, there is no point trying each of them).
+        """
+        errors = []
+        connection, reused = None, False
+        try:
+            for index, message in enumerate(messages):
+                for attempt in range(2):
+                    try:
+                        if connection is None:
+                            connection, reused = self._checkout(fresh=attempt > 0)
+                        connection.send(message)
+                        errors.append(None)
+                        break
+                    except self.MESSAGE_ERRORS as e:
+                        errors.append(e)
+                        break
+                    except Exception as e:
+                        retry = reused and attempt == 0
+                        if connection is not None:
+                            self._checkin(connection, healthy=False)
+                        connection, reused = None, False
+                        if retry:
+                            logger.info(f"Pooled SMTP connection broke ({e}), reconnecting")
+                            continue
+                        errors.extend([e] * (len(messages) - index))
+                        return errors
+        finally:
+            if connection is not None:
+                self._checkin(connection)
+        return errors
+
+    def close(self):
+        """Quit every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._quit(connection)
+
+    def _checkout(self, fresh=False):
+        """Take a healthy idle connection, or open one; returns (connection, reused)."""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise RuntimeError(f"No SMTP connection free after {self.checkout_timeout}s")
+        try:
+            while not fresh:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection, last_used = self._idle.pop()
+                idle_for = time.monotonic() - last_used
+                if idle_for < self.health_check or (idle_for < self.max_idle and self._healthy(connection)):
+                    return connection, True
+                self._quit(connection)
+            connection = mail.connect()
+            connection.__enter__()
+            return connection, False
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, connection, healthy=True):
+        if healthy:
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        else:
+            self._quit(connection)
+        self._slots.release()
+
+    @staticmethod
+    def _healthy(connection) -> bool:
+        if connection.host is None:
+            return True  # MAIL_SUPPRESS_SEND: nothing to check
+        try:
+            return connection.host.noop()[0] == 250
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(connection):
+        try:
+            connection.__exit__(None, None, None)
+        except Exception:
+            pass  # the server already dropped it
+
+
+smtp_pool = SMTPPool()
+
+def build_email(subject: str, recipients: List[str], reminder_display=None, template="reminders_template.html", contact=None, current_year=None) -> Message:
+    """Render an email into a Flask-Mail Message without sending it.
 
     Args:
         subject: Email subject line
@@ -18,130 +155,155 @@ def send_email(subject: str, recipients: List[str], reminder_display=None, templ
         contact: Contact object for backward compatibility with reminder emails
         current_year: Current year for template rendering
     """
-    try:
-        msg = Message(
-            subject=subject,
-            recipients=recipients,
+    msg = Message(
+        subject=subject,
+        recipients=recipients,
+    )
+
+    # Set current_year if not provided
+    if current_year is None:
+        current_year = datetime.now().year
+
+    # Handle different template rendering scenarios
+    if template == "SOS_template.html":
+        # SOS email rendering
+        msg.html = email_renderer.render(
+            template,
+            reminder_display=reminder_display,
+            current_year=current_year
         )
 
-        # Set current_year if not provided
-        if current_year is None:
-            current_year = datetime.now().year
-
-        # Handle different template rendering scenarios
-        if template == "SOS_template.html":
-            # SOS email rendering
-            msg.html = render_template(
-                template,
-                reminder_display=reminder_display,
-                current_year=current_year
-            )
+        # SOS plain text fallback
+        senior_name = "Senior Citizen"
+        if reminder_display and 'ezId' in reminder_display:
+            senior_name = f"Senior Citizen (ID: {reminder_display['ezId']})"
 
-            # SOS plain text fallback
-            senior_name = "Senior Citizen"
-            if reminder_display and 'ezId' in reminder_display:
-                senior_name = f"Senior Citizen (ID: {reminder_display['ezId']})"
+        msg.body = f"EMERGENCY SOS ALERT: {senior_name} needs urgent help! Please check the email for full details and contact information."
 
-            msg.body = f"EMERGENCY SOS ALERT: {senior_name} needs urgent help! Please check the email for full details and contact information."
+    elif template == "vital_alert_template.html":
+        # Vital threshold alert email rendering
+        msg.html = email_renderer.render(
+            template,
+            reminder_display=reminder_display,
+            current_year=current_year
+        )
 
-        elif template == "vital_alert_template.html":
-            # Vital threshold alert email rendering
-            msg.html = render_template(
-                template,
-                reminder_display=reminder_display,
-                current_year=current_year
-            )
+        # Vital alert plain text fallback
+        if reminder_display:
+            senior_name = reminder_display.get('senior_name', 'Senior Citizen')
+            vital_type = reminder_display.get('vital_type', 'Vital Sign')
+            reading = reminder_display.get('reading', 'N/A')
+            unit = reminder_display.get('unit', '')
 
-            # Vital alert plain text fallback
-            if reminder_display:
-                senior_name = reminder_display.get('senior_name', 'Senior Citizen')
-                vital_type = reminder_display.get('vital_type', 'Vital Sign')
-                reading = reminder_display.get('reading', 'N/A')
-                unit = reminder_display.get('unit', '')
+            msg.body = f"VITAL ALERT: {senior_name}'s {vital_type} reading of {reading} {unit} is outside the normal range. Please check on them immediately. If this is an emergency, call 108."
+        else:
+            msg.body = "A vital sign reading is outside the normal range. Please check the full email for details."
 
-                msg.body = f"VITAL ALERT: {senior_name}'s {vital_type} reading of {reading} {unit} is outside the normal range. Please check on them immediately. If this is an emergency, call 108."
-            else:
-                msg.body = "A vital sign reading is outside the normal range. Please check the full email for details."
-
-        elif template == "login_template.html":
-            # Login email rendering
-            msg.html = render_template(
-                template,
-                user_name=reminder_display.get('user_name'),
-                user_email=reminder_display.get('user_email'),
-                user_role=reminder_display.get('user_role'),
-                login_url=reminder_display.get('login_url'),
-                current_year=reminder_display.get('current_year', datetime.now().year)
-            )
+    elif template == "reminder_digest_template.html":
+        # Several reminders of one senior firing together
+        reminders = reminder_display.get('reminders', []) if reminder_display else []
+        msg.html = email_renderer.render(
+            template,
+            reminders=reminders,
+            current_year=current_year
+        )
 
-            # Login plain text fallback
-            user_name = reminder_display.get('user_name', 'User') if reminder_display else 'User'
-            login_url = reminder_display.get('login_url', '#') if reminder_display else '#'
+        # Digest plain text fallback
+        lines = [
+            f"- {reminder.get('label') or 'Reminder'}"
+            + (f" at {reminder['rem_time'].strftime('%I:%M %p')}" if isinstance(reminder.get('rem_time'), datetime) else "")
+            for reminder in reminders
+        ]
+        msg.body = "You have {} reminders:\n{}\nCheck your dashboard for more details.".format(len(reminders), "\n".join(lines))
 
-            msg.body = f"""
-                Hello {user_name},
+    elif template == "login_template.html":
+        # Login email rendering
+        msg.html = email_renderer.render(
+            template,
+            user_name=reminder_display.get('user_name'),
+            user_email=reminder_display.get('user_email'),
+            user_role=reminder_display.get('user_role'),
+            login_url=reminder_display.get('login_url'),
+            current_year=reminder_display.get('current_year', datetime.now().year)
+        )
 
-                You requested a login link for your EZCare account.
+        # Login plain text fallback
+        user_name = reminder_display.get('user_name', 'User') if reminder_display else 'User'
+        login_url = reminder_display.get('login_url', '#') if reminder_display else '#'
 
-                Please click the link below to login securely:
-                {login_url}
+        msg.body = f"""
+            Hello {user_name},
 
-                This link expires in 1 hour for your security.
+            You requested a login link for your EZCare account.
 
-                If you didn't request this login, please ignore this email.
+            Please click the link below to login securely:
+            {login_url}
 
-                Best regards,
-                EZCare Team
-                © {datetime.now().year} EZCare. All rights reserved.
-            """.strip()
+            This link expires in 1 hour for your security.
 
-        else:
-            # Regular reminder email rendering
-            template_vars = {
-                'current_year': current_year
-            }
-
-            # Handle reminder data safely
-            if reminder_display:
-                template_vars['reminder'] = reminder_display
-
-            # Handle contact object for backward compatibility
-            if contact:
-                template_vars['contact'] = contact
-
-            try:
-                msg.html = render_template(template, **template_vars)
-
-                # Create plain text fallback
-                if contact and hasattr(contact, 'label'):
-                    msg.body = f"This is a reminder for: {contact.label}. Check your dashboard for more details."
-                elif reminder_display and 'label' in reminder_display:
-                    msg.body = f"This is a reminder for: {reminder_display['label']}. Check your dashboard for more details."
-                else:
-                    msg.body = "You have a new reminder. Please check your email for details."
-
-            except Exception as template_error:
-                logger.error(f"Template rendering failed: {template_error}")
-                # Fallback to simple HTML
-                reminder_label = (
-                    contact.label if contact and hasattr(contact, 'label') else
-                    reminder_display.get('label', 'Your Reminder') if reminder_display else
-                    'Your Reminder'
-                )
-                msg.html = f"""
-                <html>
-                <body>
-                    <h2>EZCare Reminder</h2>
-                    <p>This is a reminder for: <strong>{reminder_label}</strong></p>
-                    <p>Please check your EZCare dashboard for more details.</p>
-                    <hr>
-                    <p><small>© {current_year} EZCare. All rights reserved.</small></p>
-                </body>
-                </html>
-                """
-                msg.body = f"This is a reminder for: {reminder_label}. Check your dashboard for more details."
-
-        mail.send(msg)
+            If you didn't request this login, please ignore this email.
+
+            Best regards,
+            EZCare Team
+            © {datetime.now().year} EZCare. All rights reserved.
+        """.strip()
+
+    else:
+        # Regular reminder email rendering
+        template_vars = {
+            'current_year': current_year
+        }
+
+        # Handle reminder data safely
+        if reminder_display:
+            template_vars['reminder'] = reminder_display
+
+        # Handle contact object for backward compatibility
+        if contact:
+            template_vars['contact'] = contact
+
+        try:
+            msg.html = email_renderer.render(template, **template_vars)
+
+            # Create plain text fallback
+            if contact and hasattr(contact, 'label'):
+                msg.body = f"This is a reminder for: {contact.label}. Check your dashboard for more details."
+            elif reminder_display and 'label' in reminder_display:
+                msg.body = f"This is a reminder for: {reminder_display['label']}. Check your dashboard for more details."
+            else:
+                msg.body = "You have a new reminder. Please check your email for details."
+
+        except Exception as template_error:
+            logger.error(f"Template rendering failed: {template_error}")
+            # Fallback to simple HTML
+            reminder_label = (
+                contact.label if contact and hasattr(contact, 'label') else
+                reminder_display.get('label', 'Your Reminder') if reminder_display else
+                'Your Reminder'
+            )
+            msg.html = f"""
+            <html>
+            <body>
+                <h2>EZCare Reminder</h2>
+                <p>This is a reminder for: <strong>{reminder_label}</strong></p>
+                <p>Please check your EZCare dashboard for more details.</p>
+                <hr>
+                <p><small>© {current_year} EZCare. All rights reserved.</small></p>
+            </body>
+            </html>
+            """
+            msg.body = f"This is a reminder for: {reminder_label}. Check your dashboard for more details."
+
+    return msg
+
+def send_email(subject: str, recipients: List[str], reminder_display=None, template="reminders_template.html", contact=None, current_year=None) -> None:
+    """Send an email right away over a pooled SMTP connection. Prefer the email outbox (emailOutbox.queue_email) in requests.
+
+    Takes the same arguments as build_email.
+    """
+    try:
+        msg = build_email(subject, recipients, reminder_display, template, contact, current_year)
+        smtp_pool.send(msg)
         logger.info(f"Email sent to {recipients} - Subject: {subject}")
 
     except Exception as e:
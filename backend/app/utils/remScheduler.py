@@ -1,9 +1,14 @@
+import logging
 from datetime import datetime, timedelta, time
 from dateutil.rrule import rrule, WEEKLY
 from flask_apscheduler import APScheduler
-from ..models import Reminders, Notification
-from .dbUtils import commitdb, rollbackdb, adddb
-from .mailService import send_email
+from sqlalchemy import event, insert, inspect, update
+from sqlalchemy.orm import joinedload
+from ..models import db, Reminders, Notification
+from .dbUtils import commitdb, rollbackdb
+from .emailOutbox import outbox_row, queue_emails, email_sender
+
+logger = logging.getLogger(__name__)
 
 scheduler = APScheduler()
 CATEGORY_MAP = {
@@ -25,31 +30,74 @@ def should_trigger_today(reminder: Reminders, now: datetime) -> bool:
     today_str = now.strftime('%a').lower()[:3]  # mon, tue, ...
     return today_str in [d.strip().lower() for d in reminder.weekdays.split(',')]
 
-def should_trigger_now(reminder: Reminders, now: datetime) -> bool:
-    """Check if current time matches any time slot ± 1 min"""
-    if not reminder.time_slots:
-        return abs((reminder.rem_time - now).total_seconds()) < 60
+def interval_days(reminder: Reminders) -> int:
+    """Days between active days: `interval` days, or weeks for weekly reminders."""
+    interval = max(reminder.interval or 1, 1)
+    return interval * 7 if (reminder.frequency or '').lower() == 'weekly' else interval
 
-    for slot in reminder.time_slots:
-        slot_time = datetime.combine(now.date(), time.fromisoformat(slot))
-        if abs((slot_time - now).total_seconds()) < 60:
-            return True
-    return False
+def is_reminder_day(reminder: Reminders, day) -> bool:
+    """Whether a recurring reminder fires on `day` (weekdays and every-N-days interval)."""
+    if not should_trigger_today(reminder, datetime.combine(day, time())):
+        return False
+    step = interval_days(reminder)
+    return step == 1 or not reminder.rem_time or (day - reminder.rem_time.date()).days % step == 0
 
-def trigger_reminder(reminder: Reminders):
-    """Trigger reminder and send email."""
-    subject = f"⏰ Reminder: {reminder.label}"
+def next_fire_time(reminder: Reminders, after: datetime):
+    """First time strictly after `after` at which the reminder is due, or None if never.
 
-    # Access user email via relationship
-    if not reminder.user or not reminder.user.email:
-        print(f"Missing user or email for reminder {reminder.rem_id}")
-        return
+    One-time reminders are due at rem_time. Recurring ones at each of their time_slots
+    (or rem_time's time of day without slots) on every matching day, from rem_time on.
+    With time_slots, rem_time is only the start date: every slot of that day counts.
+    """
+    if not reminder.is_active:
+        return None
+    if not reminder.is_recurring:
+        return reminder.rem_time
+
+    if reminder.time_slots:
+        slots = sorted(time.fromisoformat(slot) for slot in reminder.time_slots)
+    elif reminder.rem_time:
+        slots = [reminder.rem_time.time()]
+    else:
+        return None
+
+    earliest = after
+    if reminder.rem_time and reminder.rem_time > after:
+        # The first occurrence itself counts
+        start = datetime.combine(reminder.rem_time.date(), time()) if reminder.time_slots else reminder.rem_time
+        earliest = max(after, start - timedelta(microseconds=1))
+    # Every weekday comes round within 7 active days; past that the weekdays never match
+    for offset in range(7 * interval_days(reminder) + 1):
+        day = earliest.date() + timedelta(days=offset)
+        if not is_reminder_day(reminder, day):
+            continue
+        for slot in slots:
+            fire_at = datetime.combine(day, slot)
+            if fire_at > earliest:
+                return fire_at
+    return None
 
-    recipients = [reminder.user.email]
-    reminder_display = {
+SCHEDULE_FIELDS = ('rem_time', 'is_active', 'is_recurring', 'frequency', 'interval', 'weekdays', 'time_slots')
+
+@event.listens_for(Reminders, 'before_insert')
+def schedule_new_reminder(mapper, connection, reminder):
+    if reminder.next_fire_at is None:
+        reminder.next_fire_at = next_fire_time(reminder, datetime.utcnow())
+
+@event.listens_for(Reminders, 'before_update')
+def reschedule_changed_reminder(mapper, connection, reminder):
+    state = inspect(reminder)
+    if state.attrs.next_fire_at.history.has_changes():
+        return  # set explicitly, e.g. by check_reminders
+    if any(state.attrs[field].history.has_changes() for field in SCHEDULE_FIELDS):
+        reminder.next_fire_at = next_fire_time(reminder, datetime.utcnow())
+
+def reminder_display(reminder: Reminders) -> dict:
+    """Template variables for one firing reminder."""
+    return {
         'label': reminder.label,
         'category': CATEGORY_MAP.get(reminder.category, "Other"),
-        'rem_time': reminder.rem_time.strftime('%Y-%m-%d %H:%M:%S') if reminder.rem_time else None,
+        'rem_time': reminder.next_fire_at or reminder.rem_time,  # this occurrence; the template formats it
         'is_recurring': reminder.is_recurring,
         'frequency': reminder.frequency,
         'weekdays': reminder.weekdays,
@@ -58,60 +106,166 @@ def trigger_reminder(reminder: Reminders):
         'interval': reminder.interval,
         'is_active': reminder.is_active
     }
-    try:
-        send_email(
-            subject=subject,
-            recipients=recipients,
-            reminder_display=reminder_display,
-            template="reminders_template.html",
-            current_year=datetime.now().year
-        )
-        # Create notification using the actual reminder object attributes, not the dictionary
-        notification = Notification(
-            ez_id=reminder.user.ez_id,
-            label=reminder.label,
-            time=reminder.rem_time,
-            category=reminder.category
-        )
-        adddb(notification)
-        commitdb()
-        print(f"Email sent for Reminder: {reminder.label} to {reminder.user.email}")
-    except Exception as e:
-        rollbackdb()
-        print(f"Error sending email for {reminder.label}: {e}")
+
+def reminder_messages(reminder: Reminders):
+    """(Notification values, outbox email) for a firing reminder, or None if it has nobody to notify."""
+    # Access user email via relationship
+    if not reminder.user or not reminder.user.email:
+        logger.warning(f"Missing user or email for reminder {reminder.rem_id}")
+        return None
+
+    notification = {
+        'ez_id': reminder.user.ez_id,
+        'label': reminder.label,
+        'time': reminder.rem_time,
+        'category': reminder.category
+    }
+    email = outbox_row(
+        subject=f"⏰ Reminder: {reminder.label}",
+        recipients=[reminder.user.email],
+        template="reminders_template.html",
+        reminder_display=reminder_display(reminder)
+    )
+    return notification, email
+
+def digest_email(reminders: list[Reminders]) -> dict:
+    """One outbox email for several reminders of the same senior firing together."""
+    labels = ", ".join(rem.label for rem in reminders if rem.label)
+    if len(labels) > 60:
+        labels = labels[:57] + "..."
+    return outbox_row(
+        subject=f"⏰ {len(reminders)} Reminders: {labels}",
+        recipients=[reminders[0].user.email],
+        template="reminder_digest_template.html",
+        reminder_display={'reminders': [reminder_display(rem) for rem in reminders]}
+    )
+
+def digest_messages(reminders: list[Reminders]):
+    """(Notification values, outbox emails) for firing reminders, one email per senior.
+
+    Every reminder still gets its own notification; a senior with one firing reminder gets
+    the usual reminder email, one with several gets a single digest email listing them.
+    """
+    notifications, emails, by_senior = [], [], {}
+    for rem in reminders:
+        messages = reminder_messages(rem)
+        if messages:
+            notifications.append(messages[0])
+            by_senior.setdefault(rem.ez_id, []).append((rem, messages[1]))
+    for firing in by_senior.values():
+        if len(firing) == 1:
+            emails.append(firing[0][1])
+        else:
+            emails.append(digest_email([rem for rem, _ in firing]))
+    return notifications, emails
+
+def schedule_reminders(app):
+    """Fill in next_fire_at for active reminders that don't have one (e.g. created before it existed)."""
+    with app.app_context():
+        now = datetime.utcnow()
+        unscheduled = Reminders.query.filter(
+            Reminders.is_active == True,
+            Reminders.next_fire_at == None
+        ).all()
+        for rem in unscheduled:
+            rem.next_fire_at = next_fire_time(rem, now)
+        try:
+            commitdb()
+        except Exception as e:
+            app.logger.error(f"Error scheduling reminders: {e}")
+            rollbackdb()
 
 def check_reminders(app):
+    """One scheduler tick: fire every due reminder in a single transaction, then send the emails.
+
+    Notifications are bulk-inserted, emails go to the outbox, finished one-time reminders are
+    deactivated with one UPDATE and recurring ones advanced with one executemany UPDATE.
+    The outbox senders pick the emails up after the commit.
+
+    With REMINDER_DIGEST, a senior's reminders firing in the same tick (or due within
+    REMINDER_DIGEST_WINDOW seconds of one that does) go out as one digest email.
+    """
     with app.app_context():
         now = datetime.utcnow()
+        # A recurring occurrence more than this late (e.g. after downtime) is skipped, not sent
+        missed_after = timedelta(seconds=app.config.get('REMINDER_MISSED_GRACE', 300))
+
+        digest = app.config.get('REMINDER_DIGEST', True)
+        digest_window = timedelta(seconds=app.config.get('REMINDER_DIGEST_WINDOW', 0))
 
-        # --- One-time reminders ---
-        one_time_reminders = Reminders.query.filter(
+        # Uses ix_reminders_active_next_fire_at: only reminders due now are loaded
+        due_reminders = Reminders.query.options(joinedload(Reminders.user)).filter(
             Reminders.is_active == True,
-            Reminders.is_recurring == False,
-            Reminders.rem_time <= now
-        ).all()
+            Reminders.next_fire_at <= now
+        ).order_by(Reminders.next_fire_at).all()
+
+        if digest and digest_window and due_reminders:
+            # Bring forward the reminders of these seniors due within the window, for the same digest
+            due_reminders += Reminders.query.options(joinedload(Reminders.user)).filter(
+                Reminders.is_active == True,
+                Reminders.next_fire_at > now,
+                Reminders.next_fire_at <= now + digest_window,
+                Reminders.ez_id.in_({rem.ez_id for rem in due_reminders})
+            ).order_by(Reminders.next_fire_at).all()
+
+        notifications, emails, finished, rescheduled, firing = [], [], [], [], []
 
-        for rem in one_time_reminders:
+        def add_messages(rem):
             try:
-                trigger_reminder(rem)
-                rem.is_active = False
-                commitdb()
+                messages = reminder_messages(rem)
+                if messages:
+                    notifications.append(messages[0])
+                    emails.append(messages[1])
             except Exception as e:
-                app.logger.error(f"Error triggering one-time reminder ID {rem.rem_id}: {e}")
-                rollbackdb()
+                app.logger.error(f"Error triggering reminder ID {rem.rem_id}: {e}")
 
-        # --- Recurring reminders ---
-        recurring_reminders = Reminders.query.filter(
-            Reminders.is_active == True,
-            Reminders.is_recurring == True
-        ).all()
+        for rem in due_reminders:
+            try:
+                if rem.is_recurring:
+                    fire = now - rem.next_fire_at <= missed_after
+                    if not fire:
+                        app.logger.warning(f"Skipping missed occurrence {rem.next_fire_at} of reminder ID {rem.rem_id}")
+                    rescheduled.append({'rem_id': rem.rem_id, 'next_fire_at': next_fire_time(rem, max(now, rem.next_fire_at))})
+                else:
+                    fire = True
+                    finished.append(rem.rem_id)
+                if not fire:
+                    continue
+                if digest:
+                    firing.append(rem)
+                else:
+                    add_messages(rem)
+            except Exception as e:
+                app.logger.error(f"Error triggering reminder ID {rem.rem_id}: {e}")
 
-        for rem in recurring_reminders:
+        if firing:
             try:
-                if should_trigger_today(rem, now) and should_trigger_now(rem, now):
-                    trigger_reminder(rem)
-                    # Optional: update rem.last_triggered = now
-                    commitdb()
+                notifications, emails = digest_messages(firing)
+            except Exception as e:
+                # Still send these reminders, one email each, rather than mark them fired unsent
+                app.logger.error(f"Error building reminder digests, sending them one by one: {e}")
+                for rem in firing:
+                    add_messages(rem)
+
+        if due_reminders:
+            try:
+                if notifications:
+                    db.session.execute(insert(Notification), notifications)
+                queue_emails(emails)
+                if finished:
+                    db.session.execute(
+                        update(Reminders).where(Reminders.rem_id.in_(finished)).values(is_active=False, next_fire_at=None)
+                    )
+                if rescheduled:
+                    db.session.execute(update(Reminders), rescheduled)
+                commitdb()
             except Exception as e:
-                app.logger.error(f"Error triggering recurring reminder ID {rem.rem_id}: {e}")
                 rollbackdb()
+                app.logger.error(f"Error triggering {len(due_reminders)} due reminders: {e}")
+                return
+
+        if not email_sender.running:
+            # No sender threads in this process (EMAIL_SENDER_THREADS = 0): send from the tick
+            result = email_sender.deliver()
+            if result["sent"] or result["failed"]:
+                app.logger.info(f"Reminder emails: {result['sent']} sent, {result['failed']} failed")
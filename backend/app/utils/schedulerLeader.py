@@ -0,0 +1,198 @@
+"""
+    Leader election for the background scheduler.
+
+    create_app() runs in every gunicorn worker (and on every node), but the reminder scan
+    must run in exactly one process. Every process campaigns here; only the one that wins
+    starts APScheduler, the others just re-check every SCHEDULER_LEADER_RETRY seconds so
+    one of them takes over when the leader dies.
+
+    SCHEDULER_LEADER_BACKEND picks the lock:
+      - 'file': an exclusive flock on SCHEDULER_LEADER_LOCK_FILE. One leader per host; the
+        OS releases it the moment the leader process exits.
+      - 'db': a row in scheduler_leases that the leader renews every SCHEDULER_LEASE_TTL / 3
+        seconds. One leader across every node sharing the database; a dead leader is replaced
+        once its lease expires.
+      - 'none': no election, every process runs the scheduler (single-process development).
+
+    With FLASK_DEBUG the Werkzeug reloader's parent process never campaigns (the same check
+    Flask-APScheduler makes): it only watches files, and would otherwise hold the file lock
+    forever so the child that serves requests could never lead.
+"""
+import atexit
+import fcntl
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask.helpers import get_debug_flag
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.serving import is_running_from_reloader
+
+from ..models import db, SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerLeader:
+    """Elects one process to run the scheduler, via a file lock or a database lease."""
+
+    BACKENDS = ('file', 'db', 'none')
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = 'file'
+        self.lock_path = './scheduler.lock'
+        self.lease_name = 'reminders'
+        self.lease_ttl = 30
+        self.retry_interval = 15
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leading = False
+        self._deadline = 0.0  # monotonic time until which the db lease is surely ours
+        self._lock_file = None
+        self._on_elected = None
+        self._on_deposed = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = app.config.get('SCHEDULER_LEADER_BACKEND', self.backend)
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f"SCHEDULER_LEADER_BACKEND must be one of {self.BACKENDS}, got {self.backend!r}")
+        self.lock_path = os.path.abspath(app.config.get('SCHEDULER_LEADER_LOCK_FILE', self.lock_path))
+        self.lease_name = app.config.get('SCHEDULER_LEASE_NAME', self.lease_name)
+        self.lease_ttl = app.config.get('SCHEDULER_LEASE_TTL', self.lease_ttl)
+        self.retry_interval = app.config.get('SCHEDULER_LEADER_RETRY', self.retry_interval)
+        app.extensions['scheduler_leader'] = self
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this process may run singleton jobs right now."""
+        if not self._leading:
+            return False
+        return self.backend != 'db' or time.monotonic() < self._deadline
+
+    def start(self, on_elected, on_deposed=None):
+        """Campaign now and keep campaigning in a daemon thread.
+
+        `on_elected` is called whenever this process becomes the leader, `on_deposed` when
+        it loses the lock (db lease not renewed in time).
+        """
+        self._on_elected, self._on_deposed = on_elected, on_deposed
+        if get_debug_flag() and not is_running_from_reloader():
+            logger.info("Not campaigning for scheduler leader in the reloader's parent process")
+            return
+        self._campaign()
+        if self.backend == 'none':
+            return
+        self._thread = threading.Thread(target=self._run, name='scheduler-leader', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop campaigning and give up the lock so another process takes over right away."""
+        self._stop.set()
+        with self._lock:
+            if self._leading:
+                self._release()
+            self._leading = False
+
+    def _run(self):
+        while not self._stop.wait(self.lease_ttl / 3 if self._leading else self.retry_interval):
+            self._campaign()
+
+    def _campaign(self):
+        with self._lock:
+            if self._stop.is_set():
+                return
+            was_leading = self._leading
+            try:
+                self._leading = self._acquire()
+            except Exception as e:
+                logger.error(f"Scheduler leader election failed: {e}")
+                self._leading = False
+            if self._leading and not was_leading:
+                logger.info(f"{self.holder_id} is now the scheduler leader ({self.backend})")
+                self._on_elected()
+            elif was_leading and not self._leading:
+                logger.warning(f"{self.holder_id} lost scheduler leadership")
+                if self._on_deposed:
+                    self._on_deposed()
+
+    def _acquire(self) -> bool:
+        if self.backend == 'none':
+            return True
+        if self.backend == 'file':
+            return self._acquire_file()
+        return self._acquire_lease()
+
+    def _acquire_file(self) -> bool:
+        if self._lock_file is not None:
+            return True  # held until this process exits
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        lock_file.truncate(0)
+        lock_file.write(self.holder_id + '\n')
+        lock_file.flush()
+        self._lock_file = lock_file
+        return True
+
+    def _acquire_lease(self) -> bool:
+        started = time.monotonic()
+        now = datetime.utcnow()
+        lease = SchedulerLease.__table__
+        values = {'holder': self.holder_id, 'expires_at': now + timedelta(seconds=self.lease_ttl)}
+        with self.app.app_context():
+            # Renew our own lease, or take over an expired one
+            with db.engine.begin() as conn:
+                taken = conn.execute(
+                    lease.update()
+                    .where(lease.c.name == self.lease_name)
+                    .where(or_(lease.c.holder == self.holder_id, lease.c.expires_at < now))
+                    .values(**values)
+                ).rowcount == 1
+            if not taken:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(lease.insert().values(name=self.lease_name, **values))
+                    taken = True
+                except IntegrityError:
+                    taken = False  # someone else holds it
+        if taken:
+            # Measured from before the write, so we stop before anyone else can take over
+            self._deadline = started + self.lease_ttl
+        return taken
+
+    def _release(self):
+        try:
+            if self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+            elif self.backend == 'db':
+                lease = SchedulerLease.__table__
+                with self.app.app_context(), db.engine.begin() as conn:
+                    conn.execute(
+                        lease.update()
+                        .where(lease.c.name == self.lease_name, lease.c.holder == self.holder_id)
+                        .values(expires_at=datetime.utcnow())
+                    )
+        except Exception as e:
+            logger.error(f"Could not release scheduler leadership: {e}")
+
+
+scheduler_leader = SchedulerLeader()
@@ -0,0 +1,82 @@
+"""
+    Brings an existing database up to the current models at startup.
+
+    The repo has no migration history, and db.create_all() only creates missing tables: it never
+    adds a column to a table that already exists. upgrade_schema() therefore
+      - creates the missing tables (email_outbox, scheduler_leases, face_registration_jobs, ...)
+        with their indexes, via create_all;
+      - adds the columns listed in ADDED_COLUMNS to existing tables with ALTER TABLE ... ADD
+        COLUMN, then creates the indexes of those tables that are still missing;
+      - backfills the added columns (reminders.next_fire_at from each reminder's schedule).
+
+    Every step checks the live schema first, so it is safe to run on every start and from
+    several gunicorn workers at once. create_app runs it unless SCHEMA_AUTO_UPGRADE is off;
+    `flask upgrade-schema` runs it by hand.
+"""
+import logging
+
+from flask import current_app
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from ..models import db, Reminders
+from .remScheduler import schedule_reminders
+
+logger = logging.getLogger(__name__)
+
+# (model, column name) added to a table that existed before the column did
+ADDED_COLUMNS = [
+    (Reminders, 'next_fire_at'),
+]
+
+
+# (table name, column name) -> function(app) filling in the added column
+BACKFILLS = {
+    (Reminders.__tablename__, 'next_fire_at'): schedule_reminders,
+}
+
+
+def _add_column(model, name) -> bool:
+    """ALTER TABLE ... ADD COLUMN unless the column exists; True if this call added it."""
+    table = model.__table__
+    if name in {column['name'] for column in inspect(db.engine).get_columns(table.name)}:
+        return False
+    column = table.c[name]
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    except (OperationalError, ProgrammingError):
+        # Another worker added it first
+        if name not in {column['name'] for column in inspect(db.engine).get_columns(table.name)}:
+            raise
+        return False
+    logger.warning(f"Added column {table.name}.{name}")
+    return True
+
+
+def _create_missing_indexes(model):
+    table = model.__table__
+    existing = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            try:
+                index.create(db.engine)
+                logger.warning(f"Created index {index.name}")
+            except (OperationalError, ProgrammingError):
+                pass  # another worker created it
+
+
+def upgrade_schema():
+    """Create missing tables, add missing columns and indexes, backfill them. Needs an app context."""
+    try:
+        db.create_all()
+    except (OperationalError, ProgrammingError):
+        db.create_all()  # another worker created some of the tables in between; the rest now
+    for model, name in ADDED_COLUMNS:
+        added = _add_column(model, name)
+        _create_missing_indexes(model)
+        backfill = BACKFILLS.get((model.__tablename__, name))
+        if added and backfill:
+            backfill(current_app._get_current_object())
+            logger.warning(f"Backfilled {model.__tablename__}.{name}")
@@ -0,0 +1,100 @@
+"""
+    Messages rendered per second by build_email, through Flask's render_template and through
+    the precompiled EmailRenderer (with and without its cache of rendered reminder emails).
+
+    Usage (from backend/):
+        python benchmarks/email_render_benchmark.py [--messages 2000] [--distinct 50] [--repeat 3]
+
+    --distinct is how many different reminders the messages are spread over (a tick mailing
+    the same group meeting to many seniors has few distinct reminders).
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from flask import Flask, render_template
+
+import app as app_package
+from app.utils import mailService
+from app.utils.emailTemplates import CACHED_TEMPLATES, email_renderer
+from app.utils.mailService import build_email, mail
+
+
+class FlaskRenderer:
+    """What build_email used before EmailRenderer"""
+
+    @staticmethod
+    def render(name, **context):
+        return render_template(name, **context)
+
+
+def reminder_payload(number):
+    return {
+        'label': f'Medicine {number}',
+        'category': 'Medic',
+        'rem_time': datetime(2030, 1, 7, 9, 0) + timedelta(minutes=number),
+        'is_recurring': True,
+        'frequency': 'daily',
+        'weekdays': 'mon,wed,fri',
+        'times_per_day': 2,
+        'time_slots': ['09:00', '21:00'],
+        'interval': 1,
+        'is_active': True,
+    }
+
+
+def sos_payload(number):
+    return {'ezId': f'ez_sen{number:010d}', 'name': 'Senior', 'phone': '9000000000',
+            'address': 'Somewhere', 'time': datetime(2030, 1, 7, 9, 0)}
+
+
+def rate(template, payloads, subject, repeat):
+    """Best of `repeat` runs, in messages per second."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for payload in payloads:
+            build_email(subject, ['someone@example.com'], payload, template)
+        best = min(best, time.perf_counter() - start)
+    return len(payloads) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__, template_folder=os.path.join(os.path.dirname(app_package.__file__), "templates"))
+    app.config["MAIL_DEFAULT_SENDER"] = "no-reply@ezcare.com"
+    mail.init_app(app)
+    email_renderer.init_app(app)
+
+    reminders = [reminder_payload(n % args.distinct) for n in range(args.messages)]
+    sos = [sos_payload(n) for n in range(args.messages)]
+
+    with app.test_request_context():
+        for template, payloads, subject in (("reminders_template.html", reminders, "Reminder"),
+                                            ("SOS_template.html", sos, "SOS")):
+            mailService.email_renderer = FlaskRenderer()
+            flask_rate = rate(template, payloads, subject, args.repeat)
+            mailService.email_renderer = email_renderer
+            email_renderer.cache_size = 0
+            compiled_rate = rate(template, payloads, subject, args.repeat)
+
+            print(f"{template}")
+            print(f"  render_template : {flask_rate:9.0f} msg/s")
+            print(f"  precompiled     : {compiled_rate:9.0f} msg/s ({compiled_rate / flask_rate:.2f}x)")
+            if template in CACHED_TEMPLATES:
+                email_renderer.cache_size = args.distinct
+                cached_rate = rate(template, payloads, subject, args.repeat)
+                print(f"  + render cache  : {cached_rate:9.0f} msg/s ({cached_rate / flask_rate:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
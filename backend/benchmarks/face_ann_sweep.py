@@ -0,0 +1,150 @@
+"""
+    Recall / latency sweep of the ChromaDB HNSW parameters for the face collection.
+
+    Usage (from backend/):
+        python benchmarks/face_ann_sweep.py --chroma-path ./chroma_db [--collection face_embeddings]
+        python benchmarks/face_ann_sweep.py --identities 20000 [--per-identity 3]
+
+    Stored embeddings (from the real collection, or synthetic identities) are copied into
+    scratch collections built with every --m x --construction-ef combination; the real
+    collection is only read. For every --search-ef value, --queries stored embeddings
+    (optionally with --noise added) are replayed one at a time as /recognize would, with
+    n_results=--n-results. Reported against exact brute-force search:
+      - recall@n: share of the exact top-n embeddings that HNSW returned
+      - top-1 id: queries whose best ez_id (the /recognize answer) matches exact search
+      - p50 / p99 single-query latency
+    Pick the cheapest row whose recall is good enough, then apply it with
+    FACE_HNSW_* and `flask face rebuild-index`.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+from app.utils.faceIndex import ChromaFaceIndex
+
+
+def synthetic(identities, per_identity, noise, dim=512, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = rng.normal(size=(identities, dim)).astype(np.float32)
+    bases /= np.linalg.norm(bases, axis=1, keepdims=True)
+    owners = np.repeat(np.arange(identities), per_identity)
+    stored = bases[owners] + rng.normal(scale=noise, size=(len(owners), dim)).astype(np.float32)
+    return stored, [{"ez_id": f"ez-sen-{o}"} for o in owners]
+
+
+def from_collection(path, name, page_size=5000):
+    import chromadb
+
+    collection = chromadb.PersistentClient(path=path).get_collection(name)
+    embeddings, metadatas, offset = [], [], 0
+    while True:
+        page = collection.get(include=['embeddings', 'metadatas'], limit=page_size, offset=offset or None)
+        if not page['ids']:
+            break
+        embeddings.extend(page['embeddings'])
+        metadatas.extend(page['metadatas'])
+        offset += len(page['ids'])
+    return np.asarray(embeddings, dtype=np.float32), metadatas
+
+
+def best_ez_id(metadatas, distances):
+    return metadatas[int(np.argmin(distances))]['ez_id'] if distances else None
+
+
+def replay(workdir, search_ef, probes, k):
+    """Query a built collection with the given ef_search; returns (ids, best ez_id, latency ms) per probe.
+
+    Runs in a fresh process: Chroma reads ef_search when it loads the HNSW index, so a
+    process that already queried the collection would keep the old value.
+    """
+    import chromadb
+
+    client = chromadb.PersistentClient(path=workdir)
+    collection = client.get_collection("face_sweep")
+    collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+    index = ChromaFaceIndex(client, collection)
+    index.query([probes[0]], n_results=k)  # load the index
+    results = []
+    for probe in probes:
+        start = time.perf_counter()
+        result = index.query([probe], n_results=k)
+        latency = (time.perf_counter() - start) * 1000
+        results.append((result['ids'][0], best_ez_id(result['metadatas'][0], result['distances'][0]), latency))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chroma-path", help="CHROMA_DB_PATH of an existing face collection to replay")
+    parser.add_argument("--collection", default="face_embeddings")
+    parser.add_argument("--identities", type=int, default=10000)
+    parser.add_argument("--per-identity", type=int, default=3)
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 25, 50, 100, 200])
+    parser.add_argument("--n-results", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.0, help="gaussian noise added to replayed queries")
+    args = parser.parse_args()
+
+    import chromadb
+
+    if args.chroma_path:
+        stored, metadatas = from_collection(args.chroma_path, args.collection)
+    else:
+        stored, metadatas = synthetic(args.identities, args.per_identity, noise=0.04)
+    stored /= np.linalg.norm(stored, axis=1, keepdims=True)
+    ids = [f"emb_{i}" for i in range(len(stored))]
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(stored), size=min(args.queries, len(stored)), replace=False)
+    probes = stored[picks] + rng.normal(scale=args.noise, size=(len(picks), stored.shape[1])).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+
+    k = min(args.n_results, len(stored))
+    sims = probes @ stored.T
+    exact_top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    exact_sets = [{ids[i] for i in row} for row in exact_top]
+    exact_best = [metadatas[int(row[np.argmax(sims[q, row])])]['ez_id'] for q, row in enumerate(exact_top)]
+    print(f"{len(stored)} stored embeddings, {len(probes)} queries, n_results={k}")
+
+    spawn = multiprocessing.get_context('spawn')
+    print(f"{'M':>4} {'ef_c':>5} {'build s':>8} {'ef_s':>5} {'recall@n':>9} {'top-1 id':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for m in args.m:
+        for construction_ef in args.construction_ef:
+            workdir = tempfile.mkdtemp(prefix="face_ann_sweep_")
+            try:
+                client = chromadb.PersistentClient(path=workdir)
+                collection = client.create_collection(name="face_sweep", metadata={
+                    "hnsw:space": "cosine", "hnsw:M": m, "hnsw:construction_ef": construction_ef,
+                })
+                index = ChromaFaceIndex(client, collection)
+                start = time.perf_counter()
+                index.add(ids, list(stored), metadatas)
+                build_s = time.perf_counter() - start
+
+                del index, collection, client
+
+                for search_ef in args.search_ef:
+                    with spawn.Pool(1) as pool:
+                        results = pool.apply(replay, (workdir, search_ef, probes, k))
+                    latencies, recall, agree = [], 0.0, 0
+                    for q, (result_ids, best, latency) in enumerate(results):
+                        latencies.append(latency)
+                        recall += len(exact_sets[q].intersection(result_ids)) / k
+                        agree += best == exact_best[q]
+                    print(f"{m:>4} {construction_ef:>5} {build_s:>8.2f} {search_ef:>5} {recall / len(probes):>9.4f} "
+                          f"{agree / len(probes):>9.4f} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f}")
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
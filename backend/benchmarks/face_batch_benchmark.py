@@ -0,0 +1,65 @@
+"""
+    Compare the batched multi-frame embedding path against the per-frame FaceAnalysis loop.
+
+    Usage (from backend/):
+        python benchmarks/face_batch_benchmark.py path/to/registration.mp4 [--repeat 5]
+
+    Reports median latency of both paths and the cosine similarity between the
+    embeddings they produce (should be ~1.0, both paths use the same models).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+from app.utils.embedding_func import (
+    extract_frames_from_video,
+    extract_embeddings_from_frames,
+    extract_embeddings_per_frame,
+)
+from app.utils.faceProvider import face_provider
+
+
+def time_path(fn, frames, repeat):
+    timings = []
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(frames)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", help="registration video to extract frames from")
+    parser.add_argument("--max-frames", type=int, default=15)
+    parser.add_argument("--frame-interval", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ctx-id", type=int, default=-1, help="-1 for CPU")
+    args = parser.parse_args()
+
+    face_provider.configure(ctx_id=args.ctx_id)
+    with open(args.video, "rb") as f:
+        frames = extract_frames_from_video(f.read(), max_frames=args.max_frames, frame_interval=args.frame_interval)
+    print(f"{len(frames)} frames extracted")
+
+    face_provider.warm_up()
+    per_frame, per_frame_ms = time_path(extract_embeddings_per_frame, frames, args.repeat)
+    batched, batched_ms = time_path(extract_embeddings_from_frames, frames, args.repeat)
+
+    print(f"per-frame loop : {statistics.median(per_frame_ms):8.1f} ms median, {len(per_frame)} embeddings")
+    print(f"batched        : {statistics.median(batched_ms):8.1f} ms median, {len(batched)} embeddings")
+    print(f"speed-up       : {statistics.median(per_frame_ms) / statistics.median(batched_ms):8.2f}x")
+
+    if per_frame and len(per_frame) == len(batched):
+        sims = np.sum(np.stack(per_frame) * np.stack(batched), axis=1)
+        print(f"cosine similarity between paths: min {sims.min():.4f}, mean {sims.mean():.4f}")
+
+
+if __name__ == "__main__":
+    main()
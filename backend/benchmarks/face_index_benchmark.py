@@ -0,0 +1,96 @@
+"""
+    Compare the ChromaDB and NumPy face index backends on synthetic identities.
+
+    Usage (from backend/):
+        python benchmarks/face_index_benchmark.py [--sizes 1000 10000 100000] [--queries 500]
+
+    Each identity gets `--per-identity` noisy embeddings around a random unit vector;
+    queries are fresh noisy samples of random identities. For every size it reports
+    build time, p50/p99 single-query latency, recall@1 against exact (brute-force)
+    search and identity accuracy of the top hit.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+from app.utils.faceIndex import ChromaFaceIndex, NumpyFaceIndex
+
+
+def make_dataset(identities, per_identity, queries, noise, dim=512, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = rng.normal(size=(identities, dim)).astype(np.float32)
+    bases /= np.linalg.norm(bases, axis=1, keepdims=True)
+
+    owners = np.repeat(np.arange(identities), per_identity)
+    stored = bases[owners] + rng.normal(scale=noise, size=(len(owners), dim)).astype(np.float32)
+    stored /= np.linalg.norm(stored, axis=1, keepdims=True)
+
+    truth = rng.integers(0, identities, size=queries)
+    probes = bases[truth] + rng.normal(scale=noise, size=(queries, dim)).astype(np.float32)
+    probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+    return stored, owners, probes, truth
+
+
+def open_chroma(path):
+    import chromadb
+
+    client = chromadb.PersistentClient(path=path)
+    collection = client.get_or_create_collection(name="face_benchmark", metadata={"hnsw:space": "cosine"})
+    return ChromaFaceIndex(client, collection)
+
+
+def run_backend(index, stored, owners, probes, n_results):
+    ids = [f"emb_{i}" for i in range(len(stored))]
+    metadatas = [{"ez_id": f"ez-sen-{owner}"} for owner in owners]
+
+    start = time.perf_counter()
+    index.add(ids, list(stored), metadatas)
+    build_s = time.perf_counter() - start
+
+    index.query([probes[0]], n_results=n_results)  # warm caches / mmap
+    latencies, top_ids, top_owners = [], [], []
+    for probe in probes:
+        start = time.perf_counter()
+        result = index.query([probe], n_results=n_results)
+        latencies.append((time.perf_counter() - start) * 1000)
+        top_ids.append(result['ids'][0][0])
+        top_owners.append(result['metadatas'][0][0]['ez_id'])
+    return build_s, np.array(latencies), top_ids, top_owners
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--per-identity", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--n-results", type=int, default=50)
+    parser.add_argument("--noise", type=float, default=0.04, help="per-dimension gaussian noise")
+    args = parser.parse_args()
+
+    print(f"{'identities':>10} {'backend':>8} {'build s':>9} {'p50 ms':>8} {'p99 ms':>8} {'recall@1':>9} {'id acc':>7}")
+    for size in args.sizes:
+        stored, owners, probes, truth = make_dataset(size, args.per_identity, args.queries, args.noise)
+        exact = np.argmax(probes @ stored.T, axis=1)
+        exact_ids = [f"emb_{i}" for i in exact]
+        truth_ids = [f"ez-sen-{t}" for t in truth]
+
+        for name, factory in (("numpy", NumpyFaceIndex), ("chroma", open_chroma)):
+            workdir = tempfile.mkdtemp(prefix=f"face_{name}_")
+            try:
+                build_s, latencies, top_ids, top_owners = run_backend(factory(workdir), stored, owners, probes, args.n_results)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            recall = np.mean([a == b for a, b in zip(top_ids, exact_ids)])
+            accuracy = np.mean([a == b for a, b in zip(top_owners, truth_ids)])
+            print(f"{size:>10} {name:>8} {build_s:>9.2f} {np.percentile(latencies, 50):>8.2f} "
+                  f"{np.percentile(latencies, 99):>8.2f} {recall:>9.3f} {accuracy:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
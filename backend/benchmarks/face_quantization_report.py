@@ -0,0 +1,96 @@
+"""
+    Accuracy report for quantized (float16 / int8) face index storage.
+
+    Usage (from backend/):
+        python benchmarks/face_quantization_report.py [--identities 5000] [--queries 1000]
+        python benchmarks/face_quantization_report.py --from-index ./face_index
+
+    Builds a NumpyFaceIndex per dtype from the same embeddings and replays the same
+    queries against each. Reports storage size, max distance error against float32,
+    top-1 agreement, and how many /recognize decisions (distance <= 0.85 threshold,
+    over the top --n-results candidates) flip compared to float32.
+
+    --from-index replays a real float32 NumPy index (every stored embedding queries
+    the index), otherwise synthetic identities are generated.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+from app.utils.faceIndex import NumpyFaceIndex
+
+THRESHOLD = 0.85  # same distance threshold as /user-lookup/recognize
+
+
+def synthetic(identities, per_identity, queries, noise, dim=512, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = rng.normal(size=(identities, dim)).astype(np.float32)
+    bases /= np.linalg.norm(bases, axis=1, keepdims=True)
+    owners = np.repeat(np.arange(identities), per_identity)
+    stored = bases[owners] + rng.normal(scale=noise, size=(len(owners), dim)).astype(np.float32)
+    truth = rng.integers(0, identities, size=queries)
+    probes = bases[truth] + rng.normal(scale=noise, size=(queries, dim)).astype(np.float32)
+    return stored, [{"ez_id": f"ez-sen-{o}"} for o in owners], probes
+
+
+def from_index(path, queries):
+    existing = NumpyFaceIndex(path).get(include_embeddings=True)
+    stored = existing['embeddings']
+    picks = np.random.default_rng(0).choice(len(stored), size=min(queries, len(stored)), replace=False)
+    return stored, existing['metadatas'], stored[picks]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-index", help="path of an existing float32 NumPy face index to replay")
+    parser.add_argument("--identities", type=int, default=5000)
+    parser.add_argument("--per-identity", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=0.04, help="per-dimension gaussian noise")
+    parser.add_argument("--n-results", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.from_index:
+        stored, metadatas, probes = from_index(args.from_index, args.queries)
+    else:
+        stored, metadatas, probes = synthetic(args.identities, args.per_identity, args.queries, args.noise)
+    ids = [f"emb_{i}" for i in range(len(stored))]
+    print(f"{len(stored)} stored embeddings, {len(probes)} queries, threshold {THRESHOLD}")
+
+    results = {}
+    for dtype in NumpyFaceIndex.DTYPES:
+        workdir = tempfile.mkdtemp(prefix=f"face_{dtype}_")
+        try:
+            index = NumpyFaceIndex(workdir, dtype=dtype)
+            index.add(ids, list(stored), metadatas)
+            results[dtype] = (index.nbytes(), index.query(list(probes), n_results=args.n_results))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    base_bytes, base = results['float32']
+    print(f"{'dtype':>8} {'MB':>8} {'ratio':>6} {'max |dd|':>9} {'top-1 agree':>12} {'flipped':>8} {'accept f32':>11} {'accept q':>9}")
+    for dtype, (nbytes, result) in results.items():
+        max_err, agree, flipped, accepted_base, accepted_q, pairs = 0.0, 0, 0, 0, 0, 0
+        for q_ids, q_dist, b_ids, b_dist in zip(result['ids'], result['distances'], base['ids'], base['distances']):
+            agree += q_ids[0] == b_ids[0]
+            q_by_id = dict(zip(q_ids, q_dist))
+            for emb_id, distance in zip(b_ids, b_dist):
+                # candidates that fell out of the quantized top-n count as rejected
+                q_distance = q_by_id.get(emb_id, 2.0)
+                if emb_id in q_by_id:
+                    max_err = max(max_err, abs(q_distance - distance))
+                accepted_base += distance <= THRESHOLD
+                accepted_q += q_distance <= THRESHOLD
+                flipped += (distance <= THRESHOLD) != (q_distance <= THRESHOLD)
+                pairs += 1
+        print(f"{dtype:>8} {nbytes / 2**20:>8.2f} {base_bytes / nbytes:>6.1f} {max_err:>9.5f} "
+              f"{agree / len(probes):>12.4f} {flipped / pairs:>8.4%} {accepted_base:>11} {accepted_q:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,75 @@ class Config:
     MAIL_SERVER = "localhost"
     MAIL_PORT = 1025
     MAIL_DEFAULT_SENDER = 'no-reply@ezcare.com'
+    MAIL_POOL_SIZE = 4  # SMTP connections kept open per process, shared by every sender thread
+    MAIL_POOL_MAX_IDLE = 240  # seconds; closed before the server's idle timeout drops them
+    MAIL_POOL_HEALTH_CHECK = 30  # seconds idle after which a connection is checked with NOOP before use
+    MAIL_POOL_CHECKOUT_TIMEOUT = 30  # seconds to wait for a free connection
+    EMAIL_RENDER_CACHE_SIZE = 256  # rendered reminder emails kept for identical reminders; 0 = render every one
+    SCHEMA_AUTO_UPGRADE = True  # create_app adds missing tables/columns (see utils/schemaUpgrade.py); off = run `flask upgrade-schema` yourself
+    SCHEDULER_LEADER_BACKEND = os.getenv('SCHEDULER_LEADER_BACKEND', 'file')  # who runs the reminder scan: 'file' = one process per host, 'db' = one across all nodes, 'none' = every process
+    SCHEDULER_LEADER_LOCK_FILE = os.getenv('SCHEDULER_LEADER_LOCK_FILE', './instance/scheduler.lock')
+    SCHEDULER_LEASE_TTL = 30  # seconds; a 'db' leader renews every TTL / 3, a dead one is replaced after TTL
+    SCHEDULER_LEADER_RETRY = 15  # seconds between election attempts of the other processes
+    REMINDER_MISSED_GRACE = 300  # seconds; a recurring reminder found later than this after its time (e.g. after downtime) is skipped
+    REMINDER_DIGEST = True  # a senior's reminders firing in the same tick are sent as one digest email
+    REMINDER_DIGEST_WINDOW = 0  # seconds; also bring forward that senior's reminders due this soon into the digest
+    EMAIL_SENDER_THREADS = int(os.getenv('EMAIL_SENDER_THREADS', 2))  # outbox sender threads, run by the scheduler leader only; 0 = the reminder tick sends
+    EMAIL_SENDER_URGENT_THREADS = int(os.getenv('EMAIL_SENDER_URGENT_THREADS', 1))  # extra threads that only send SOS / vital alerts
+    EMAIL_SENDER_BATCH_SIZE = 100  # emails claimed at once and sent over one pooled SMTP connection
+    EMAIL_SENDER_POLL_INTERVAL = 5  # seconds; senders are also woken right after an email is queued in this process
+    EMAIL_SENDER_MAX_ATTEMPTS = 6  # then the email is marked 'failed'
+    EMAIL_SENDER_RETRY_BASE = 30  # seconds before the first retry, doubling per attempt
+    EMAIL_SENDER_RETRY_MAX = 3600
+    EMAIL_SENDER_CLAIM_TIMEOUT = 300  # seconds before emails claimed by a dead sender are handed out again
+    CHROMA_DB_PATH = os.getenv('CHROMA_DB_PATH', './chroma_db')
+    FACE_COLLECTION_NAME = 'face_embeddings'
+    FACE_MODEL_NAME = 'buffalo_l'
+    FACE_INDEX_BACKEND = os.getenv('FACE_INDEX_BACKEND', 'chroma')  # 'chroma' or 'numpy' (memory-mapped matrix, in-process search)
+    FACE_NUMPY_INDEX_PATH = os.getenv('FACE_NUMPY_INDEX_PATH', './face_index')
+    FACE_INDEX_DTYPE = os.getenv('FACE_INDEX_DTYPE', 'float32')  # numpy backend storage: 'float32', 'float16' or 'int8'
+    FACE_INDEX_MODE = os.getenv('FACE_INDEX_MODE', 'raw')  # 'raw' = every frame embedding, 'prototype' = 1-3 centroids per user
+    FACE_PROTOTYPES_PER_USER = 3
+    FACE_QUERY_N_RESULTS = int(os.getenv('FACE_QUERY_N_RESULTS', 50))  # nearest embeddings /recognize fetches before grouping by ez_id
+    FACE_HNSW_M = int(os.getenv('FACE_HNSW_M', 16))  # graph degree; changing it needs `flask face rebuild-index`
+    FACE_HNSW_CONSTRUCTION_EF = int(os.getenv('FACE_HNSW_CONSTRUCTION_EF', 100))  # build-time beam width; changing it needs a rebuild
+    FACE_HNSW_SEARCH_EF = int(os.getenv('FACE_HNSW_SEARCH_EF', 100))  # query-time beam width, applied to the existing collection on startup
+    FACE_LOCALITY_SEARCH = os.getenv('FACE_LOCALITY_SEARCH', 'false').lower() == 'true'  # search the caller's pincode(s) first, the whole index only if nothing confident is found there
+    FACE_LOCALITY_MIN_SIMILARITY = 0.65  # best local similarity needed to skip the global fallback
+    FACE_LOCALITY_MAX_PINCODES = 20  # pincodes a /recognize request may scope its search to
+    FACE_MODEL_CTX_ID = 0  # set to -1 if using CPU
+    FACE_MODEL_WARMUP = os.getenv('FACE_MODEL_WARMUP', 'false').lower() == 'true'  # start inference workers and run a dummy inference at startup
+    FACE_MODEL_DET_SIZE = tuple(int(v) for v in os.getenv('FACE_MODEL_DET_SIZE', '640x640').split('x'))  # detector input (width, height); 320x320 or 480x480 is faster for close-up kiosk photos
+    FACE_PHOTO_DECODE_MAX_SIDE = 1280  # photos are decoded (JPEG draft mode) at no less than this longer side; 0 = full resolution
+    FACE_MODEL_ALLOWED_MODULES = os.getenv('FACE_MODEL_ALLOWED_MODULES', 'detection,recognition').split(',')  # skips landmark_2d/3d and genderage models
+    FACE_MODEL_PROVIDERS = [p for p in os.getenv('FACE_MODEL_PROVIDERS', '').split(',') if p] or None  # e.g. 'CPUExecutionProvider'; None = CUDA if available, else CPU
+    FACE_MODEL_INTRA_OP_THREADS = int(os.getenv('FACE_MODEL_INTRA_OP_THREADS', 0))  # 0 = CPU cores / FACE_INFERENCE_WORKERS; lower it when several web processes share the host
+    FACE_MODEL_INTER_OP_THREADS = int(os.getenv('FACE_MODEL_INTER_OP_THREADS', 1))  # sessions run sequentially, so one is enough
+    FACE_MODEL_ALLOW_SPINNING = os.getenv('FACE_MODEL_ALLOW_SPINNING', 'false').lower() == 'true'  # busy-wait ONNX Runtime threads between ops
+    FACE_INFERENCE_WORKERS = int(os.getenv('FACE_INFERENCE_WORKERS', 1))  # model-owning processes, 0 = run in a thread of the web process
+    FACE_INFERENCE_QUEUE_SIZE = int(os.getenv('FACE_INFERENCE_QUEUE_SIZE', 4))  # jobs allowed to wait before answering 503
+    FACE_INFERENCE_TIMEOUT = 60  # seconds a request waits for its inference job
+    FACE_INFERENCE_RETRY_AFTER = 5  # seconds, sent in the Retry-After header when the queue is full
+    FACE_JOB_UPLOAD_FOLDER = os.getenv('FACE_JOB_UPLOAD_FOLDER', './face_uploads')  # registration videos waiting to be processed
+    FACE_JOB_THREADS = 2  # background registration jobs per web process
+    FACE_JOB_STALE_SECONDS = 600  # a queued/running job not updated for this long can be retried
+    FACE_REGISTRATION_MIN_FRESH = 10  # re-registrations with fewer new embeddings keep matching old ones to make up the difference
+    FACE_REGISTRATION_KEEP_SIMILARITY = 0.5  # min cosine similarity of a kept old embedding to the new ones
+    FACE_RECOGNITION_CACHE_ENABLED = os.getenv('FACE_RECOGNITION_CACHE_ENABLED', 'true').lower() == 'true'
+    FACE_RECOGNITION_CACHE_SIZE = 256  # photos remembered per web worker (LRU)
+    FACE_RECOGNITION_CACHE_TTL = 30  # seconds a cached /recognize answer stays valid
+    FACE_RECOGNITION_CACHE_MAX_DISTANCE = 6  # photos whose 256-bit dHash differs by <= this many bits share a cache entry
+    FACE_RECOGNITION_CACHE_STAMP = os.getenv('FACE_RECOGNITION_CACHE_STAMP', './face_uploads/recognition_cache.stamp')  # touched to invalidate every worker's cache
+    FACE_METRICS_ENABLED = os.getenv('FACE_METRICS_ENABLED', 'true').lower() == 'true'  # per-stage latency histograms served on /metrics
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # bearer token for Prometheus on /metrics and /user-lookup/recognize/cache; moderators' JWTs work too
+    FACE_BATCH_MAX_IMAGES = 10  # photos accepted by /user-lookup/recognize/batch
+    FACE_BATCH_MAX_IMAGE_BYTES = 15 * 1024 * 1024
+    FACE_BATCH_MAX_ARCHIVE_BYTES = 64 * 1024 * 1024  # total uncompressed photo bytes a batch zip may inflate to
+    FACE_BATCH_MAX_ARCHIVE_MEMBERS = 100  # entries (of any kind) allowed in a batch zip
+    FACE_FRAME_MIN_SHARPNESS = 60.0  # Laplacian variance below this counts as blurred
+    FACE_FRAME_MIN_BRIGHTNESS = 40.0  # mean gray level (0-255)
+    FACE_FRAME_MAX_BRIGHTNESS = 220.0
+    FACE_FRAME_DEDUP_DISTANCE = 3  # frames whose dHash differs by <= this many bits are duplicates
 
 
 class DevelopmentConfig(Config):
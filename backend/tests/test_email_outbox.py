@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import db, EmailOutbox
+from app.utils import emailOutbox
+from app.utils.emailOutbox import (
+    EmailSender, PRIORITY_LOGIN, PRIORITY_REMINDER, PRIORITY_URGENT,
+    decode_payload, encode_payload, queue_email,
+)
+
+
+class FakePool:
+    """smtp_pool stand-in: records subjects, fails the ones listed in `failing`"""
+
+    def __init__(self):
+        self.sent = []
+        self.failing = set()
+        self.batches = 0
+
+    def send_many(self, messages):
+        self.batches += 1
+        errors = []
+        for message in messages:
+            if message in self.failing:
+                errors.append(ConnectionError("SMTP down"))
+            else:
+                self.sent.append(message)
+                errors.append(None)
+        return errors
+
+
+@pytest.fixture
+def mail(app, monkeypatch):
+    fake = FakePool()
+    monkeypatch.setattr(emailOutbox, 'smtp_pool', fake)
+    monkeypatch.setattr(emailOutbox, 'build_email', lambda **email: email['subject'])
+    return fake
+
+
+@pytest.fixture
+def sender():
+    return EmailSender()
+
+
+class TestPayload:
+    def test_datetimes_round_trip(self):
+        payload = {'name': 'Sen', 'time': datetime(2030, 1, 7, 9, 30)}
+        encoded = encode_payload(payload)
+        assert encoded['time'] == {'$datetime': '2030-01-07T09:30:00'}
+        assert decode_payload(encoded) == payload
+
+    def test_nested_datetimes_round_trip(self):
+        payload = {'reminders': [{'label': 'Pill', 'rem_time': datetime(2030, 1, 7, 9, 0)}]}
+        assert decode_payload(encode_payload(payload)) == payload
+
+
+class TestEmailSender:
+    """Claiming, priority lanes and retries of the email outbox"""
+
+    def test_nothing_is_queued_until_commit(self, mail, sender):
+        queue_email('Reminder', ['a@example.com'])
+        db.session.rollback()
+        assert sender.deliver() == {"sent": 0, "failed": 0}
+
+    def test_most_urgent_first_in_one_batch(self, mail, sender):
+        queue_email('Reminder', ['a@example.com'], priority=PRIORITY_REMINDER)
+        queue_email('Login', ['a@example.com'], priority=PRIORITY_LOGIN)
+        queue_email('SOS', ['a@example.com'], priority=PRIORITY_URGENT)
+        db.session.commit()
+
+        assert sender.deliver() == {"sent": 3, "failed": 0}
+        assert mail.sent == ['SOS', 'Login', 'Reminder']
+        assert mail.batches == 1
+        email = EmailOutbox.query.filter_by(subject='Login').one()
+        assert (email.status, email.payload, email.claimed_by) == ('sent', None, None)
+
+    def test_urgent_lane_only_takes_urgent_rows(self, mail, sender):
+        queue_email('Reminder', ['a@example.com'])
+        queue_email('SOS', ['a@example.com'], priority=PRIORITY_URGENT)
+        db.session.commit()
+
+        assert sender.deliver(max_priority=PRIORITY_URGENT) == {"sent": 1, "failed": 0}
+        assert mail.sent == ['SOS']
+        assert EmailOutbox.query.filter_by(subject='Reminder').one().status == 'pending'
+
+    def test_failures_back_off_then_give_up(self, mail, sender):
+        sender.max_attempts = 2
+        mail.failing.add('Reminder')
+        queue_email('Reminder', ['a@example.com'], reminder_display={'label': 'Medicine'})
+        queue_email('Other', ['b@example.com'])
+        db.session.commit()
+
+        assert sender.deliver() == {"sent": 1, "failed": 1}
+        email = EmailOutbox.query.filter_by(subject='Reminder').one()
+        assert (email.status, email.attempts, email.error) == ('pending', 1, "SMTP down")
+        assert email.payload == {'label': 'Medicine'}  # still needed for the retry
+        assert email.next_attempt_at > datetime.utcnow() + timedelta(seconds=sender.retry_base - 5)
+
+        # Not due yet
+        assert sender.deliver() == {"sent": 0, "failed": 0}
+
+        email.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert sender.deliver() == {"sent": 0, "failed": 1}
+        db.session.refresh(email)
+        assert (email.status, email.attempts, email.payload) == ('failed', 2, None)
+
+    def test_backoff_doubles_up_to_max(self, sender):
+        assert [sender.backoff(n).total_seconds() for n in (1, 2, 3)] == [30, 60, 120]
+        assert sender.backoff(20).total_seconds() == sender.retry_max
+
+    def test_stale_claims_are_released(self, mail, sender):
+        queue_email('Reminder', ['a@example.com'])
+        db.session.commit()
+        email = EmailOutbox.query.one()
+        email.status, email.claimed_by = 'sending', 'dead-worker'
+        email.claimed_at = datetime.utcnow() - timedelta(seconds=sender.claim_timeout + 1)
+        db.session.commit()
+
+        assert sender.deliver() == {"sent": 1, "failed": 0}
+        db.session.refresh(email)
+        assert email.status == 'sent'
+
+    def test_restart_replaces_the_sender_threads(self, app, mail, sender):
+        sender.app, sender.threads, sender.urgent_threads, sender.poll_interval = app, 1, 1, 0.05
+        sender.start()
+        first = list(sender._workers)
+        sender.stop()
+        assert not sender.running
+        sender.start()
+        assert sender.running and len(sender._workers) == 2
+        for worker in first:
+            worker.join(timeout=2)
+            assert not worker.is_alive()
+        sender.stop()
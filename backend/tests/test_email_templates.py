@@ -0,0 +1,70 @@
+import os
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+import app as app_package
+from app.utils.emailOutbox import decode_payload, encode_payload
+from app.utils.emailTemplates import EMAIL_TEMPLATES, EmailRenderer
+from app.utils.mailService import build_email, mail
+
+
+@pytest.fixture
+def mail_app():
+    app = Flask(__name__, template_folder=os.path.join(os.path.dirname(app_package.__file__), "templates"))
+    app.config["MAIL_DEFAULT_SENDER"] = "no-reply@ezcare.com"
+    mail.init_app(app)
+    with app.app_context():
+        yield app
+
+
+def reminder_display(label='Medicine'):
+    return {'label': label, 'category': 'Medic', 'rem_time': datetime(2030, 1, 7, 9, 0), 'is_recurring': True,
+            'frequency': 'daily', 'weekdays': None, 'times_per_day': None, 'time_slots': ['09:00'],
+            'interval': 1, 'is_active': True}
+
+
+class TestEmailRenderer:
+    """Templates compiled once, rendered reminder emails cached"""
+
+    def test_all_templates_compile_at_startup(self, mail_app):
+        renderer = EmailRenderer(mail_app)
+        assert sorted(renderer._templates) == sorted(EMAIL_TEMPLATES)
+
+    def test_reminder_email_uses_the_template(self, mail_app):
+        msg = build_email('Reminder', ['a@example.com'], reminder_display(), "reminders_template.html")
+        assert 'Monday, January 07, 2030' in msg.html
+        assert 'Medicine' in msg.body
+
+    def test_digest_lists_every_reminder(self, mail_app):
+        payload = decode_payload(encode_payload({'reminders': [reminder_display('Pill A'), reminder_display('Pill B')]}))
+        msg = build_email('Reminders', ['a@example.com'], payload, "reminder_digest_template.html")
+        assert 'You have 2 scheduled reminders' in msg.html
+        assert 'Pill A' in msg.html and 'Pill B' in msg.html
+        assert '- Pill B at 09:00 AM' in msg.body
+
+    def test_identical_reminders_render_once(self, mail_app, monkeypatch):
+        renderer = EmailRenderer(mail_app)
+        template = renderer._templates["reminders_template.html"]
+        calls = []
+        monkeypatch.setattr(template, 'render', lambda context: calls.append(context) or context.get('reminder', {}).get('label'))
+
+        assert renderer.render("reminders_template.html", reminder=reminder_display()) == 'Medicine'
+        assert renderer.render("reminders_template.html", reminder=reminder_display()) == 'Medicine'
+        assert renderer.render("reminders_template.html", reminder=reminder_display('Walk')) == 'Walk'
+        assert len(calls) == 2
+
+        renderer.render("reminders_template.html", contact=object())  # not JSON: never cached
+        renderer.render("reminders_template.html", contact=object())
+        assert len(calls) == 4
+
+    def test_cache_is_bounded_and_skips_login_links(self, mail_app):
+        renderer = EmailRenderer(mail_app)
+        renderer.cache_size = 2
+        for label in ('a', 'b', 'c'):
+            renderer.render("reminders_template.html", reminder=reminder_display(label), current_year=2030)
+        assert len(renderer._rendered) == 2
+
+        renderer.render("login_template.html", user_name='Sen', login_url='https://example.com/?token=secret')
+        assert all(name == "reminders_template.html" for name, _ in renderer._rendered)
@@ -0,0 +1,266 @@
+import io
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.utils.embedding_func import (
+    build_prototypes, select_kept_embeddings, decode_photo, detect_face_crop, search_faces,
+    set_identity_pincode, extract_embeddings_from_frames, extract_embeddings_from_images, extract_frames_from_video, iter_video_frames, video_source
+)
+from app.utils import embedding_func
+from app.utils.faceIndex import NumpyFaceIndex
+from app.utils.faceProvider import face_provider
+
+
+def normalized(rows):
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+class TestBuildPrototypes:
+    """Clustering of registration embeddings into per-user prototypes"""
+
+    def make_user(self, seed, count, spread=0.3):
+        rng = np.random.default_rng(seed)
+        base = rng.normal(size=512)
+        return list(normalized(base + rng.normal(scale=spread, size=(count, 512))))
+
+    def test_prototype_count_scales_with_embeddings(self):
+        assert len(build_prototypes(self.make_user(0, 4))[0]) == 1
+        assert len(build_prototypes(self.make_user(0, 10))[0]) == 2
+        assert len(build_prototypes(self.make_user(0, 15))[0]) == 3
+        assert len(build_prototypes(self.make_user(0, 15), max_prototypes=1)[0]) == 1
+
+    def test_prototypes_are_normalized_and_cover_all_embeddings(self):
+        embeddings = self.make_user(1, 15)
+        prototypes, support = build_prototypes(embeddings)
+        for prototype in prototypes:
+            assert prototype.dtype == np.float32
+            assert np.linalg.norm(prototype) == pytest.approx(1.0, abs=1e-5)
+        assert sum(support) == len(embeddings)
+
+    def test_prototypes_stay_close_to_their_user(self):
+        user = self.make_user(2, 15)
+        other = self.make_user(3, 15)
+        prototypes, _ = build_prototypes(user)
+        own = np.max(np.stack(prototypes) @ np.stack(user).T, axis=0).mean()
+        foreign = np.max(np.stack(prototypes) @ np.stack(other).T, axis=0).mean()
+        assert own > 0.8
+        assert foreign < 0.3
+
+
+class StubFaceModel:
+    """insightface-like model: a face in every frame brighter than mid-grey, batch sizes recorded"""
+    LANDMARKS = np.array([[0.40, 0.40], [0.60, 0.40], [0.50, 0.50], [0.42, 0.60], [0.58, 0.60]])
+
+    def __init__(self):
+        self.det_size = (640, 640)
+        self.det_model = self
+        self.detected = 0
+        self.batches = []
+        recognition = type('StubRecognition', (), {'input_size': (112, 112), 'get_feat': self.get_feat})()
+        self.models = {'recognition': recognition}
+
+    def detect(self, img, max_num=0, metric='default'):
+        self.detected += 1
+        if img.mean() < 128:
+            return np.zeros((0, 5)), None
+        height, width = img.shape[:2]
+        return np.array([[0.3 * width, 0.3 * height, 0.7 * width, 0.7 * height, 0.99]]), (self.LANDMARKS * [width, height])[None]
+
+    def get_feat(self, crops):
+        self.batches.append(len(crops))
+        return np.stack([np.full(512, crop.mean() + 1.0, dtype=np.float32) for crop in crops])
+
+
+class TestBatchedFrameEmbeddings:
+    """Detection per frame, recognition batched over the crops of every frame"""
+
+    def test_recognition_runs_in_batches_over_frames_with_a_face(self, monkeypatch):
+        model = StubFaceModel()
+        monkeypatch.setattr(face_provider, '_model', model)
+        frames = [np.full((200, 200, 3), value, dtype=np.uint8) for value in (200, 50, 210, 220, 230, 240)]
+
+        embeddings = extract_embeddings_from_frames(frames, batch_size=3)
+        assert model.detected == 6
+        assert model.batches == [3, 2]
+        assert len(embeddings) == 5
+        assert all(emb.dtype == np.float32 and np.linalg.norm(emb) == pytest.approx(1.0, abs=1e-5) for emb in embeddings)
+
+    def test_model_without_recognition_falls_back_to_per_frame(self, monkeypatch):
+        face = type('Face', (), {'bbox': np.array([0, 0, 10, 10]), 'embedding': np.ones(512, dtype=np.float32)})()
+        model = type('FullModel', (), {'models': {}, 'get': lambda self, frame: [face]})()
+        monkeypatch.setattr(face_provider, '_model', model)
+        assert len(extract_embeddings_from_frames([np.zeros((20, 20, 3), dtype=np.uint8)] * 2)) == 2
+
+    def test_photos_without_recognition_model_fall_back_to_per_photo(self, monkeypatch):
+        face = type('Face', (), {'bbox': np.array([0, 0, 10, 10]), 'embedding': np.ones(512, dtype=np.float32)})()
+        model = type('FullModel', (), {'models': {}, 'get': lambda self, img: [face] if img.mean() > 100 else []})()
+        monkeypatch.setattr(face_provider, '_model', model)
+        photos = []
+        for value in (200, 10):
+            buffer = io.BytesIO()
+            Image.new('RGB', (32, 32), (value,) * 3).save(buffer, format='PNG')
+            photos.append(buffer.getvalue())
+
+        embeddings = extract_embeddings_from_images(photos)
+        assert embeddings[1] is None
+        assert np.linalg.norm(embeddings[0]) == pytest.approx(1.0, abs=1e-5)
+
+
+class TestVideoFrames:
+    """Frames streamed from an in-memory video: sampling stride, early stop, source cleanup"""
+
+    @pytest.fixture
+    def video(self, tmp_path):
+        """20 grey frames, frame i has brightness 10 * i"""
+        path = str(tmp_path / 'clip.avi')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+        for i in range(20):
+            writer.write(np.full((48, 64, 3), 10 * i, dtype=np.uint8))
+        writer.release()
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @pytest.fixture
+    def grabs(self, monkeypatch):
+        """Number of frames grabbed from each capture opened"""
+        grabs = []
+        VideoCapture = cv2.VideoCapture
+
+        class CountingCapture:
+            def __init__(self, path):
+                self.cap = VideoCapture(path)
+                grabs.append(0)
+
+            def grab(self):
+                grabs[-1] += 1
+                return self.cap.grab()
+
+            def __getattr__(self, name):
+                return getattr(self.cap, name)
+
+        monkeypatch.setattr(embedding_func.cv2, 'VideoCapture', CountingCapture)
+        return grabs
+
+    def test_every_nth_frame_is_yielded(self, video):
+        frames = list(iter_video_frames(video, frame_interval=5))
+        assert len(frames) == 4
+        assert [round(frame.mean() / 10) for frame in frames] == [0, 5, 10, 15]
+        assert frames[0].shape == (48, 64, 3)
+
+    def test_decoding_stops_at_the_frame_cap(self, video, grabs):
+        frames = extract_frames_from_video(video, max_frames=2, frame_interval=5)
+        assert len(frames) == 2
+        assert grabs == [6]  # frames 0..5, nothing after the second sampled frame
+
+    def test_memory_file_is_closed_after_reading(self, video):
+        open_fds = len(os.listdir('/proc/self/fd'))
+        with video_source(video) as path:
+            assert path.startswith('/proc/self/fd/')
+            assert len(os.listdir('/proc/self/fd')) == open_fds + 1
+        assert len(os.listdir('/proc/self/fd')) == open_fds
+
+    def test_temp_file_fallback_is_removed(self, video, monkeypatch):
+        monkeypatch.delattr(os, 'memfd_create')
+        with video_source(io.BytesIO(video)) as path:
+            assert os.path.getsize(path) == len(video)
+            assert len(list(iter_video_frames(path, frame_interval=10))) == 2
+        assert not os.path.exists(path)
+
+
+class TestSelectKeptEmbeddings:
+    """Which old embeddings survive a re-registration with few fresh frames"""
+
+    def test_keeps_closest_matching_rows_up_to_limit(self):
+        rng = np.random.default_rng(3)
+        person, stranger = rng.normal(size=512), rng.normal(size=512)
+        old = normalized([person + rng.normal(scale=0.2, size=512) for _ in range(4)] + [stranger])
+        existing = {"ids": [f"old_{i}" for i in range(5)], "embeddings": old}
+        fresh = list(normalized([person + rng.normal(scale=0.2, size=512) for _ in range(3)]))
+
+        kept = select_kept_embeddings(existing, fresh, limit=10)
+        assert sorted(kept) == ["old_0", "old_1", "old_2", "old_3"]
+        assert len(select_kept_embeddings(existing, fresh, limit=2)) == 2
+        assert select_kept_embeddings(existing, fresh, limit=0) == []
+
+
+class TestLocalitySearch:
+    """Pincode-scoped face search with a global fallback"""
+
+    @pytest.fixture
+    def faces(self, tmp_path, monkeypatch):
+        rng = np.random.default_rng(0)
+        faces = normalized(rng.normal(size=(4, 512)))
+        index = NumpyFaceIndex(str(tmp_path))
+        index.add(
+            ["near", "far", "twin", "unset"], list(faces),
+            [{"ez_id": "ez-1", "pincode": "600001"}, {"ez_id": "ez-2", "pincode": "600002"},
+             {"ez_id": "ez-3", "pincode": "600001"}, {"ez_id": "ez-4"}]
+        )
+        monkeypatch.setattr(face_provider, '_index', index)
+        return faces
+
+    def test_confident_local_match_skips_global_search(self, faces):
+        result = search_faces([faces[0]], n_results=5, pincodes=["600001"], min_similarity=0.65)
+        assert result["scopes"] == ["locality"]
+        assert result["ids"][0] == ["near", "twin"]
+
+    def test_rows_without_confident_local_match_fall_back(self, faces):
+        result = search_faces([faces[0], faces[1]], n_results=1, pincodes=["600001"], min_similarity=0.65)
+        assert result["scopes"] == ["locality", "global"]
+        assert [ids[0] for ids in result["ids"]] == ["near", "far"]
+
+    def test_no_pincodes_searches_globally(self, faces):
+        result = search_faces([faces[3]], n_results=1)
+        assert (result["scopes"], result["ids"]) == (["global"], [["unset"]])
+
+    def test_set_identity_pincode_moves_embeddings(self, faces):
+        assert set_identity_pincode("ez-4", "600001") == 1
+        assert set_identity_pincode("ez-4", "600001") == 0
+        result = search_faces([faces[3]], n_results=1, pincodes=["600001"], min_similarity=0.65)
+        assert (result["scopes"], result["ids"]) == (["locality"], [["unset"]])
+
+
+class TestPhotoDownscaling:
+    """Draft-mode decoding of large photos; the detector gets the decoded frame as is"""
+
+    class StubDetector:
+        """Reports one face whose landmarks sit at fixed fractions of the image it is given"""
+        LANDMARKS = np.array([[0.40, 0.40], [0.60, 0.40], [0.50, 0.50], [0.42, 0.60], [0.58, 0.60]])
+
+        def __init__(self):
+            self.seen = []
+
+        def detect(self, img, max_num=0, metric='default'):
+            self.seen.append(img.shape)
+            height, width = img.shape[:2]
+            kps = self.LANDMARKS * [width, height]
+            return np.array([[0.3 * width, 0.3 * height, 0.7 * width, 0.7 * height, 0.99]]), kps[None]
+
+    @pytest.fixture
+    def detector(self, monkeypatch):
+        detector = self.StubDetector()
+        model = type('StubModel', (), {'det_size': (640, 640), 'det_model': detector, 'models': {}})()
+        monkeypatch.setattr(face_provider, '_model', model)
+        return detector
+
+    def test_jpeg_decoded_at_reduced_scale(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 3000), (120, 80, 40)).save(buffer, format='JPEG')
+        assert decode_photo(buffer.getvalue()).shape == (3000, 4000, 3)
+        assert decode_photo(buffer.getvalue(), max_side=1280).shape == (1500, 2000, 3)
+
+    def test_crop_uses_the_detector_landmarks_on_the_full_frame(self, detector):
+        from insightface.utils import face_align
+
+        rng = np.random.default_rng(0)
+        frame = (rng.random((1500, 2000, 3)) * 255).astype(np.uint8)
+        crop = detect_face_crop(frame, image_size=112)
+
+        assert detector.seen == [(1500, 2000, 3)]  # no extra resample: RetinaFace letterboxes to det_size itself
+        expected = face_align.norm_crop(frame, landmark=self.StubDetector.LANDMARKS * [2000, 1500], image_size=112)
+        assert np.array_equal(crop, expected)
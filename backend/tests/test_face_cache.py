@@ -0,0 +1,78 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.utils.faceCache import RecognitionCache
+
+
+def jpeg(pixels, quality=90):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+class TestRecognitionCache:
+    """Perceptual-hash LRU/TTL cache in front of /user-lookup/recognize"""
+
+    @pytest.fixture
+    def photo(self):
+        rng = np.random.default_rng(0)
+        small = rng.integers(0, 255, size=(24, 24, 3), dtype=np.uint8)
+        return np.asarray(Image.fromarray(small).resize((240, 240), Image.BILINEAR))
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        cache = RecognitionCache()
+        cache.stamp_path = str(tmp_path / 'cache.stamp')
+        return cache
+
+    def test_reencoded_photo_hits(self, cache, photo):
+        key = cache.photo_hash(jpeg(photo, quality=90))
+        assert cache.get(key) is None
+        cache.put(key, ({"matches": []}, 200), cache.generation)
+
+        assert cache.get(cache.photo_hash(jpeg(photo, quality=70))) == ({"matches": []}, 200)
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+    def test_different_photo_misses(self, cache, photo):
+        cache.put(cache.photo_hash(jpeg(photo)), ({}, 200), cache.generation)
+        assert cache.get(cache.photo_hash(jpeg(np.ascontiguousarray(photo[::-1])))) is None
+
+    def test_undecodable_photo_is_not_cached(self, cache):
+        assert cache.photo_hash(b'not an image') is None
+        assert cache.get(None) is None
+        assert cache.stats()["misses"] == 0
+
+    def test_entries_expire_and_are_bounded(self, cache):
+        cache.max_distance = 0
+        cache.max_entries = 2
+        for key in (1, 2, 3):
+            cache.put(key, key, cache.generation)
+        assert cache.get(1) is None
+        assert cache.stats()["evictions"] == 1
+
+        cache.ttl = -1
+        assert cache.get(3) is None
+
+    def test_invalidate_reaches_other_processes(self, cache, tmp_path):
+        other = RecognitionCache()
+        other.stamp_path = cache.stamp_path
+        other.put(7, "stale", other.generation)
+
+        cache.invalidate()
+        assert other.get(7) is None
+
+    def test_result_computed_before_invalidation_is_dropped(self, cache):
+        generation = cache.generation
+        cache.invalidate()
+        cache.put(5, "stale", generation)
+        assert cache.get(5) is None
+
+    def test_scoped_searches_do_not_share_entries(self, cache, photo):
+        data = jpeg(photo)
+        cache.put(cache.photo_hash(data, scope='600001'), "local", cache.generation)
+        assert cache.get(cache.photo_hash(data)) is None
+        assert cache.get(cache.photo_hash(data, scope='600002')) is None
+        assert cache.get(cache.photo_hash(jpeg(photo, quality=70), scope='600001')) == "local"
@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+from flask import Flask
+
+from app.cli import face_cli, read_enrollment_source, read_progress_log
+from app.utils.faceProvider import face_provider
+
+
+class TestEnrollBulkInputs:
+    """Source layouts and the resumable progress log of `flask face enroll-bulk`"""
+
+    def test_directory_layout(self, tmp_path):
+        (tmp_path / 'ez-1.mp4').write_bytes(b'')
+        (tmp_path / 'ez-2').mkdir()
+        (tmp_path / 'ez-2' / 'front.jpg').write_bytes(b'')
+        (tmp_path / 'ez-2' / 'side.png').write_bytes(b'')
+        (tmp_path / 'ez-3').mkdir()
+        (tmp_path / 'notes.txt').write_text('')
+
+        entries = read_enrollment_source(str(tmp_path))
+        assert entries == {
+            'ez-1': [str(tmp_path / 'ez-1.mp4')],
+            'ez-2': [str(tmp_path / 'ez-2' / 'front.jpg'), str(tmp_path / 'ez-2' / 'side.png')],
+        }
+
+    def test_csv_manifest_paths_are_relative_to_it(self, tmp_path):
+        manifest = tmp_path / 'manifest.csv'
+        manifest.write_text('ez_id,path\nez-1,media/a.mp4\nez-1,media/b.jpg\n,media/c.jpg\n')
+
+        assert read_enrollment_source(str(manifest)) == {
+            'ez-1': [str(tmp_path / 'media' / 'a.mp4'), str(tmp_path / 'media' / 'b.jpg')],
+        }
+
+    def test_progress_log_keeps_last_status_and_ignores_torn_line(self, tmp_path):
+        log = tmp_path / 'run.jsonl'
+        log.write_text(
+            json.dumps({'ez_id': 'ez-1', 'status': 'failed'}) + '\n'
+            + json.dumps({'ez_id': 'ez-1', 'status': 'enrolled'}) + '\n'
+            + '{"ez_id": "ez-2", "sta'
+        )
+        assert read_progress_log(str(log)) == {'ez-1': 'enrolled'}
+        assert read_progress_log(str(tmp_path / 'missing.jsonl')) == {}
+
+
+class TestRebuildIndex:
+    """`flask face rebuild-index` copies the collection into one built with new HNSW parameters"""
+
+    def test_rebuild_keeps_every_embedding(self, tmp_path, monkeypatch):
+        for name, value in [('chroma_path', str(tmp_path)), ('collection_name', 'faces'), ('index_backend', 'chroma'),
+                            ('hnsw_m', 16), ('hnsw_construction_ef', 100), ('hnsw_search_ef', 100),
+                            ('_client', None), ('_collection', None), ('_index', None)]:
+            monkeypatch.setattr(face_provider, name, value)
+        rng = np.random.default_rng(0)
+        face_provider.index.add([f"emb_{i}" for i in range(25)], list(rng.normal(size=(25, 512)).astype(np.float32)),
+                                [{"ez_id": f"ez-{i // 5}"} for i in range(25)])
+        app = Flask(__name__)
+        app.cli.add_command(face_cli)
+
+        result = app.test_cli_runner().invoke(args=['face', 'rebuild-index', '--m', '8', '--search-ef', '40', '--page-size', '10'])
+        assert result.exit_code == 0, result.output
+        assert "copied 25/25" in result.output
+
+        rebuilt = face_provider.client.get_collection('faces')
+        hnsw = rebuilt.configuration_json['hnsw']
+        assert (hnsw['max_neighbors'], hnsw['ef_construction'], hnsw['ef_search']) == (8, 100, 40)
+        assert rebuilt.count() == 25
+        assert [c.name for c in face_provider.client.list_collections()] == ['faces']
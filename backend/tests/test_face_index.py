@@ -0,0 +1,103 @@
+import fcntl
+import threading
+
+import numpy as np
+import pytest
+
+from app.utils.faceIndex import NumpyFaceIndex
+
+
+class TestNumpyFaceIndex:
+    """Memory-mapped NumPy face index backend"""
+
+    @pytest.fixture
+    def embeddings(self):
+        rng = np.random.default_rng(0)
+        rows = rng.normal(size=(30, 512)).astype(np.float32)
+        return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+    @pytest.fixture
+    def index(self, tmp_path, embeddings):
+        index = NumpyFaceIndex(str(tmp_path))
+        index.add(
+            [f"emb_{i}" for i in range(30)],
+            list(embeddings),
+            [{"ez_id": f"ez-sen-{i // 3}", "pincode": str(600000 + i % 2)} for i in range(30)]
+        )
+        return index
+
+    def test_query_returns_nearest_first_with_cosine_distance(self, index, embeddings):
+        result = index.query([embeddings[7]], n_results=3)
+        assert result["ids"][0][0] == "emb_7"
+        assert result["metadatas"][0][0]["ez_id"] == "ez-sen-2"
+        assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+        assert result["distances"][0] == sorted(result["distances"][0])
+
+    def test_query_multiple_vectors(self, index, embeddings):
+        result = index.query([embeddings[1], embeddings[20]], n_results=2)
+        assert [ids[0] for ids in result["ids"]] == ["emb_1", "emb_20"]
+
+    def test_query_with_where_filter(self, index, embeddings):
+        result = index.query([embeddings[7]], n_results=50, where={"pincode": {"$in": ["600000"]}})
+        assert len(result["ids"][0]) == 15
+        assert all(m["pincode"] == "600000" for m in result["metadatas"][0])
+
+    def test_get_and_delete_by_ez_id(self, index):
+        existing = index.get(where={"ez_id": "ez-sen-4"}, include_embeddings=True)
+        assert existing["ids"] == ["emb_12", "emb_13", "emb_14"]
+        assert existing["embeddings"].shape == (3, 512)
+        index.delete(existing["ids"])
+        assert index.count() == 27
+        assert index.get(where={"ez_id": "ez-sen-4"})["ids"] == []
+
+    def test_other_instances_see_writes(self, index, tmp_path, embeddings):
+        reader = NumpyFaceIndex(str(tmp_path))
+        assert reader.count() == 30
+        index.delete(["emb_0"])
+        assert reader.count() == 29
+
+    def test_reload_waits_for_a_rewrite_in_progress(self, index, tmp_path):
+        reader = NumpyFaceIndex(str(tmp_path))
+        counts = []
+        with open(tmp_path / '.lock', 'a') as lock:
+            # Another process mid-rewrite: the new metadata.json is in place, its lock still held
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with index._lock:
+                index._write(index._matrix[1:], None, index._ids[1:], index._metadatas[1:])
+            thread = threading.Thread(target=lambda: counts.append(reader.count()))
+            thread.start()
+            thread.join(timeout=0.3)
+            assert thread.is_alive() and counts == []
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        thread.join(timeout=2)
+        assert counts == [29]
+
+    @pytest.mark.parametrize("dtype", ["float16", "int8"])
+    def test_quantized_storage_matches_float32(self, tmp_path, index, embeddings, dtype):
+        quantized = NumpyFaceIndex(str(tmp_path / dtype), dtype=dtype)
+        quantized.add([f"emb_{i}" for i in range(30)], list(embeddings), [{"ez_id": f"ez-sen-{i // 3}"} for i in range(30)])
+        assert quantized.nbytes() < index.nbytes()
+
+        expected = index.query(list(embeddings[:5]), n_results=5)
+        result = quantized.query(list(embeddings[:5]), n_results=5)
+        assert [ids[0] for ids in result["ids"]] == [ids[0] for ids in expected["ids"]]
+        assert np.allclose(result["distances"], expected["distances"], atol=5e-3)
+        assert quantized.get(include_embeddings=True)["embeddings"].dtype == np.float32
+
+    def test_replace_identity_swaps_rows_in_one_write(self, index, embeddings):
+        version = index._disk_version()
+        index.replace_identity("ez-sen-4", ["new_0"], [embeddings[0]], [{"ez_id": "ez-sen-4"}], keep_ids=["emb_13"])
+        assert index.get(where={"ez_id": "ez-sen-4"})["ids"] == ["emb_13", "new_0"]
+        assert index.count() == 29
+        assert index._disk_version() != version
+
+        result = index.query([embeddings[0]], n_results=2, where={"ez_id": "ez-sen-4"})
+        assert result["ids"][0][0] == "new_0"
+        assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+
+    def test_update_metadatas_merges_and_deletes_keys(self, index, tmp_path):
+        index.update_metadatas(["emb_0", "emb_1", "missing"], [{"pincode": "700001"}, {"pincode": None}, {"pincode": "1"}])
+        metadatas = index.get(where={"ez_id": "ez-sen-0"})["metadatas"]
+        assert metadatas[0] == {"ez_id": "ez-sen-0", "pincode": "700001"}
+        assert metadatas[1] == {"ez_id": "ez-sen-0"}
+        assert NumpyFaceIndex(str(tmp_path)).get(where={"pincode": "700001"})["ids"] == ["emb_0"]
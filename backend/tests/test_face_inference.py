@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.utils.faceInference import FaceInferencePool, InferenceQueueFull, InferenceTimeout
+
+
+class TestFaceInferencePool:
+    """Backpressure and timeout behaviour of the face inference pool (in-process mode)"""
+
+    def make_pool(self, queue_size=1):
+        pool = FaceInferencePool()
+        pool.workers = 0  # thread mode, no model or subprocess needed
+        pool.queue_size = queue_size
+        pool.retry_after = 7
+        return pool
+
+    def test_run_returns_result(self):
+        pool = self.make_pool()
+        try:
+            assert pool.run(pow, 2, 10) == 1024
+        finally:
+            pool.shutdown()
+
+    def test_submit_raises_when_full(self):
+        pool = self.make_pool(queue_size=1)
+        release = threading.Event()
+        try:
+            futures = [pool.submit(release.wait) for _ in range(pool.capacity)]
+            with pytest.raises(InferenceQueueFull) as err:
+                pool.submit(release.wait)
+            assert err.value.retry_after == 7
+        finally:
+            release.set()
+            for future in futures:
+                future.result()
+            pool.shutdown()
+
+    def test_slot_freed_after_job_finishes(self):
+        pool = self.make_pool(queue_size=1)
+        try:
+            for _ in range(3):
+                assert pool.run(pow, 3, 2) == 9
+            assert pool.in_flight == 0
+        finally:
+            pool.shutdown()
+
+    def test_dead_worker_pool_is_replaced(self):
+        pool = FaceInferencePool()
+        pool.workers = 1
+        try:
+            with pytest.raises(BrokenProcessPool):
+                pool.run(os._exit, 1)  # the worker process dies mid-job
+            assert pool.run(pow, 2, 3) == 8
+            assert (pool.restarts, pool.in_flight) == (1, 0)
+        finally:
+            pool.shutdown()
+
+    def test_run_times_out(self):
+        pool = self.make_pool()
+        release = threading.Event()
+        try:
+            with pytest.raises(InferenceTimeout):
+                pool.run(release.wait, timeout=0.05)
+        finally:
+            release.set()
+            pool.shutdown()
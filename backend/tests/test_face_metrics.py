@@ -0,0 +1,88 @@
+import time
+
+from flask_jwt_extended import create_access_token
+
+from app.models import db, User
+from app.utils.authControl import metrics_access_required
+from app.utils.faceInference import FaceInferencePool
+from app.utils.faceMetrics import FaceMetrics, Histogram, face_metrics
+
+
+def detect_and_embed():
+    with face_metrics.stage('detection'):
+        time.sleep(0.01)
+    with face_metrics.stage('embedding'):
+        pass
+    return 'done'
+
+
+class TestFaceMetrics:
+    """Stage timing traces and their Prometheus histogram export"""
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram('face_test_seconds', 'Test.', ('stage',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage='decode')
+        histogram.observe(0.5, stage='decode')
+        histogram.observe(3.0, stage='decode')
+
+        lines = histogram.render()
+        assert 'face_test_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+        assert 'face_test_seconds_bucket{stage="decode",le="1"} 2' in lines
+        assert 'face_test_seconds_bucket{stage="decode",le="+Inf"} 3' in lines
+        assert 'face_test_seconds_count{stage="decode"} 3' in lines
+        assert 'face_test_seconds_sum{stage="decode"} 3.55' in lines
+
+    def test_trace_sums_repeated_stages(self):
+        metrics = FaceMetrics()
+        with metrics.trace('register_job') as outcome:
+            for _ in range(3):
+                with metrics.stage('detection'):
+                    time.sleep(0.005)
+            outcome['status'] = 'completed'
+
+        text = metrics.render()
+        assert 'face_stage_duration_seconds_count{endpoint="register_job",stage="detection"} 1' in text
+        assert 'face_request_duration_seconds_count{endpoint="register_job",status="completed"} 1' in text
+
+    def test_stage_outside_trace_is_ignored(self):
+        metrics = FaceMetrics()
+        with metrics.stage('detection'):
+            pass
+        assert 'face_stage_duration_seconds_count' not in metrics.render()
+
+    def test_inference_pool_reports_worker_stages(self):
+        pool = FaceInferencePool()
+        pool.workers = 0
+        try:
+            with face_metrics.trace('test_pool'):
+                assert pool.run(detect_and_embed) == 'done'
+        finally:
+            pool.shutdown()
+
+        text = face_metrics.render()
+        for stage in ('queue_wait', 'detection', 'embedding'):
+            assert f'face_stage_duration_seconds_count{{endpoint="test_pool",stage="{stage}"}} 1' in text
+
+
+class TestMetricsAccess:
+    """/metrics and /recognize/cache need the scrape token or a moderator"""
+
+    def call(self, app, headers=None):
+        view = metrics_access_required(lambda: 'metrics')
+        with app.test_request_context('/metrics', headers=headers or {}):
+            response = view()
+        return response if isinstance(response, str) else response[1]  # view result or status code
+
+    def bearer(self, app, role):
+        user = User(ez_id=f'ez-{role}', role=role, email=f'{role}@example.com', password='x', name='U', phone_num=f'900000000{role}')
+        db.session.add(user)
+        db.session.commit()
+        return {'Authorization': f"Bearer {create_access_token(identity=user)}"}
+
+    def test_token_or_moderator_only(self, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-secret')
+        assert self.call(app) == 401
+        assert self.call(app, {'Authorization': 'Bearer wrong'}) == 401
+        assert self.call(app, {'Authorization': 'Bearer scrape-secret'}) == 'metrics'
+        assert self.call(app, self.bearer(app, 0)) == 403
+        assert self.call(app, self.bearer(app, 2)) == 'metrics'
@@ -0,0 +1,81 @@
+import onnxruntime
+import pytest
+from flask import Flask
+
+from app.utils import faceModel
+from app.utils.faceModel import TunedFaceAnalysis, resolve_providers, session_options
+from app.utils.faceProvider import FaceProvider
+
+
+class TestSessionTuning:
+    """ONNX Runtime session options, providers and module selection of the face model"""
+
+    def test_session_options(self):
+        options = session_options(intra_op_threads=2, inter_op_threads=1, allow_spinning=False)
+        assert (options.intra_op_num_threads, options.inter_op_num_threads) == (2, 1)
+        assert options.execution_mode == onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        assert options.get_session_config_entry('session.intra_op.allow_spinning') == '0'
+        assert options.get_session_config_entry('session.inter_op.allow_spinning') == '0'
+
+    def test_unavailable_providers_are_dropped(self):
+        assert resolve_providers(['NoSuchExecutionProvider', 'CPUExecutionProvider']) == ['CPUExecutionProvider']
+        assert resolve_providers(['NoSuchExecutionProvider']) == ['CPUExecutionProvider']
+
+    def test_only_allowed_modules_are_kept(self, tmp_path, monkeypatch):
+        for name in ('1k3d68', '2d106det', 'det_10g', 'genderage', 'w600k_r50'):
+            (tmp_path / f'{name}.onnx').write_bytes(b'')
+        tasks = {'1k3d68': 'landmark_3d_68', '2d106det': 'landmark_2d_106', 'det_10g': 'detection',
+                 'genderage': 'genderage', 'w600k_r50': 'recognition'}
+        built = []
+
+        class ModelRouter:
+            def __init__(self, onnx_file):
+                self.name = onnx_file.rsplit('/', 1)[-1][:-len('.onnx')]
+
+            def get_model(self, sess_options=None, providers=None):
+                built.append((self.name, sess_options, providers))
+                return type('StubModel', (), {'taskname': tasks[self.name]})()
+
+        monkeypatch.setattr(faceModel, 'ensure_available', lambda *args, **kwargs: str(tmp_path))
+        monkeypatch.setattr(faceModel.model_zoo, 'ModelRouter', ModelRouter)
+        options = session_options(intra_op_threads=3)
+
+        model = TunedFaceAnalysis('buffalo_l', allowed_modules=['detection', 'recognition'],
+                                  providers=['CPUExecutionProvider'], sess_options=options)
+        assert sorted(model.models) == ['detection', 'recognition']
+        assert model.det_model is model.models['detection']
+        assert all(sess_options is options and providers == ['CPUExecutionProvider'] for _, sess_options, providers in built)
+
+
+class TestModelSettings:
+    """FACE_MODEL_* config reaches the provider and the settings sent to inference workers"""
+
+    def test_intra_op_threads_split_cores_between_workers(self, monkeypatch):
+        monkeypatch.setattr('os.cpu_count', lambda: 8)
+        app = Flask(__name__)
+        app.config.update(FACE_INFERENCE_WORKERS=4, FACE_MODEL_DET_SIZE=(320, 320), FACE_MODEL_ALLOW_SPINNING=False)
+        settings = FaceProvider(app).model_settings
+        assert (settings['intra_op_threads'], settings['det_size'], settings['allow_spinning']) == (2, (320, 320), False)
+
+        app.config['FACE_MODEL_INTRA_OP_THREADS'] = 1
+        assert FaceProvider(app).model_settings['intra_op_threads'] == 1
+
+    def test_unknown_setting_is_rejected(self):
+        with pytest.raises(TypeError):
+            FaceProvider().configure(det_sizes=(320, 320))
+
+    def test_warm_up_runs_detection_and_recognition_once(self, monkeypatch):
+        calls = []
+        recognition = type('StubRecognition', (), {
+            'input_size': (112, 112),
+            'get_feat': lambda self, crops: calls.append(('recognition', crops[0].shape))
+        })()
+        detection = type('StubDetection', (), {
+            'detect': lambda self, img, max_num=0, metric='default': calls.append(('detection', img.shape))
+        })()
+        model = type('StubModel', (), {'det_size': (320, 256), 'det_model': detection, 'models': {'recognition': recognition}})()
+        provider = FaceProvider()
+        monkeypatch.setattr(provider, '_model', model)
+
+        provider.warm_up(index=False)
+        assert calls == [('detection', (256, 320, 3)), ('recognition', (112, 112, 3))]
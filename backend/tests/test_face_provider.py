@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+import threading
+import types
+
+import pytest
+from flask import Flask
+
+from app.utils import faceModel
+from app.utils.faceProvider import FaceProvider
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+class TestLazyFaceProvider:
+    """The face model and ChromaDB are built on first use, not at import or create_app"""
+
+    def test_create_app_imports_no_face_libraries(self, tmp_path):
+        script = ("import sys; from app import create_app; create_app(); "
+                  "print(sorted(m for m in ('insightface', 'chromadb', 'onnxruntime') if m in sys.modules))")
+        env = {**os.environ,
+               'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'app.db'}",
+               'SCHEDULER_LEADER_LOCK_FILE': str(tmp_path / 'scheduler.lock'),
+               'EMAIL_SENDER_THREADS': '0'}
+        result = subprocess.run([sys.executable, '-c', script], cwd=BACKEND_DIR, env=env,
+                                capture_output=True, text=True, timeout=120)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == '[]'
+
+    def test_model_and_collection_load_once_on_first_use(self, tmp_path, monkeypatch):
+        loads = {'model': 0, 'client': 0}
+
+        def load_face_model(name, **settings):
+            loads['model'] += 1
+            return object()
+
+        class PersistentClient:
+            def __init__(self, path):
+                loads['client'] += 1
+
+            def get_or_create_collection(self, name, metadata):
+                return types.SimpleNamespace(name=name, metadata=metadata, configuration_json={})
+
+        monkeypatch.setattr(faceModel, 'load_face_model', load_face_model)
+        monkeypatch.setitem(sys.modules, 'chromadb', types.SimpleNamespace(PersistentClient=PersistentClient))
+
+        app = Flask(__name__)
+        app.config['CHROMA_DB_PATH'] = str(tmp_path)
+        provider = FaceProvider(app)
+        assert not provider.is_loaded
+        assert loads == {'model': 0, 'client': 0}
+
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(provider.model)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert provider.is_loaded and len({id(model) for model in models}) == 1
+        assert provider.collection is provider.collection
+        assert loads == {'model': 1, 'client': 1}
+
+
+class TestHnswSettings:
+    """FACE_HNSW_* and FACE_QUERY_N_RESULTS shape the Chroma collection and /recognize queries"""
+
+    @pytest.fixture
+    def hnsw_app(self, tmp_path):
+        app = Flask(__name__)
+        app.config.update(CHROMA_DB_PATH=str(tmp_path / 'chroma'), FACE_COLLECTION_NAME='faces',
+                          FACE_HNSW_M=8, FACE_HNSW_CONSTRUCTION_EF=50, FACE_HNSW_SEARCH_EF=20)
+        return app
+
+    def hnsw(self, collection):
+        config = collection.configuration_json['hnsw']
+        return config['max_neighbors'], config['ef_construction'], config['ef_search']
+
+    def test_new_collection_uses_the_configured_parameters(self, hnsw_app):
+        assert self.hnsw(FaceProvider(hnsw_app).collection) == (8, 50, 20)
+
+    def test_existing_collection_gets_ef_search_and_a_build_warning(self, hnsw_app, caplog):
+        FaceProvider(hnsw_app).collection
+        hnsw_app.config.update(FACE_HNSW_M=16, FACE_HNSW_SEARCH_EF=64)
+        with caplog.at_level('WARNING', logger='app.utils.faceProvider'):
+            collection = FaceProvider(hnsw_app).collection
+        assert self.hnsw(collection) == (8, 50, 64)
+        assert 'flask face rebuild-index' in caplog.text
+
+    def test_query_size(self, hnsw_app):
+        hnsw_app.config.update(FACE_QUERY_N_RESULTS=12)
+        provider = FaceProvider(hnsw_app)
+        assert provider.query_size == 12
+        provider.index_mode = 'prototype'
+        assert provider.query_size == 12  # 5 per prototype would be 15
+        provider.n_results = 50
+        assert provider.query_size == 15
+        assert provider.hnsw_metadata(m=32)['hnsw:M'] == 32
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.embedding_func import FrameQualityFilter, extract_embeddings_from_video
+from app.utils.faceProvider import face_provider
+
+
+class TestFrameQualityFilter:
+    """Cheap blur / brightness / duplicate checks on registration frames"""
+
+    def noise_frame(self, seed):
+        rng = np.random.default_rng(seed)
+        return (rng.random((120, 160, 3)) * 255).astype(np.uint8)
+
+    def test_accepts_sharp_frame_and_rejects_duplicate(self):
+        frame_filter = FrameQualityFilter()
+        frame = self.noise_frame(0)
+        assert frame_filter.check(frame)
+        assert not frame_filter.check(frame.copy())
+        assert frame_filter.stats["duplicate"] == 1
+
+    def test_rejects_dark_bright_and_blurry_frames(self):
+        frame_filter = FrameQualityFilter()
+        assert not frame_filter.check(np.zeros((120, 160, 3), dtype=np.uint8))
+        assert not frame_filter.check(np.full((120, 160, 3), 250, dtype=np.uint8))
+        assert not frame_filter.check(np.full((120, 160, 3), 128, dtype=np.uint8))
+        assert frame_filter.stats["too_dark"] == 1
+        assert frame_filter.stats["too_bright"] == 1
+        assert frame_filter.stats["blurry"] == 1
+        assert frame_filter.stats["sampled"] == 3
+
+
+class TestFilteredVideoExtraction:
+    """Only frames that pass the filter reach the detector; frame_stats counts every rejection"""
+
+    class StubModel:
+        """Finds a face in every frame except the `missing`-th one it is shown"""
+
+        def __init__(self, missing):
+            self.det_size = (640, 640)
+            self.det_model = self
+            self.missing = missing
+            self.detected = 0
+            recognition = type('StubRecognition', (), {
+                'input_size': (112, 112),
+                'get_feat': lambda _, crops: np.ones((len(crops), 512), dtype=np.float32)
+            })()
+            self.models = {'recognition': recognition}
+
+        def detect(self, img, max_num=0, metric='default'):
+            self.detected += 1
+            if self.detected == self.missing:
+                return np.zeros((0, 5)), None
+            height, width = img.shape[:2]
+            kps = np.array([[0.40, 0.40], [0.60, 0.40], [0.50, 0.50], [0.42, 0.60], [0.58, 0.60]]) * [width, height]
+            return np.array([[0.3 * width, 0.3 * height, 0.7 * width, 0.7 * height, 0.99]]), kps[None]
+
+    @pytest.fixture
+    def video(self, tmp_path):
+        """12 frames: every 4th one black, the rest distinct sharp noise"""
+        path = str(tmp_path / 'clip.avi')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (160, 120))
+        rng = np.random.default_rng(0)
+        for i in range(12):
+            frame = np.zeros((120, 160, 3), dtype=np.uint8) if i % 4 == 0 else (rng.random((120, 160, 3)) * 255).astype(np.uint8)
+            writer.write(frame)
+        writer.release()
+        return path
+
+    def test_rejected_frames_skip_detection(self, video, monkeypatch):
+        model = self.StubModel(missing=2)
+        monkeypatch.setattr(face_provider, '_model', model)
+
+        embeddings, stats = extract_embeddings_from_video(video, max_frames=15, frame_interval=1)
+        assert model.detected == 9
+        assert len(embeddings) == 8
+        assert (stats["sampled"], stats["too_dark"], stats["no_face"], stats["accepted"]) == (12, 3, 1, 8)
+
+    def test_stops_once_enough_faces_are_found(self, video, monkeypatch):
+        monkeypatch.setattr(face_provider, '_model', self.StubModel(missing=0))
+        embeddings, stats = extract_embeddings_from_video(video, max_frames=3, frame_interval=1)
+        assert len(embeddings) == 3
+        assert stats["sampled"] == 4  # one black frame, then three faces
@@ -0,0 +1,125 @@
+import smtplib
+
+import pytest
+
+from app.utils import mailService
+from app.utils.mailService import SMTPPool
+
+
+class FakeHost:
+    def __init__(self):
+        self.alive = True
+
+    def noop(self):
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected("gone")
+        return (250, b'OK')
+
+
+class FakeConnection:
+    """A Flask-Mail connection to a fake SMTP server"""
+
+    def __init__(self, server):
+        self.server = server
+        self.host = FakeHost()
+        self.closed = False
+
+    def __enter__(self):
+        if self.server.down:
+            raise ConnectionRefusedError("connection refused")
+        self.server.opened += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    def send(self, message):
+        if not self.host.alive:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        if message in self.server.refused:
+            raise smtplib.SMTPRecipientsRefused({message: (550, b'No such user')})
+        self.server.sent.append(message)
+
+
+class FakeServer:
+    def __init__(self):
+        self.opened = 0
+        self.sent = []
+        self.refused = set()
+        self.down = False
+        self.connections = []
+
+    def connect(self):
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+
+@pytest.fixture
+def server(monkeypatch):
+    fake = FakeServer()
+    monkeypatch.setattr(mailService, 'mail', fake)
+    return fake
+
+
+@pytest.fixture
+def pool():
+    pool = SMTPPool()
+    yield pool
+    pool.close()
+
+
+class TestSMTPPool:
+    """Connection reuse, health checks and reconnects of the SMTP pool"""
+
+    def test_batches_reuse_one_connection(self, server, pool):
+        assert pool.send_many(['a', 'b']) == [None, None]
+        pool.send('c')
+        assert server.sent == ['a', 'b', 'c']
+        assert server.opened == 1
+
+    def test_refused_message_keeps_the_connection(self, server, pool):
+        server.refused.add('b')
+        errors = pool.send_many(['a', 'b', 'c'])
+        assert errors[0] is None and errors[2] is None
+        assert isinstance(errors[1], smtplib.SMTPRecipientsRefused)
+        assert server.sent == ['a', 'c']
+        assert server.opened == 1
+
+    def test_dropped_connection_is_replaced(self, server, pool):
+        pool.send('a')
+        server.connections[0].host.alive = False
+        assert pool.send_many(['b', 'c']) == [None, None]
+        assert server.sent == ['a', 'b', 'c']
+        assert server.opened == 2
+        assert server.connections[0].closed
+
+    def test_idle_connections_are_checked_or_closed(self, server, pool, monkeypatch):
+        clock = [1000.0]
+        monkeypatch.setattr(mailService.time, 'monotonic', lambda: clock[0])
+        pool.send('a')
+
+        clock[0] += pool.health_check + 1
+        pool.send('b')  # passes NOOP, reused
+        assert server.opened == 1
+
+        clock[0] += pool.health_check + 1
+        server.connections[0].host.alive = False
+        pool.send('c')  # fails NOOP, replaced before sending
+        assert server.opened == 2
+
+        clock[0] += pool.max_idle + 1
+        pool.send('d')  # too old to trust, replaced without a NOOP
+        assert server.opened == 3
+        assert server.sent == ['a', 'b', 'c', 'd']
+
+    def test_server_down_fails_the_batch(self, server, pool):
+        server.down = True
+        errors = pool.send_many(['a', 'b'])
+        assert [type(error) for error in errors] == [ConnectionRefusedError, ConnectionRefusedError]
+        with pytest.raises(ConnectionRefusedError):
+            pool.send('c')
+
+        server.down = False
+        pool.send('d')
+        assert server.sent == ['d']
@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.graphql.prescriptions import first_reminder_time
+from app.models import db, EmailOutbox, Notification, Reminders, User
+from app.utils import emailOutbox, remScheduler
+from app.utils.remScheduler import check_reminders, next_fire_time, schedule_reminders
+
+
+class FakePool:
+    """Stands in for the SMTP pool: accepts every message"""
+
+    def send_many(self, messages):
+        return [None] * len(messages)
+
+
+def reminder(**fields):
+    defaults = dict(ez_id='ez-sen-1', label='Medicine', category=1, is_active=True, is_recurring=True, interval=1)
+    return Reminders(**{**defaults, **fields})
+
+
+class TestNextFireTime:
+    """next_fire_at computed from rem_time, time_slots, weekdays and interval"""
+
+    # 2030-01-07 is a Monday
+    start = datetime(2030, 1, 7, 0, 0)
+
+    def test_one_time_fires_at_rem_time(self):
+        rem = reminder(is_recurring=False, rem_time=datetime(2030, 1, 1, 9, 0))
+        assert next_fire_time(rem, self.start) == datetime(2030, 1, 1, 9, 0)
+
+    def test_daily_slots(self):
+        rem = reminder(rem_time=datetime(2030, 1, 7, 8, 0), time_slots=['20:00', '08:00'])
+        assert next_fire_time(rem, self.start) == datetime(2030, 1, 7, 8, 0)
+        assert next_fire_time(rem, datetime(2030, 1, 7, 8, 0)) == datetime(2030, 1, 7, 20, 0)
+        assert next_fire_time(rem, datetime(2030, 1, 7, 20, 0)) == datetime(2030, 1, 8, 8, 0)
+
+    def test_weekdays_and_interval(self):
+        rem = reminder(rem_time=datetime(2030, 1, 7, 9, 0), weekdays='mon,thu', time_slots=['09:00'])
+        assert next_fire_time(rem, datetime(2030, 1, 7, 9, 0)) == datetime(2030, 1, 10, 9, 0)
+
+        rem = reminder(rem_time=datetime(2030, 1, 7, 9, 0), interval=3)
+        assert next_fire_time(rem, datetime(2030, 1, 7, 9, 0)) == datetime(2030, 1, 10, 9, 0)
+
+    def test_slots_count_from_the_start_of_rem_times_day(self):
+        slots = ['08:00', '14:00', '20:00']
+        rem = reminder(rem_time=datetime(2030, 1, 8, 14, 0), time_slots=slots)
+        assert next_fire_time(rem, datetime(2030, 1, 7, 10, 0)) == datetime(2030, 1, 8, 8, 0)
+
+        # A prescription added at 10:00 still fires at today's 14:00 and 20:00
+        rem = reminder(rem_time=first_reminder_time(slots, datetime(2030, 1, 7, 10, 0)), time_slots=slots)
+        assert next_fire_time(rem, datetime(2030, 1, 7, 10, 0)) == datetime(2030, 1, 7, 14, 0)
+        assert next_fire_time(rem, datetime(2030, 1, 7, 14, 0)) == datetime(2030, 1, 7, 20, 0)
+        assert first_reminder_time(slots, datetime(2030, 1, 7, 21, 0)) == datetime(2030, 1, 8, 8, 0)
+
+    def test_future_first_occurrence_and_unmatchable_weekdays(self):
+        rem = reminder(rem_time=datetime(2030, 2, 1, 9, 30))
+        assert next_fire_time(rem, self.start) == datetime(2030, 2, 1, 9, 30)
+        assert next_fire_time(reminder(rem_time=self.start, weekdays='weekly'), self.start) is None
+        assert next_fire_time(reminder(rem_time=self.start, is_active=False), self.start) is None
+
+
+class TestCheckReminders:
+    """The minute scan only loads and advances reminders whose next_fire_at is due"""
+
+    @pytest.fixture
+    def fired(self, app, monkeypatch):
+        """Labels of the reminders in each email sent"""
+        db.session.add(User(ez_id='ez-sen-1', role=0, email='sen@example.com', password='x', name='Sen', phone_num='9000000001'))
+        db.session.commit()
+        fired = []
+        monkeypatch.setattr(emailOutbox, 'smtp_pool', FakePool())
+        def build_email(reminder_display, **email):
+            fired.append([display['label'] for display in reminder_display.get('reminders', [reminder_display])])
+        monkeypatch.setattr(emailOutbox, 'build_email', build_email)
+        return fired
+
+    def test_insert_and_update_keep_next_fire_at(self, app):
+        rem = reminder(rem_time=datetime(2030, 1, 7, 8, 0), time_slots=['08:00'])
+        db.session.add(rem)
+        db.session.commit()
+        assert rem.next_fire_at == datetime(2030, 1, 7, 8, 0)
+
+        rem.time_slots = ['07:00']
+        db.session.commit()
+        assert rem.next_fire_at == datetime(2030, 1, 7, 7, 0)  # rem_time is the start date of slotted reminders
+
+    def test_due_reminders_fire_and_advance(self, app, fired):
+        now = datetime.utcnow()
+        one_time = reminder(label='Once', is_recurring=False, rem_time=now - timedelta(days=1))
+        recurring = reminder(label='Daily', rem_time=now - timedelta(days=2))
+        later = reminder(label='Later', rem_time=now + timedelta(hours=1))
+        db.session.add_all([one_time, recurring, later])
+        db.session.commit()
+        recurring.next_fire_at = now - timedelta(seconds=30)
+        db.session.commit()
+
+        check_reminders(app)
+        assert fired == [['Once', 'Daily']]  # one digest, in firing order
+        assert sorted(n.label for n in Notification.query.all()) == ['Daily', 'Once']
+        assert [e.status for e in EmailOutbox.query.all()] == ['sent']
+        assert (one_time.is_active, one_time.next_fire_at) == (False, None)
+        assert now < recurring.next_fire_at <= now + timedelta(days=1)
+
+        check_reminders(app)
+        assert len(fired) == 1
+
+    def test_digest_is_per_senior_and_optional(self, app, fired, monkeypatch):
+        db.session.add(User(ez_id='ez-sen-2', role=0, email='sen2@example.com', password='x', name='Sen 2', phone_num='9000000002'))
+        now = datetime.utcnow()
+        db.session.add_all([
+            reminder(label='Pill A', is_recurring=False, rem_time=now),
+            reminder(label='Pill B', is_recurring=False, rem_time=now),
+            reminder(ez_id='ez-sen-2', label='Walk', is_recurring=False, rem_time=now),
+        ])
+        db.session.commit()
+        monkeypatch.setitem(app.config, 'REMINDER_DIGEST', False)
+        check_reminders(app)
+        assert sorted(fired) == [['Pill A'], ['Pill B'], ['Walk']]
+
+        fired.clear()
+        for rem in Reminders.query.all():
+            rem.is_active = True
+        db.session.commit()
+        monkeypatch.setitem(app.config, 'REMINDER_DIGEST', True)
+        check_reminders(app)
+        assert sorted(fired) == [['Pill A', 'Pill B'], ['Walk']]
+        assert Notification.query.count() == 6
+        digest = EmailOutbox.query.filter_by(template='reminder_digest_template.html').one()
+        assert digest.recipients == ['sen@example.com']
+        assert digest.subject == '⏰ 2 Reminders: Pill A, Pill B'
+
+    def test_digest_window_brings_forward_the_same_seniors_reminders(self, app, fired, monkeypatch):
+        db.session.add(User(ez_id='ez-sen-2', role=0, email='sen2@example.com', password='x', name='Sen 2', phone_num='9000000002'))
+        now = datetime.utcnow()
+        soon = reminder(label='Soon', is_recurring=False, rem_time=now + timedelta(minutes=2))
+        other = reminder(ez_id='ez-sen-2', label='Other', is_recurring=False, rem_time=now + timedelta(minutes=2))
+        db.session.add_all([reminder(label='Now', is_recurring=False, rem_time=now), soon, other])
+        db.session.commit()
+
+        monkeypatch.setitem(app.config, 'REMINDER_DIGEST_WINDOW', 300)
+        check_reminders(app)
+        assert fired == [['Now', 'Soon']]
+        assert (soon.is_active, other.is_active) == (False, True)
+
+    def test_failed_digest_falls_back_to_one_email_each(self, app, fired, monkeypatch):
+        def fail(reminders):
+            raise RuntimeError("Bad digest")
+        monkeypatch.setattr(remScheduler, 'digest_email', fail)
+        now = datetime.utcnow()
+        db.session.add_all([
+            reminder(label='Pill A', is_recurring=False, rem_time=now),
+            reminder(label='Pill B', is_recurring=False, rem_time=now),
+        ])
+        db.session.commit()
+
+        check_reminders(app)
+        assert sorted(fired) == [['Pill A'], ['Pill B']]
+        assert Notification.query.count() == 2
+        assert not Reminders.query.filter_by(is_active=True).count()
+
+    def test_failed_email_stays_in_outbox(self, app, fired, monkeypatch):
+        def fail(**email):
+            raise RuntimeError("Failed to send email")
+        monkeypatch.setattr(emailOutbox, 'build_email', fail)
+        db.session.add(reminder(label='Once', is_recurring=False, rem_time=datetime.utcnow()))
+        db.session.commit()
+
+        check_reminders(app)
+        email = EmailOutbox.query.one()
+        assert (email.status, email.attempts, email.error) == ('pending', 1, "Failed to send email")
+        assert email.next_attempt_at > datetime.utcnow()
+        assert Notification.query.count() == 1
+
+    def test_missed_recurring_occurrence_is_skipped(self, app, fired):
+        now = datetime.utcnow()
+        rem = reminder(rem_time=now - timedelta(days=2))
+        db.session.add(rem)
+        db.session.commit()
+        rem.next_fire_at = now - timedelta(hours=1)
+        db.session.commit()
+
+        check_reminders(app)
+        assert fired == []
+        assert rem.next_fire_at > now
+
+    def test_schedule_reminders_backfills(self, app):
+        rem = reminder(rem_time=datetime(2030, 1, 7, 8, 0))
+        db.session.add(rem)
+        db.session.commit()
+        rem.next_fire_at = None
+        db.session.commit()
+
+        schedule_reminders(app)
+        assert rem.next_fire_at == datetime(2030, 1, 7, 8, 0)
@@ -0,0 +1,78 @@
+import pytest
+from flask import Flask
+
+from app.models import db, SchedulerLease
+from app.utils.schedulerLeader import SchedulerLeader
+
+
+def candidate(app, events, name):
+    leader = SchedulerLeader(app)
+    leader.start(on_elected=lambda: events.append(f'{name} elected'),
+                 on_deposed=lambda: events.append(f'{name} deposed'))
+    return leader
+
+
+class TestSchedulerLeader:
+    """Only one process runs the reminder scheduler"""
+
+    @pytest.fixture
+    def app(self, tmp_path):
+        app = Flask(__name__)
+        app.config.update(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'lease.db'}",
+            SCHEDULER_LEADER_LOCK_FILE=str(tmp_path / 'scheduler.lock'),
+            SCHEDULER_LEADER_RETRY=3600,  # campaigns are driven by the tests
+            SCHEDULER_LEASE_TTL=3600,
+        )
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+        return app
+
+    def test_file_lock_elects_one_and_fails_over(self, app):
+        events = []
+        first, second = candidate(app, events, 'first'), candidate(app, events, 'second')
+        assert (first.is_leader, second.is_leader) == (True, False)
+
+        first.stop()
+        second._campaign()
+        assert second.is_leader
+        assert events == ['first elected', 'second elected']
+        second.stop()
+
+    def test_db_lease_elects_one_and_expires(self, app):
+        app.config['SCHEDULER_LEADER_BACKEND'] = 'db'
+        events = []
+        first, second = candidate(app, events, 'first'), candidate(app, events, 'second')
+        assert (first.is_leader, second.is_leader) == (True, False)
+
+        # The leader stops renewing (e.g. it hung) and its lease runs out
+        with app.app_context():
+            SchedulerLease.query.one().expires_at = SchedulerLease.query.one().expires_at.replace(year=2000)
+            db.session.commit()
+        second._campaign()
+        first._campaign()
+        assert (first.is_leader, second.is_leader) == (False, True)
+        assert events == ['first elected', 'second elected', 'first deposed']
+
+        second.stop()
+        first._campaign()
+        assert first.is_leader
+        first.stop()
+
+    def test_none_backend_always_leads(self, app):
+        app.config['SCHEDULER_LEADER_BACKEND'] = 'none'
+        events = []
+        assert candidate(app, events, 'a').is_leader and candidate(app, events, 'b').is_leader
+        assert events == ['a elected', 'b elected']
+
+    def test_reloader_parent_does_not_campaign(self, app, monkeypatch):
+        monkeypatch.setenv('FLASK_DEBUG', '1')
+        monkeypatch.delenv('WERKZEUG_RUN_MAIN', raising=False)
+        events = []
+        parent = candidate(app, events, 'parent')
+        monkeypatch.setenv('WERKZEUG_RUN_MAIN', 'true')
+        child = candidate(app, events, 'child')
+        assert (parent.is_leader, child.is_leader) == (False, True)
+        assert events == ['child elected']
+        child.stop()
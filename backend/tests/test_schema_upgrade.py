@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from app.models import db, Reminders
+from app.utils.schemaUpgrade import upgrade_schema
+
+
+@pytest.fixture
+def old_db(tmp_path):
+    """A database created before reminders.next_fire_at and the email outbox existed"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'old.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_reminders_active_next_fire_at"))
+            conn.execute(text("ALTER TABLE reminders DROP COLUMN next_fire_at"))
+            conn.execute(text("DROP TABLE email_outbox"))
+            conn.execute(text("DROP TABLE scheduler_leases"))
+            conn.execute(text(
+                "INSERT INTO reminders (ez_id, label, rem_time, is_active, is_recurring, interval) "
+                "VALUES ('ez-sen-1', 'Medicine', '2030-01-07 08:00:00.000000', 1, 1, 1)"
+            ))
+        yield app
+        db.session.remove()
+
+
+class TestUpgradeSchema:
+    """Existing databases get the new tables, columns and indexes"""
+
+    def test_adds_tables_column_and_index_and_backfills(self, old_db):
+        upgrade_schema()
+
+        schema = inspect(db.engine)
+        assert {'email_outbox', 'scheduler_leases', 'face_registration_jobs'} <= set(schema.get_table_names())
+        assert 'next_fire_at' in {column['name'] for column in schema.get_columns('reminders')}
+        assert 'ix_reminders_active_next_fire_at' in {index['name'] for index in schema.get_indexes('reminders')}
+        assert Reminders.query.one().next_fire_at == datetime(2030, 1, 7, 8, 0)
+
+    def test_is_idempotent(self, old_db):
+        upgrade_schema()
+        upgrade_schema()
+        assert Reminders.query.count() == 1
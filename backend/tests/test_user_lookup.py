@@ -0,0 +1,346 @@
+import io
+import json
+import os
+from datetime import datetime, timedelta
+import zipfile
+
+import numpy as np
+import pytest
+from flask import Flask
+from flask_jwt_extended import create_access_token
+from PIL import Image
+
+from app.api.user_lookup import lookup
+from app.graphql.auth import jwt
+from app.models import db, FaceRegistrationJob, SenInfo, User
+from app.utils.faceCache import recognition_cache
+from app.utils.faceIndex import NumpyFaceIndex
+from app.utils.faceInference import face_inference, InferenceQueueFull, InferenceTimeout
+from app.utils.faceJobs import registration_jobs
+from app.utils.faceProvider import face_provider
+
+
+@pytest.fixture
+def lookup_app(tmp_path, monkeypatch):
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'lookup.db'}",
+        JWT_SECRET_KEY="test-secret",
+    )
+    db.init_app(app)
+    jwt.init_app(app)
+    app.register_blueprint(lookup, url_prefix='/user-lookup')
+    monkeypatch.setattr(recognition_cache, 'enabled', False)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(lookup_app):
+    return lookup_app.test_client()
+
+
+def photo_bytes(color=(120, 80, 40)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def senior_headers(ez_id='ez-sen-1', phone_num='9000000001'):
+    user = User(ez_id=ez_id, role=0, email=f'{ez_id}@example.com', password='x', name='Sen', phone_num=phone_num)
+    db.session.add_all([user, SenInfo(ez_id=ez_id, pincode='600001')])
+    db.session.commit()
+    return {'Authorization': f"Bearer {create_access_token(identity=user)}"}
+
+
+class ManualExecutor:
+    """Stands in for the job thread pool: queued jobs run when the test says so"""
+
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, fn, *args):
+        self.queued.append((fn, args))
+
+    def run_all(self):
+        while self.queued:
+            fn, args = self.queued.pop(0)
+            fn(*args)
+
+
+@pytest.fixture
+def jobs(lookup_app, tmp_path, monkeypatch):
+    """registration_jobs bound to the test app, with a manual executor and a NumPy face index"""
+    executor = ManualExecutor()
+    monkeypatch.setattr(registration_jobs, 'app', lookup_app)
+    monkeypatch.setattr(registration_jobs, 'upload_folder', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(registration_jobs, '_executor', executor)
+    monkeypatch.setattr(recognition_cache, 'stamp_path', str(tmp_path / 'cache.stamp'))
+    monkeypatch.setattr(face_provider, '_index', NumpyFaceIndex(str(tmp_path / 'index')))
+    return executor
+
+
+def face_video(monkeypatch, faces=5):
+    """Stub the inference pool so every uploaded video yields `faces` embeddings"""
+    rng = np.random.default_rng(faces)
+    embeddings = [(row / np.linalg.norm(row)).astype(np.float32) for row in rng.normal(size=(faces, 512))]
+    stats = {"sampled": 12, "too_dark": 2, "too_bright": 0, "blurry": 1, "duplicate": 1, "no_face": 3, "accepted": faces}
+    monkeypatch.setattr(face_inference, 'run', lambda fn, path, **kwargs: (embeddings, dict(stats)))
+
+
+def post_video(client, headers, data=b'video-1'):
+    return client.post('/user-lookup/register', headers=headers, data={'video': (io.BytesIO(data), 'clip.mp4')})
+
+
+class TestInferenceBackpressure:
+    """A saturated or slow inference pool answers 503 + Retry-After or 504, never a hung request"""
+
+    def fail_with(self, monkeypatch, error):
+        def run(fn, *args, **kwargs):
+            raise error
+        monkeypatch.setattr(face_inference, 'run', run)
+
+    def test_recognize_answers_503_with_retry_after_when_full(self, client, monkeypatch):
+        self.fail_with(monkeypatch, InferenceQueueFull(retry_after=7))
+        response = client.post('/user-lookup/recognize', data={'photo': (io.BytesIO(photo_bytes()), 'me.jpg')})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '7'
+
+    def test_recognize_answers_504_on_timeout(self, client, monkeypatch):
+        self.fail_with(monkeypatch, InferenceTimeout("too slow"))
+        response = client.post('/user-lookup/recognize', data={'photo': (io.BytesIO(photo_bytes()), 'me.jpg')})
+        assert response.status_code == 504
+        assert 'took too long' in response.get_json()['error']
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+class TestBatchArchiveLimits:
+    """A batch zip is checked against member and size limits before anything is inflated"""
+
+    @pytest.fixture(autouse=True)
+    def no_faces(self, monkeypatch):
+        monkeypatch.setattr(face_inference, 'run', lambda fn, images, **kwargs: [None] * len(images))
+
+    def post_archive(self, client, members):
+        archive = members if isinstance(members, bytes) else zip_bytes(members)
+        return client.post('/user-lookup/recognize/batch', data={'archive': (io.BytesIO(archive), 'photos.zip')})
+
+    def test_bomb_member_is_reported_without_inflating(self, client, monkeypatch):
+        bomb = zip_bytes({'bomb.jpg': b'\0' * (16 * 1024 * 1024)})  # ~16 KB compressed
+        opened = []
+        monkeypatch.setattr(zipfile.ZipFile, 'open', lambda self, info, *args, **kwargs: opened.append(info))
+        response = self.post_archive(client, bomb)
+        assert response.status_code == 400
+        assert opened == []
+
+    def test_too_many_members_is_rejected(self, client, lookup_app, monkeypatch):
+        monkeypatch.setitem(lookup_app.config, 'FACE_BATCH_MAX_ARCHIVE_MEMBERS', 3)
+        response = self.post_archive(client, {f'notes_{i}.txt': b'x' for i in range(4)})
+        assert response.status_code == 400
+        assert response.get_json()['error'] == "The archive may hold at most 3 files"
+
+    def test_total_uncompressed_size_is_capped(self, client, lookup_app, monkeypatch):
+        monkeypatch.setitem(lookup_app.config, 'FACE_BATCH_MAX_ARCHIVE_BYTES', 1000)
+        response = self.post_archive(client, {'a.jpg': b'\0' * 600, 'b.jpg': b'\0' * 600})
+        assert response.status_code == 400
+        assert response.get_json()['error'] == "The archive is too large once uncompressed"
+
+
+class TestRecognizeBatch:
+    """Several photos, one inference job and one index query, fused into a best match"""
+
+    @pytest.fixture
+    def faces(self, tmp_path, monkeypatch):
+        rng = np.random.default_rng(0)
+        sen, other = rng.normal(size=(2, 512))
+        normalized = lambda v: (v / np.linalg.norm(v)).astype(np.float32)
+        index = NumpyFaceIndex(str(tmp_path / 'index'))
+        index.add(['sen_0', 'other_0'], [normalized(sen), normalized(other)], [{'ez_id': 'ez-sen-1'}, {'ez_id': 'ez-sen-2'}])
+        monkeypatch.setattr(face_provider, '_index', index)
+
+        # Embedding per photo: the senior twice, the other senior once, one photo without a face
+        photos = {name: photo_bytes(color) for name, color in
+                  [('a.jpg', (200, 0, 0)), ('b.jpg', (0, 200, 0)), ('c.png', (0, 0, 200)), ('d.jpg', (90, 90, 90))]}
+        embeddings = {
+            photos['a.jpg']: normalized(sen + rng.normal(scale=0.1, size=512)),
+            photos['b.jpg']: None,
+            photos['c.png']: normalized(sen + rng.normal(scale=0.1, size=512)),
+            photos['d.jpg']: normalized(other),
+        }
+        jobs = []
+
+        def run(fn, images, **kwargs):
+            jobs.append(len(images))
+            return [embeddings[data] for data in images]
+        monkeypatch.setattr(face_inference, 'run', run)
+        return photos, jobs
+
+    def test_photos_and_archive_are_matched_per_photo_and_fused(self, client, faces):
+        photos, jobs = faces
+        archive = zip_bytes({'c.png': photos['c.png'], 'readme.txt': b'not a photo', 'd.jpg': photos['d.jpg']})
+        response = client.post('/user-lookup/recognize/batch', data={
+            'photos': [(io.BytesIO(photos['a.jpg']), 'a.jpg'), (io.BytesIO(photos['b.jpg']), 'b.jpg')],
+            'archive': (io.BytesIO(archive), 'more.zip'),
+        })
+        body = response.get_json()
+
+        assert response.status_code == 200
+        assert jobs == [4]  # one inference job for every photo, readme.txt skipped
+        assert [result['filename'] for result in body['results']] == ['a.jpg', 'b.jpg', 'c.png', 'd.jpg']
+        assert body['results'][1] == {'index': 1, 'filename': 'b.jpg', 'error': 'No face detected'}
+        assert body['results'][0]['matches'][0]['ezId'] == 'ez-sen-1'
+        assert body['results'][3]['matches'][0]['ezId'] == 'ez-sen-2'
+
+        best = body['best_match']
+        assert (best['ezId'], best['photos_matched']) == ('ez-sen-1', 2)
+        own = [body['results'][i]['matches'][0]['similarity'] for i in (0, 2)]
+        assert best['similarity'] == pytest.approx(sum(own) / 3)  # averaged over the 3 photos with a face
+        assert (body['debug_info']['photos_received'], body['debug_info']['faces_detected']) == (4, 3)
+
+    def test_no_face_in_any_photo(self, client, faces):
+        photos, _ = faces
+        response = client.post('/user-lookup/recognize/batch', data={'photos': [(io.BytesIO(photos['b.jpg']), 'b.jpg')]})
+        assert response.status_code == 400
+        assert 'No face detected in any' in response.get_json()['error']
+
+    def test_too_many_photos(self, client, faces, lookup_app, monkeypatch):
+        photos, jobs = faces
+        monkeypatch.setitem(lookup_app.config, 'FACE_BATCH_MAX_IMAGES', 1)
+        response = client.post('/user-lookup/recognize/batch', data={
+            'photos': [(io.BytesIO(photos['a.jpg']), 'a.jpg'), (io.BytesIO(photos['c.png']), 'c.png')]
+        })
+        assert response.status_code == 400
+        assert jobs == []
+
+
+class TestRegistrationJobs:
+    """POST /register queues a background job; GET /register/<job_id> reports on it"""
+
+    def test_register_answers_202_with_job_and_status_url(self, client, jobs):
+        response = post_video(client, senior_headers())
+        body = response.get_json()
+        assert response.status_code == 202
+        assert body['status'] == 'queued'
+        assert body['status_url'] == f"/user-lookup/register/{body['job_id']}"
+        job = FaceRegistrationJob.query.get(body['job_id'])
+        assert os.path.exists(job.upload_path)
+        assert len(jobs.queued) == 1
+
+    def test_polling_follows_the_job_to_completed(self, client, jobs, monkeypatch):
+        headers = senior_headers()
+        face_video(monkeypatch, faces=5)
+        body = post_video(client, headers).get_json()
+        status = client.get(body['status_url'], headers=headers).get_json()
+        assert (status['status'], status['stage']) == ('queued', 'uploaded')
+
+        jobs.run_all()
+        status = client.get(body['status_url'], headers=headers).get_json()
+        assert (status['status'], status['stage'], status['error']) == ('completed', 'done', None)
+        assert status['progress'] == {"frames_decoded": 12, "faces_found": 5, "embeddings_stored": 5, "embeddings_kept": 0}
+        assert status['frame_stats']['no_face'] == 3
+        assert face_provider.index.count() == 5
+        assert not os.path.exists(FaceRegistrationJob.query.get(body['job_id']).upload_path)
+
+    def test_running_job_reports_live_progress(self, client, jobs):
+        headers = senior_headers()
+        body = post_video(client, headers).get_json()
+        job = FaceRegistrationJob.query.get(body['job_id'])
+        job.status = 'processing'
+        db.session.commit()
+        os.makedirs(registration_jobs.upload_folder, exist_ok=True)
+        with open(registration_jobs.progress_path(job.job_id), 'w') as f:
+            json.dump({"frames_decoded": 7, "faces_found": 2}, f)
+
+        progress = client.get(body['status_url'], headers=headers).get_json()['progress']
+        assert (progress['frames_decoded'], progress['faces_found']) == (7, 2)
+
+    def test_too_few_faces_fails_the_job(self, client, jobs, monkeypatch):
+        headers = senior_headers()
+        face_video(monkeypatch, faces=2)
+        body = post_video(client, headers).get_json()
+        jobs.run_all()
+
+        status = client.get(body['status_url'], headers=headers).get_json()
+        assert status['status'] == 'failed'
+        assert status['error'] == "At least 3 frames with valid faces are required for registration from video"
+        assert face_provider.index.count() == 0
+
+    def test_inference_timeout_fails_the_job(self, client, jobs, monkeypatch):
+        headers = senior_headers()
+        def run(fn, *args, **kwargs):
+            raise InferenceTimeout("too slow")
+        monkeypatch.setattr(face_inference, 'run', run)
+        body = post_video(client, headers).get_json()
+        jobs.run_all()
+
+        status = client.get(body['status_url'], headers=headers).get_json()
+        assert (status['status'], status['error']) == ('failed', "Face processing took too long. Please try again.")
+
+    def test_find_reusable_returns_in_flight_and_fails_stale_jobs(self, client, jobs):
+        body = post_video(client, senior_headers()).get_json()
+        job = FaceRegistrationJob.query.get(body['job_id'])
+        assert registration_jobs.find_reusable('ez-sen-1', job.upload_sha256) is job
+
+        job.updated_at = datetime.utcnow() - registration_jobs.stale_after - timedelta(seconds=1)
+        db.session.commit()
+        assert registration_jobs.find_reusable('ez-sen-1', job.upload_sha256) is None
+        assert (job.status, job.error) == ('failed', "Job stalled, please retry")
+
+    def test_jobs_are_private_to_their_senior(self, client, jobs):
+        body = post_video(client, senior_headers()).get_json()
+        other = senior_headers('ez-sen-2', '9000000002')
+        assert client.get(body['status_url'], headers=other).status_code == 404
+        assert client.get('/user-lookup/register/missing', headers=other).status_code == 404
+
+        doctor = User(ez_id='ez-doc-1', role=1, email='doc@example.com', password='x', name='Doc', phone_num='9000000003')
+        db.session.add(doctor)
+        db.session.commit()
+        response = client.get(body['status_url'], headers={'Authorization': f"Bearer {create_access_token(identity=doctor)}"})
+        assert response.status_code == 403
+
+
+class TestRegistrationReuse:
+    """Re-posting a video returns its job only while that job still describes the registration"""
+
+    def test_in_flight_job_is_reused(self, client, jobs):
+        headers = senior_headers()
+        first = post_video(client, headers).get_json()
+        again = post_video(client, headers)
+        assert again.status_code == 202
+        assert again.get_json()['job_id'] == first['job_id']
+        assert len(jobs.queued) == 1
+
+    def test_completed_job_answers_200(self, client, jobs, monkeypatch):
+        headers = senior_headers()
+        face_video(monkeypatch)
+        first = post_video(client, headers).get_json()
+        jobs.run_all()
+
+        again = post_video(client, headers)
+        assert again.status_code == 200
+        assert again.get_json()['job_id'] == first['job_id']
+        assert again.get_json()['message'] == "This video is already registered"
+        assert jobs.queued == []
+
+    def test_superseded_job_is_run_again(self, client, jobs, monkeypatch):
+        headers = senior_headers()
+        face_video(monkeypatch)
+        first = post_video(client, headers, b'video-1').get_json()
+        jobs.run_all()
+        post_video(client, headers, b'video-2')
+        jobs.run_all()
+
+        again = post_video(client, headers, b'video-1')
+        assert again.status_code == 202
+        assert again.get_json()['job_id'] != first['job_id']
+        assert len(jobs.queued) == 1
@@ -335,6 +335,49 @@ class TestVitalLogsAPI:
 
 
 
+    def add_alerting_heart_rate(self, client, app, db_user, suffix):
+        """Log a heart rate above the threshold for a senior with one alerting contact"""
+        senior_id, senior_token = self.create_senior_profile(client, app, db_user, suffix)
+        from app.models import EmergencyContacts, db
+        db.session.add(EmergencyContacts(sen_id=senior_id, name="Kin", email="kin@example.com", send_alert=True))
+        db.session.commit()
+
+        resp = self.make_authenticated_request(client, '''
+            mutation {
+                addVitalLog(vitalTypeId: 2, reading: "150") {
+                    status
+                    message
+                }
+            }
+        ''', senior_token)
+        return self.safe_get_data(resp, "addVitalLog")["addVitalLog"]
+
+    def test_add_vital_log_queues_threshold_alert(self, client, app, db_user):
+        """A reading outside the threshold queues an urgent email with the log"""
+        from app.models import EmailOutbox, VitalLogs
+        result = self.add_alerting_heart_rate(client, app, db_user, "705")
+        assert result["status"] == 201
+        assert VitalLogs.query.count() == 1
+        email = EmailOutbox.query.one()
+        assert (email.recipients, email.priority) == (["kin@example.com"], 0)
+
+    def test_failed_threshold_alert_keeps_the_log(self, client, app, db_user, monkeypatch):
+        """A failing outbox INSERT only loses the alert, not the vital log"""
+        from app.graphql import vital_logs
+        from app.models import EmailOutbox, VitalLogs, db
+
+        def broken_queue_email(**email):
+            db.session.add(EmailOutbox(subject=None, recipients=None, template=None))  # NOT NULL violation
+            db.session.flush()
+        monkeypatch.setattr(vital_logs, "queue_email", broken_queue_email)
+
+        result = self.add_alerting_heart_rate(client, app, db_user, "706")
+        assert result["status"] == 201
+        assert VitalLogs.query.count() == 1
+        assert EmailOutbox.query.count() == 0
+
+
+
     def test_add_vital_log_various_readings(self, client, app, db_user):
         """Test adding vital logs with various reading formats"""
         senior_id, senior_token = self.create_senior_profile(client, app, db_user, "703")